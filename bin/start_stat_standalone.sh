@@ -21,6 +21,7 @@ nohup python /opt/stat/python3/lib/python3.11/site-packages/trac/ticket/slack_pr
 exec tracd \
      --basic-auth system,/opt/stat/.htpasswd,trac \
      -s -p 8123 \
+     --processes 4 --threads 8 \
      --user jainnikh --group jainnikh \
      /opt/stat/system/ \
      -b localhost
@@ -1137,6 +1137,30 @@ Field.prototype.val = function () {
 // Page data was provided by the IRequestFilter request post-processing.
 var page_info = window.kis2_page_info;
 
+// Fetches the trac.ini rules for the ticket's status, unless they were
+// embedded in the page. The response is cached by the browser until the
+// configuration changes.
+var load_config = function () {
+    if (page_info['trac_ini'] !== undefined) {
+        return Promise.resolve();
+    }
+    return new Promise(function (resolve, reject) {
+        $.ajax(page_info['config_url'], {
+            dataType: 'json',
+            cache: true,
+            error: function (jqXHR, textStatus, errorThrown) {
+                console.log('Failed to load configuration: ' + errorThrown);
+                reject({ error: errorThrown });
+            },
+            success: function (result) {
+                page_info['trac_ini'] = result;
+                resolve();
+            },
+            timeout: 10000
+        });
+    });
+};
+
 // This function is called at the time the page is initially loaded, but also
 // following a preview rendering. This is needed to hide fields in the preview
 // ticket box.
@@ -1181,6 +1205,7 @@ var hook_autoSubmit = function () {
 return {
     ev: evaluate,
     ui: ui,
+    load_config: load_config,
     update_fields: update_fields,
     hook_autoSubmit: hook_autoSubmit
 };
@@ -1207,5 +1232,5 @@ if (window.Promise.prototype.caught === undefined) {
 // This function is called when the page has loaded. It initialises the fields.
 $(function () {
     kis2.hook_autoSubmit();
-    kis2.update_fields();
+    kis2.load_config().then(kis2.update_fields);
 });
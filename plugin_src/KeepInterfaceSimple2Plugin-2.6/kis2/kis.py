@@ -10,22 +10,34 @@
 # you should have received as part of this distribution.
 
 import json
+import operator
+import os
 import re
+import time
+from datetime import datetime
 
 from pkg_resources import resource_filename
 
 from trac.core import *
 from trac.config import ConfigurationError
+from trac.db.api import DatabaseManager
+from trac.env import IEnvironmentSetupParticipant
+from trac.perm import PermissionSystem
 from trac.ticket import ITicketManipulator
 from trac.ticket import TicketSystem
 from trac.ticket.model import Ticket
-from trac.web.api import IRequestFilter, \
+from trac.util.datefmt import utc
+from trac.web.api import HTTPNotFound, \
+                         IRequestFilter, \
                          IRequestHandler, \
                          RequestDone
 from trac.web.chrome import add_script, add_script_data, ITemplateProvider
 
 #from genshi.filters.transform import Transformer
 
+db_version_name = 'kis2_version'
+db_version = 1
+
 ###############################################################################
 
 class IConfigFunction(Interface):
@@ -78,34 +90,27 @@ The 'req' parameter is the HTTP request object; the remaining parameters are the
         except ValueError:
             return False
 
-        for child, parent in self.env.db_query(
-                'SELECT ticket, value FROM ticket_custom WHERE name="parent"'):
-            parent_match = re.match('#(\d+)', parent or '')
-            if parent_match:
-                parent_id = int(parent_match.group(1))
-                if parent_id == this_ticket_id:
-                    child_ticket = Ticket(self.env, int(child))
-                    if child_ticket['status'] != 'closed':
-                        return True
+        # The 'parent' field starts with '#<n>', possibly followed by
+        # other text (e.g. '#12, #13'), so the prefix selects candidates
+        # which are then matched like before.
+        parent = '#%d' % this_ticket_id
+        with self.env.db_query as db:
+            for value, in db("""
+                    SELECT c.value FROM ticket_custom AS c
+                    INNER JOIN ticket AS t ON t.id = c.ticket
+                    WHERE c.name = 'parent' AND t.status != 'closed'
+                    AND (c.value = %%s OR c.value %s)
+                    """ % db.like(), [parent, db.like_escape(parent) + '%']):
+                parent_match = re.match(r'#(\d+)', value)
+                if parent_match and \
+                        int(parent_match.group(1)) == this_ticket_id:
+                    return True
         return False
 
     def has_role(self, req, *args):
         # Returns whether a user is a member of a permissions group.
         # If there is only one argument, the current user is assumed.
         # The optional second argument specifies a particular user.
-        def expand(group, expanded=set()):
-            expanded.add(group)
-            with self.env.db_query as db:
-                for username in db('SELECT DISTINCT username FROM permission '
-                                   'WHERE action = %s', [group]):
-                    if db('SELECT COUNT(*) FROM permission '
-                          'WHERE action = %s', [username[0]])[0][0]:
-                        if username[0] not in expanded:
-                            for user in expand(username[0], expanded):
-                                yield user
-                    else:
-                        yield username[0]
-
         if len(args) < 1 or len(args) > 2:
             raise ConfigurationError('has_role() called with %s arguments' %
                 len(args))
@@ -113,8 +118,8 @@ The 'req' parameter is the HTTP request object; the remaining parameters are the
         if len(args) == 2:
             user = args[1]
         else:
-            user = req.authname.encode('utf-8')
-        return user in expand(role)
+            user = req.authname
+        return user in KisIndex(self.env).role_members(role)
 
     def is_parent(self, req, *args):
         # Returns True if another ticket has a field named 'parent' that
@@ -153,243 +158,287 @@ The 'req' parameter is the HTTP request object; the remaining parameters are the
 
 ###############################################################################
 
-class Lexer():
-    def __init__(self, symbol_table, config_functions, req):
-        # Initialise state required for lexer.
-        self.symbol_table = symbol_table
-        self.config_functions = config_functions
-        self.req = req
-        self.look = ['', '']
+class KisIndex(Component):
+    """ Keeps the lookups behind the built-in functions cheap: adds a
+        database index on `ticket_custom(name, value)` for `child_open()` and
+        `is_parent()`, and caches the permission group closure for
+        `has_role()`.
+    """
+    implements(IEnvironmentSetupParticipant)
 
-    # 'tokeniser' looks for tokens at the start of 'x' and returns with the
-    # token text placed into 'token', and the token type into 'token_type'.
-    # There are four types of token, each indicated with a single character:
-    #
-    #    - N - means that the text in 'token' identifies a Number;
-    #    - F - means that the text in 'token' identifies a Field;
-    #    - O - means that the text in 'token' is an Operator;
-    #    - S - means that the text in 'token' is a String.
+    def __init__(self):
+        self._permissions = None
+        self._role_members = {}
+
+    # IEnvironmentSetupParticipant methods
+    def environment_created(self):
+        self.upgrade_environment()
+
+    def environment_needs_upgrade(self):
+        return DatabaseManager(self.env).needs_upgrade(db_version,
+                                                       db_version_name)
+
+    def upgrade_environment(self):
+        dbm = DatabaseManager(self.env)
+        # MySQL can only index a prefix of a text column.
+        value = 'value(255)' if dbm.connection_uri.startswith('mysql:') \
+                else 'value'
+        with self.env.db_transaction as db:
+            db("CREATE INDEX ticket_custom_name_value_idx "
+               "ON ticket_custom (name, %s)" % value)
+        dbm.set_database_version(db_version, db_version_name)
+
+    def role_members(self, role):
+        ''' Returns the users that are members of the permissions group
+            'role', directly or through other groups. The result is cached
+            until the permissions change.
+        '''
+        # The default permission store returns its cached list of
+        # permissions, which is replaced whenever a permission is granted
+        # or revoked.
+        permissions = PermissionSystem(self.env).get_all_permissions()
+        if permissions is not self._permissions:
+            self._role_members = {}
+            self._permissions = permissions
+        members = self._role_members.get(role)
+        if members is None:
+            subjects = {}
+            for username, action in permissions:
+                subjects.setdefault(action, set()).add(username)
+            members = set()
+            expanded = set()
+            pending = [role]
+            while pending:
+                group = pending.pop()
+                expanded.add(group)
+                for username in subjects.get(group, ()):
+                    if username in subjects:
+                        # A group with members of its own.
+                        if username not in expanded:
+                            pending.append(username)
+                    else:
+                        members.add(username)
+            members = self._role_members[role] = frozenset(members)
+        return members
 
-    def tokeniser(self, x):
-        # Ignoring whitespace, split x on numbers,
-        # on words,
-        # on tokens ',', '||', '(', ')', '&&', '!', '==', '!=', '~=' or 'in',
-        # or on strings delimited by single quotes.
+###############################################################################
+
+# Tokens, ignoring trailing whitespace: numbers, words, operators ',', '||',
+# '(', ')', '&&', '!', '==', '!=', '~=' (and arithmetic and comparison
+# operators), or strings delimited by single quotes. The word 'in' is lexed
+# as a word and recognised as an operator by the parser.
+_token_re = re.compile(r"(?:(?P<N>[0-9]+(?:\.[0-9]+)?)"
+                       r"|(?P<F>[A-Za-z_]\w*)"
+                       r"|(?P<O>,|\|\||\(|\)|&&|==|!=|~=|!|\+|-|\*|/|"
+                       r"<=|>=|<|>|\?|:)"
+                       r"|'(?P<S>[^']*)') *")
+
+_operators = {
+    '*': operator.mul, '/': operator.truediv,
+    '+': operator.add, '-': operator.sub,
+    '<': operator.lt, '>': operator.gt, '<=': operator.le, '>=': operator.ge,
+    '==': operator.eq, '!=': operator.ne,
+}
+
+
+def tokenise(predicate):
+    """ Split 'predicate' into a list of (token_type, token) pairs, ending
+        with (None, ''). There are four types of token, each indicated with a
+        single character:
+
+           - N - means that the text in 'token' identifies a Number;
+           - F - means that the text in 'token' identifies a Field;
+           - O - means that the text in 'token' is an Operator;
+           - S - means that the text in 'token' is a String.
+
+        Unrecognised text is returned as a token of type None.
+    """
+    tokens = []
+    pos = 0
+    while pos < len(predicate):
+        m = _token_re.match(predicate, pos)
+        if not m:
+            tokens.append((None, predicate[pos:]))
+            break
+        tokens.append((m.lastgroup, m.group(m.lastgroup)))
+        pos = m.end()
+    tokens.append((None, ''))
+    return tokens
 
-        m = re.search('^([0-9]+(?:\.[0-9]+)?) *(.*)', x)
-        if m:
-            return 'N', m.group(1), m.group(2)
 
-        m = re.search('^([A-Za-z_]\w*) *(.*)', x)
-        if m:
-            return 'F', m.group(1), m.group(2)
+class Compiler(object):
+    """ Recursive descent parser turning a predicate into a closure.
 
-        m = re.search('^(,|\|\||\(|\)|&&|==|!=|~=|in|!|'
-                      '\+|-|\*|\/|<|>|<=|>=|\?|:) *(.*)', x)
-        if m:
-            return 'O', m.group(1), m.group(2)
+        The closure is called as 'rule(symbol_table, req)' and returns the
+        value of the predicate. Predicates are parsed once, so evaluating a
+        rule costs no more than the field lookups and function calls it
+        contains.
+    """
 
-        m = re.search("^'([^']*)' *(.*)", x)
-        if m:
-            return 'S', m.group(1), m.group(2)
+    def __init__(self, config_functions):
+        self.config_functions = config_functions
 
-        if not x:
-            return None, '', 'EOF'
+    def compile(self, predicate):
+        self.tokens = tokenise(predicate)
+        self.pos = 0
+        return self.expression()
 
-        return None, x, ''
+    @property
+    def look(self):
+        return self.tokens[self.pos]
 
     def match(self, m):
         if self.look[1] == m:
-            self.look[0], self.look[1], self.rest = self.tokeniser(self.rest)
+            self.pos = min(self.pos + 1, len(self.tokens) - 1)
         else:
             raise ConfigurationError('Syntax error: %s; expected %s' %
                                      (self.look[1], m))
 
+    def function(self, name):
+        for provider in self.config_functions:
+            funcs = provider.__class__.__dict__
+            if name in funcs:
+                return funcs[name].__get__(provider)
+        raise ConfigurationError(
+            "Function '%s' has no implementation" % name,
+             title='Missing plugin or error in trac.ini [kis2_warden]',
+             show_traceback=True)
+
     def term(self):
-        if self.look[0] == 'N':
-            v = float(self.look[1])
-            self.match(self.look[1])
-            text = '%s' % v
-        elif self.look[0] == 'S':
-            v = self.look[1]
-            self.match(v)
-            text = "'%s'" % v
-        elif self.look[1] == '(':
+        token_type, text = self.look
+        if token_type == 'N':
+            self.match(text)
+            v = float(text)
+            return lambda symbols, req: v
+        if token_type == 'S':
+            self.match(text)
+            return lambda symbols, req: text
+        if text == '(':
             self.match('(')
-            v, text = self.expression()
+            f = self.expression()
             self.match(')')
-            text = '(%s)' % text
-        elif self.look[0] == 'F':
-            text = self.look[1]
+            return f
+        if token_type == 'F':
             self.match(text)
             if self.look[1] == '(':
                 # Function call.
                 self.match('(')
-                args, text2 = self.param_list()
+                params = self.param_list()
                 self.match(')')
-                v = None
-                for provider in self.config_functions:
-                    funcs = provider.__class__.__dict__
-                    if text in funcs:
-                        v = funcs[text].__get__(provider)(self.req, *args)
-                        break
-                else:
-                    raise ConfigurationError(
-                        "Function '%s' has no implementation" % text,
-                         title='Missing plugin or error in trac.ini '
-                               '[kis2_warden]',
-                         show_traceback=True)
-                text = '%s(%s)' % (text, text2)
-            else:
-                v = self.symbol_table[text]
-                if v == None and not text.startswith('_'):
+                func = self.function(text)
+                return lambda symbols, req: \
+                    func(req, *[p(symbols, req) for p in params])
+
+            def field(symbols, req):
+                v = symbols[text]
+                if v is None and not text.startswith('_'):
                     raise ConfigurationError(
                         "No field named '%s' is defined" % text,
                         title='Error in trac.ini [kis2_warden]')
-        else:
-            raise ConfigurationError(
-                'Unrecognised token: %s' % self.look[1],
-                title='Syntax error in trac.ini [kis2_warden]')
-        return v, text
+                return v
+            return field
+        raise ConfigurationError(
+            'Unrecognised token: %s' % text,
+            title='Syntax error in trac.ini [kis2_warden]')
 
     def membership(self):
-        v, text = self.term()
+        f = self.term()
         if self.look[1] == 'in':
             self.match('in')
-            i, text2 = self.cmp_list()
-            v = v in i
-            text = '%s in %s' % (text, text2)
-        return v, text
+            items = self.cmp_list()
+            return lambda symbols, req: \
+                f(symbols, req) in [i(symbols, req) for i in items]
+        return f
 
     def param_list(self):
         if self.look[1] == ')':
-            v_list = []
-            text = ''
-        else:
-            t, text = self.expression()
-            v_list = [t]
-            if self.look[1] == ',':
-                self.match(',')
-                p_list, text2 = self.param_list()
-                v_list = v_list + p_list
-                text = '%s, %s' % (text, text2)
-        return v_list, text
+            return []
+        params = [self.expression()]
+        if self.look[1] == ',':
+            self.match(',')
+            params += self.param_list()
+        return params
 
     def cmp_list(self):
         if self.look[1] == '(':
             self.match('(')
-            v_list, text = self.cmp_list()
+            items = self.cmp_list()
             self.match(')')
-            text = '(%s)' % text
-        else:
-            v, text = self.expression()
-            v_list = [v]
-            if self.look[1] == ',':
-                self.match(',')
-                c_list, text2 = self.cmp_list()
-                v_list = v_list + c_list
-                text = '%s, %s' % (text, text2)
-        return v_list, text
+            return items
+        items = [self.expression()]
+        if self.look[1] == ',':
+            self.match(',')
+            items += self.cmp_list()
+        return items
 
     def negation(self):
         if self.look[1] == '-':
             self.match('-')
-            v, text = self.negation()
-            v = -v
-            text = '-%s' % text
-        elif self.look[1] == '!':
+            f = self.negation()
+            return lambda symbols, req: -f(symbols, req)
+        if self.look[1] == '!':
             self.match('!')
-            v, text = self.negation()
-            v = not v
-            text = '!%s' % text
-        else:
-            v, text = self.membership()
-        return v, text
+            f = self.negation()
+            return lambda symbols, req: not f(symbols, req)
+        return self.membership()
+
+    def binary(self, operand, operators, right):
+        # Operators are right associative, as they always have been.
+        f = operand()
+        op = self.look[1]
+        if op not in operators:
+            return f
+        self.match(op)
+        e = right()
+        if op == '~=':
+            return lambda symbols, req: \
+                bool(re.search(e(symbols, req), f(symbols, req)))
+        func = _operators[op]
+        return lambda symbols, req: func(f(symbols, req), e(symbols, req))
 
     def product(self):
-        v, text = self.negation()
-        if self.look[1] in ('*', '/'):
-            op = self.look[1]
-            self.match(op)
-            e, text2 = self.product()
-            v = eval('v %s e' % op)
-            text = '%s %s %s' % (text, op, text2)
-        return v, text
+        return self.binary(self.negation, ('*', '/'), self.product)
 
     def sum(self):
-        v, text = self.product()
-        if self.look[1] in ('+', '-'):
-            op = self.look[1]
-            self.match(op)
-            e, text2 = self.sum()
-            v = eval('v %s e' % op)
-            text = '%s %s %s' % (text, op, text2)
-        return v, text
+        return self.binary(self.product, ('+', '-'), self.sum)
 
     def comparison(self):
-        v, text = self.sum()
-        if self.look[1] in ('<', '>', '<=', '>='):
-            op = self.look[1]
-            self.match(op)
-            e, text2 = self.comparison()
-            v = eval('v %s e' % op)
-            text = '%s %s %s' % (text, op, text2)
-        return v, text
+        return self.binary(self.sum, ('<', '>', '<=', '>='), self.comparison)
 
     def equality(self):
-        v, text = self.comparison()
-        if self.look[1] in ('==', '!=', '~='):
-            op = self.look[1]
-            self.match(op)
-            e, text2 = self.equality()
-            if op == '==' or op == '!=':
-                v = eval('v %s e' % op)
-            elif op == '~=':
-                v = bool(re.search(e, v))
-            text = '%s %s %s' % (text, op, text2)
-        return v, text
+        return self.binary(self.comparison, ('==', '!=', '~='), self.equality)
 
     def and_expression(self):
-        v, text = self.equality()
+        f = self.equality()
         if self.look[1] == '&&':
             self.match('&&')
-            e, text2 = self.and_expression()
-            v = v and e
-            text = '%s && %s' % (text, text2)
-        return v, text
+            e = self.and_expression()
+            return lambda symbols, req: f(symbols, req) and e(symbols, req)
+        return f
 
     def or_expression(self):
-        v, text = self.and_expression()
+        f = self.and_expression()
         if self.look[1] == '||':
             self.match('||')
-            e, text2 = self.or_expression()
-            v = v or e
-            text = '%s || %s' % (text, text2)
-        return v, text
+            e = self.or_expression()
+            return lambda symbols, req: f(symbols, req) or e(symbols, req)
+        return f
 
     def expression(self):
-        v, text = self.or_expression()
+        f = self.or_expression()
         if self.look[1] == '?':
             self.match('?')
-            v_t, text_t= self.expression()
+            f_t = self.expression()
             if self.look[1] != ':':
                 raise ConfigurationError(
                     'Unexpected terminal: %s' % self.look[1],
                      title='Syntax error in trac.ini [kis2_warden]',
                      show_traceback=True)
-            else:
-                self.match(':')
-                v_f, text_f= self.expression()
-            if v:
-                v = v_t
-            else:
-                v = v_f
-            text = '%s ? %s : %s' % (text, text_t, text_f)
-        return v, text
-
-    def evaluate(self, predicate):
-        self.look[0], self.look[1], self.rest = self.tokeniser(predicate)
-        return self.expression()
+            self.match(':')
+            f_f = self.expression()
+            return lambda symbols, req: \
+                f_t(symbols, req) if f(symbols, req) else f_f(symbols, req)
+        return f
 
 class KisWarden(Component):
     '''
@@ -425,6 +474,13 @@ only designated approver can approve = !has_role('approver') && approval != _app
 
     config_functions = ExtensionPoint(IConfigFunction)
 
+    def __init__(self):
+        super(KisWarden, self).__init__()
+        self._rules = None
+        self._rule_items = None
+        # Cumulative evaluation count and time in seconds, by rule name.
+        self.timings = {}
+
     # ITicketManipulator methods
     def prepare_ticket(self, req, ticket, fields, actions):
         """ Not currently called, but should be provided for future
@@ -436,103 +492,129 @@ only designated approver can approve = !has_role('approver') && approval != _app
         """ Make sure required conditions for the next state the ticket will
             be in have been met.
         """
-
-        class Symbol_Table(object):
-            def __init__(self, env, req, ticket):
-                self.env = env
-                self.req = req
-                self.ticket = ticket
-
-            def _get_action_controllers(self, action):
-                ''' Function modified from 'ticketvalidatorplugin',
-                    copyright (C) 2008 Max Stewart <max.e.stewart@gmail.com>
-                    and licensed under 3-clause BSD licence.
-                '''
-                for controller in TicketSystem(self.env).action_controllers:
-                    actions = [action for weight, action in
-                               controller.get_ticket_actions(self.req,
-                                                             self.ticket)]
-                    if action in actions:
-                        yield controller
-
-            def _get_next_state(self):
-                ''' Get the state this ticket is going to be in.
-                    Function modified from 'ticketvalidatorplugin',
-                    copyright (C) 2008 Max Stewart <max.e.stewart@gmail.com>
-                    and licensed under 3-clause BSD licence.
-                '''
-                if 'action' not in self.req.args:
-                    return ''
-
-                action = self.req.args['action']
-                action_changes = {}
-
-                for controller in \
-                        self._get_action_controllers(action):
-                    action_changes.update(
-                        controller.get_ticket_changes(self.req,
-                                                      self.ticket,
-                                                      action))
-
-                return 'status' in action_changes and \
-                    action_changes['status'] or self.ticket['status']
-
-            def __getitem__(self, key):
-                ''' Look up the value of a field. The field name 'authname' is
-                    a special case, returning the name of the user attempting
-                    the transition.
-                    If the field name is prefixed by '_', this indicates that
-                    the original value of a field that is being changed in the
-                    current transition should be provided.
-                '''
-
-                def __empty_string_if_field_exists__(key):
-                    existing_fields = TicketSystem(self.env).get_ticket_fields()
-                    if any(x['name'] == key for x in existing_fields):
-                        return ''
-                    return None
-
-                value = None
-                if key == 'authname':
-                    value = self.req.authname
-                elif key == 'true':
-                    value = True
-                elif key == 'false':
-                    value = False
-                elif key.startswith('_'):
-                    key = key[1:]
-                    if key in self.ticket._old:
-                        # _old only has values for fields that are changing.
-                        value = self.ticket._old[key] or ''
-                elif key == 'status':
-                    # This is handled specially, as there may be action
-                    # controllers that change or restrict the next status.
-                    value = self._get_next_state()
-
-                # Return empty string for fields that exist but have no
-                # valid (default) value.
-                if value is None:
-                    value = self.ticket.get_value_or_default(key)
-                if value is None:
-                    value = __empty_string_if_field_exists__(key)
-                return value
-
-        symbol_table = Symbol_Table(self.env, req, ticket)
-        lexer = Lexer(symbol_table, self.config_functions, req)
+        symbol_table = SymbolTable(self.env, req, ticket)
         errors = []
+        start = time.time()
+        slowest = None
+        for rule, predicate, compiled in self.rules:
+            rule_start = time.time()
+            if compiled(symbol_table, req):
+                errors.append((None, "%s (%s)" % (rule, predicate)))
+            elapsed = time.time() - rule_start
+            timing = self.timings.setdefault(rule, [0, 0.0])
+            timing[0] += 1
+            timing[1] += elapsed
+            if slowest is None or elapsed > slowest[1]:
+                slowest = rule, elapsed
+        if slowest:
+            self.log.debug("KisWarden: evaluated %d rules in %.1f ms, "
+                           "slowest '%s' took %.1f ms", len(self.rules),
+                           (time.time() - start) * 1000, slowest[0],
+                           slowest[1] * 1000)
+        return errors
 
-        warden_rules = self.config.options('kis2_warden')
+    @property
+    def rules(self):
+        """ The warden rules as a list of (name, predicate, compiled) tuples.
+            The rules are compiled again only when the configuration changes.
+        """
+        items = self.config.options('kis2_warden')
         for test_value in self.config.options('kis2_warden'):
             break
         else:
             # No rules defined under 'kis2_warden'; try 'kis_warden'.
-            warden_rules = self.config.options('kis_warden')
+            items = self.config.options('kis_warden')
+        items = tuple(items)
+        if items != self._rule_items:
+            compiler = Compiler(self.config_functions)
+            self._rules = [(rule, predicate, compiler.compile(predicate))
+                           for rule, predicate in items]
+            self._rule_items = items
+            self.timings = {}
+        return self._rules
+
+
+class SymbolTable(object):
+    """ Field values of a ticket being validated by 'KisWarden'. The next
+        status and the field metadata are looked up once per request.
+    """
 
-        for rule, predicate in warden_rules:
-            e, text = lexer.evaluate(predicate)
-            if e:
-                errors.append((None, "%s (%s)" % (rule, predicate)))
-        return errors
+    def __init__(self, env, req, ticket):
+        self.env = env
+        self.req = req
+        self.ticket = ticket
+        self._next_state = None
+
+    def _get_action_controllers(self, action):
+        ''' Function modified from 'ticketvalidatorplugin',
+            copyright (C) 2008 Max Stewart <max.e.stewart@gmail.com>
+            and licensed under 3-clause BSD licence.
+        '''
+        for controller in TicketSystem(self.env).action_controllers:
+            actions = [action for weight, action in
+                       controller.get_ticket_actions(self.req,
+                                                     self.ticket)]
+            if action in actions:
+                yield controller
+
+    def _get_next_state(self):
+        ''' Get the state this ticket is going to be in.
+            Function modified from 'ticketvalidatorplugin',
+            copyright (C) 2008 Max Stewart <max.e.stewart@gmail.com>
+            and licensed under 3-clause BSD licence.
+        '''
+        if self._next_state is not None:
+            return self._next_state
+        if 'action' not in self.req.args:
+            self._next_state = ''
+            return ''
+
+        action = self.req.args['action']
+        action_changes = {}
+
+        for controller in \
+                self._get_action_controllers(action):
+            action_changes.update(
+                controller.get_ticket_changes(self.req,
+                                              self.ticket,
+                                              action))
+
+        self._next_state = 'status' in action_changes and \
+            action_changes['status'] or self.ticket['status']
+        return self._next_state
+
+    def __getitem__(self, key):
+        ''' Look up the value of a field. The field name 'authname' is
+            a special case, returning the name of the user attempting
+            the transition.
+            If the field name is prefixed by '_', this indicates that
+            the original value of a field that is being changed in the
+            current transition should be provided.
+        '''
+        value = None
+        if key == 'authname':
+            value = self.req.authname
+        elif key == 'true':
+            value = True
+        elif key == 'false':
+            value = False
+        elif key.startswith('_'):
+            key = key[1:]
+            if key in self.ticket._old:
+                # _old only has values for fields that are changing.
+                value = self.ticket._old[key] or ''
+        elif key == 'status':
+            # This is handled specially, as there may be action
+            # controllers that change or restrict the next status.
+            value = self._get_next_state()
+
+        # Return empty string for fields that exist but have no
+        # valid (default) value.
+        if value is None:
+            value = self.ticket.get_value_or_default(key)
+        if value is None and self.ticket.fields.by_name(key) is not None:
+            value = ''
+        return value
 
 ###############################################################################
 
@@ -738,9 +820,20 @@ evaluation.available.none = evaluation_template == 'None'
 
     config_functions = ExtensionPoint(IConfigFunction)
 
+    # Predicates of these attributes are evaluated for their truth value
+    # only, so they can be folded into 'true' or 'false' when they depend
+    # on nothing but the ticket status.
+    _foldable_attributes = ('visible', 'available', 'when')
+    _foldable_tokens = set(['status', 'true', 'false', 'in', '(', ')', '!',
+                            '&&', '||', '==', '!=', ','])
+
     def __init__(self):
         super(KisAssistant, self).__init__()
+        self._config_version = None
+        self._payloads = {}
+        self._load_config()
 
+    def _load_config(self):
         # Construct an object representing the configuration, to be passed to
         # the client-side script.
         items = self.config.options('kis2_assistant')
@@ -761,6 +854,63 @@ evaluation.available.none = evaluation_template == 'None'
             config_traverse['#'] = \
                 re.sub("\s*,\s*", ",", value.strip()).split(",")
 
+    @property
+    def config_version(self):
+        """ Version of the client-side configuration, derived from the
+            modification time of trac.ini.
+        """
+        try:
+            mtime = os.path.getmtime(self.config.filename)
+        except (OSError, TypeError):
+            mtime = 0
+        version = '%x' % int(mtime * 1000)
+        if version != self._config_version:
+            self._load_config()
+            self._payloads = {}
+            self._config_version = version
+        return version
+
+    def get_config_payload(self, status):
+        """ Returns the client-side configuration for tickets in 'status' as
+            JSON. Predicates depending on nothing but the status are
+            evaluated on the server. 'status' must be a status of the
+            workflow, or empty for a new ticket.
+        """
+        self.config_version
+        payload = self._payloads.get(status)
+        if payload is None:
+            config = self._fold_config(self.kis_config, status, None)
+            payload = json.dumps(config).encode('utf-8')
+            self._payloads[status] = payload
+        return payload
+
+    def _fold_config(self, node, status, attribute):
+        folded = {}
+        for key, value in node.items():
+            if key == '#':
+                if attribute in self._foldable_attributes:
+                    value = self._fold_predicate(', '.join(value), status) \
+                            or value
+                folded[key] = value
+            else:
+                folded[key] = self._fold_config(value, status,
+                                                key if key in
+                                                self._foldable_attributes
+                                                else attribute)
+        return folded
+
+    def _fold_predicate(self, predicate, status):
+        # Only fold predicates for which Python and Javascript agree.
+        for token_type, token in tokenise(predicate)[:-1]:
+            if token_type != 'S' and token not in self._foldable_tokens:
+                return None
+        symbols = {'status': status, 'true': True, 'false': False}
+        try:
+            value = Compiler([]).compile(predicate)(symbols, None)
+        except ConfigurationError:
+            return None
+        return ['true' if value else 'false']
+
     # ITemplateProvider methods
     def get_htdocs_dirs(self):
 #        return [('kis2', resource_filename(__name__, 'htdocs'))]
@@ -776,17 +926,26 @@ evaluation.available.none = evaluation_template == 'None'
     def post_process_request(self, req, template, data, content_type):
         if req.path_info.startswith('/newticket') or \
                 req.path_info.startswith('/ticket/'):
-            if 'id' in req.args:
+            # Use the ticket being rendered rather than loading it again.
+            ticket = data.get('ticket') if data else None
+            if ticket is not None and ticket.exists:
+                ticket_id = str(ticket.id)
+                status = ticket.get_value_or_default('status')
+            elif 'id' in req.args:
                 ticket_id = req.args['id'].lstrip('#')
                 ticket = Ticket(self.env, ticket_id)
                 status = ticket.get_value_or_default('status')
             else:
                 ticket_id = None
                 status = ''
-            page_data = { 'trac_ini' : self.kis_config,
-                          'status'   : status,
-                          'id'       : ticket_id,
-                          'authname' : req.authname }
+            # The rules are fetched separately, so that browsers can cache
+            # them until trac.ini changes.
+            config_url = req.href('2kis_config', self.config_version,
+                                  status=status)
+            page_data = { 'config_url' : config_url,
+                          'status'     : status,
+                          'id'         : ticket_id,
+                          'authname'   : req.authname }
             add_script_data(req, {'kis2_page_info' : page_data})
 
             # Add the client-side support functions.
@@ -801,10 +960,16 @@ evaluation.available.none = evaluation_template == 'None'
         return template, data, content_type
 
     # IRequestHandler
+    def get_request_routes(self):
+        return [re.compile(r'.*/2kis_function$'), '/2kis_config']
+
     def match_request(self, req):
-        return req.path_info.endswith('/2kis_function')
+        return req.path_info.endswith('/2kis_function') or \
+               req.path_info.startswith('/2kis_config/')
 
     def process_request(self, req):
+        if req.path_info.startswith('/2kis_config/'):
+            self._send_config(req)
         if req.args['op'] == 'call_function':
             args = req.args.get('args[]')
             if type(args) == type(None):
@@ -825,3 +990,26 @@ evaluation.available.none = evaluation_template == 'None'
                      title='Missing plugin or error in trac.ini '
                            '[kis2_assistant]',
                      show_traceback=True)
+
+    def _send_config(self, req):
+        req.perm.require('TICKET_VIEW')
+        status = req.args.get('status', '')
+        # The payloads are cached by status, which is sent by the client.
+        if status and status not in TicketSystem(self.env).get_all_status():
+            raise HTTPNotFound("Unknown ticket status '%s'" % status)
+        version = self.config_version
+        payload = self.get_config_payload(status)
+        mtime = datetime.fromtimestamp(int(version, 16) / 1000.0, utc)
+        req.check_modified(mtime, status)
+        req.send_response(200)
+        req.send_header('Content-Type', 'application/json')
+        req.send_header('Content-Length', len(payload))
+        if req.path_info == '/2kis_config/' + version:
+            # The URL changes with the configuration.
+            req.send_header('Cache-Control', 'private, max-age=31536000')
+        else:
+            req.send_header('Cache-Control', 'private, no-cache')
+        req.end_headers()
+        if req.method != 'HEAD':
+            req.write(payload)
+        raise RequestDone
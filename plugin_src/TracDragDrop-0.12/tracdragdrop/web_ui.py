@@ -213,6 +213,10 @@ class TracDragDropModule(Component):
 
         return stream
 
+    # IRequestHandler#get_request_routes
+    def get_request_routes(self):
+        return ['/tracdragdrop']
+
     # IRequestHandler#match_request
     def match_request(self, req):
         match = re.match(r'/tracdragdrop/([^/]+)/([^/]+)/(.*)\Z', req.path_info)
@@ -26,6 +26,7 @@
     @version 0.11.4
 """
 
+import threading
 from functools import partial
 from pkg_resources import resource_filename
 try:
@@ -47,6 +48,7 @@ from trac.web.chrome import add_stylesheet, ITemplateProvider, add_warning, web_
 from trac.wiki.api import WikiSystem
 from trac.wiki.formatter import format_to_html, format_to_oneliner, Formatter, system_message
 from trac.wiki.macros import WikiMacroBase
+from trac.wiki.rendercache import RenderCache
 
 
 WARNING = tag('Error importing Python Markdown, install it from ',
@@ -105,6 +107,9 @@ class MarkdownFormatter(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/markup_render']
+
     def match_request(self, req):
         # We don't have to check the request here because Trac is
         # calling process_request() directly from the returned handler
@@ -146,6 +151,12 @@ class MarkdownFormatter(Component):
     def post_process_request(self, req, template, data, content_type):
 
         def wiki_to_html(self, context, wikidom, escape_newlines=None):
+            render_cache = self.env[RenderCache]
+            if render_cache:
+                return render_cache.render(
+                    'markdown', context, wikidom,
+                    lambda: format_to_markdown(self, context, wikidom),
+                    self.tab_length)
             return Markup(format_to_markdown(self, context, wikidom))
 
         if template and data and 'page' in data:
@@ -178,6 +189,34 @@ def format_to_markdown(self, context, content):
         else:
             return _sanitizer.sanitize(text)
 
+    # Macros and wiki processors may render Markdown again while the
+    # instance is in use, so each thread keeps a pool of idle instances.
+    pool = _markdown_pool(self.tab_length)
+    md = pool.pop() if pool else _create_markdown(self.tab_length)
+    try:
+        # Added for use with format_to_html() and format_to_oneliner()
+        md.trac_context = context
+        md.trac_env = self.env
+        return sanitize(md.reset().convert(content))
+    finally:
+        md.trac_context = md.trac_env = None
+        pool.append(md)
+
+
+_markdown_pools = threading.local()
+
+
+def _markdown_pool(tab_length):
+    """Return the list of idle `Markdown` instances of the current thread
+    for the given `tab_length`."""
+    try:
+        pools = _markdown_pools.pools
+    except AttributeError:
+        pools = _markdown_pools.pools = {}
+    return pools.setdefault(tab_length, [])
+
+
+def _create_markdown(tab_length):
     trac_link = TracLinkExtension()
     trac_macro = TracMacroExtension()
     trac_tkt = TracTicketExtension()
@@ -185,14 +224,10 @@ def format_to_markdown(self, context, content):
     wp_fence = WikiProcessorFenceExtension()
 
     md = Markdown(extensions=['extra', wiki_proc, trac_link, trac_macro, trac_tkt, wp_fence],
-                  tab_length=self.tab_length, output_format='html')
+                  tab_length=tab_length, output_format='html')
 
     md.treeprocessors.register(TracClassTreeprocessor(), 'trac_class', 30)
-
-    # Added for use with format_to_html() and format_to_oneliner()
-    md.trac_context = context
-    md.trac_env = self.env
-    return sanitize(md.convert(content))
+    return md
 
 
 class TracLinkInlineProcessor(InlineProcessor):
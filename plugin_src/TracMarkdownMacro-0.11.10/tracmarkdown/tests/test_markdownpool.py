@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Cinc
+#
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution.
+#
+import unittest
+from trac.test import EnvironmentStub, MockRequest
+from trac.web.chrome import web_context
+from tracmarkdown.macro import MarkdownMacro, _markdown_pool, \
+    format_to_markdown
+
+
+class TestMarkdownPool(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True, enable=['trac.*',
+                                                              'tracmarkdown.*'])
+        req = MockRequest(self.env)
+        self.context = web_context(req, 'wiki', 'WikiStart')
+        self.macro = MarkdownMacro(self.env)
+        del _markdown_pool(self.macro.tab_length)[:]
+
+    def render(self, content):
+        return format_to_markdown(self.macro, self.context, content)
+
+    def test_instance_reused(self):
+        self.render('Some *text*')
+        pool = _markdown_pool(self.macro.tab_length)
+        self.assertEqual(1, len(pool))
+        md = pool[0]
+        self.render('More *text*')
+        self.assertEqual([md], _markdown_pool(self.macro.tab_length))
+        self.assertIsNone(md.trac_context)
+
+    def test_state_reset(self):
+        self.assertIn('class="footnote"',
+                      self.render('Text[^1]\n\n[^1]: A footnote.'))
+        self.assertNotIn('footnote', self.render('Plain text'))
+
+    def test_nested_rendering(self):
+        markdown = """
+Outer *text*
+
+{{{#!Markdown
+Inner **text**
+}}}
+"""
+        html = self.render(markdown)
+        self.assertIn('<em>text</em>', html)
+        self.assertIn('<strong>text</strong>', html)
+        self.assertEqual(2, len(_markdown_pool(self.macro.tab_length)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,11 +8,17 @@ License: BSD
 
 import inspect
 import re
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from trac.config import IntOption
 from trac.core import (Component, ExtensionPoint, Interface, TracError,
                        implements)
-from trac.perm import IPermissionRequestor
+from trac.perm import IPermissionRequestor, PermissionError
+from trac.resource import ResourceNotFound
+from trac.util.text import exception_to_unicode, to_unicode
 
 from . import __version__
 from .util import basestring, getargspec, unicode, xmlrpclib
@@ -150,6 +156,12 @@ class IRPCProtocol(Interface):
                   `parse_rpc_request` can be accessed through
                   `req.rpc` (see above).
         result  : The value returned by the target RPC method
+
+        Protocols may also provide `send_rpc_result_stream(req, result)`,
+        called instead when the client asked for a streamed response
+        (`stream` key of the mapping returned by `parse_rpc_request`) and
+        the method returned a generator. `result` is then an iterator to
+        be serialized while it is consumed.
         """
 
     def send_rpc_error(req, rpcreq, e):
@@ -220,7 +232,9 @@ class Method(object):
         self.namespace = provider.xmlrpc_namespace()
         self.namespace_description = inspect.getdoc(provider)
 
-    def __call__(self, req, args):
+    def __call__(self, req, args, stream=False):
+        """Call the method. With `stream`, a generator result is returned
+        as is instead of being converted to a list."""
         if self.permission:
             req.perm.assert_permission(self.permission)
         result = self.callable(req, *args)
@@ -229,6 +243,8 @@ class Method(object):
             result = 0
         elif isinstance(result, dict):
             pass
+        elif stream and isinstance(result, types.GeneratorType):
+            pass
         elif not isinstance(result, basestring):
             # Try and convert result to a list
             try:
@@ -285,6 +301,37 @@ class XMLRPCSystem(Component):
 
     method_handlers = ExtensionPoint(IXMLRPCHandler)
 
+    multicall_workers = IntOption('tracrpc', 'multicall_workers', 4,
+        """Number of threads running the read-only calls of a
+        `system.multicallEx` request in `parallel` mode.""")
+
+    # Calls known not to modify anything, which may run concurrently.
+    # Calls of other methods, including those of other plugins, are
+    # assumed to write.
+    _read_only_methods = frozenset([
+        'search.getSearchFilters', 'search.performSearch',
+        'system.getAPIVersion', 'system.listMethods', 'system.methodHelp',
+        'system.methodSignature',
+        'ticket.changeLog', 'ticket.get', 'ticket.getActions',
+        'ticket.getAttachment', 'ticket.getAvailableActions',
+        'ticket.getMany', 'ticket.getRecentChanges',
+        'ticket.getRecentChangesPage', 'ticket.getTicketFields',
+        'ticket.listAttachments', 'ticket.query', 'ticket.queryPage',
+        'ticket.component.get', 'ticket.component.getAll',
+        'ticket.milestone.get', 'ticket.milestone.getAll',
+        'ticket.priority.get', 'ticket.priority.getAll',
+        'ticket.resolution.get', 'ticket.resolution.getAll',
+        'ticket.severity.get', 'ticket.severity.getAll',
+        'ticket.status.get', 'ticket.status.getAll',
+        'ticket.type.get', 'ticket.type.getAll',
+        'ticket.version.get', 'ticket.version.getAll',
+        'wiki.getAllPages', 'wiki.getAttachment', 'wiki.getPage',
+        'wiki.getPageHTML', 'wiki.getPageHTMLVersion', 'wiki.getPageInfo',
+        'wiki.getPageInfoVersion', 'wiki.getPageVersion',
+        'wiki.getRPCVersionSupported', 'wiki.getRecentChanges',
+        'wiki.listAttachments', 'wiki.listLinks', 'wiki.wikiToHtml',
+    ])
+
     def __init__(self):
         # systeminfo is removed in Trac 1.3.1 and ISystemInfoProvider
         # should generally be used instead, but in this case the plugin
@@ -305,6 +352,8 @@ class XMLRPCSystem(Component):
 
     def xmlrpc_methods(self):
         yield ('XML_RPC', ((list, list),), self.multicall)
+        yield ('XML_RPC', ((list, list), (list, list, dict)),
+               self.multicallEx)
         yield ('XML_RPC', ((list,),), self.listMethods)
         yield ('XML_RPC', ((str, str),), self.methodHelp)
         yield ('XML_RPC', ((list, str),), self.methodSignature)
@@ -340,6 +389,51 @@ class XMLRPCSystem(Component):
             except Exception as e:
                 yield e
 
+    def multicallEx(self, req, signatures, options={}):
+        """ Like `system.multicall()`, with extra `options` (a struct):
+         * `parallel`: run consecutive calls of the methods only reading
+           data (`ticket.get`, `ticket.query`, `wiki.getPage`, ...)
+           concurrently.
+         * `atomic`: run all calls in a single database transaction. If a
+           call fails, the changes of all calls are rolled back and the
+           remaining calls are not executed. Notifications and chat
+           messages about the changes are only sent once the transaction
+           is committed, and caches are only invalidated then.
+        Calls are structs with `methodName` (or `method`) and `params`.
+        Returns an array with a struct for each call, holding either
+        `result` or `faultCode` and `faultString`, plus `time`, the
+        number of seconds spent in the call. """
+        parallel = bool(options.get('parallel'))
+        atomic = bool(options.get('atomic'))
+        results = [None] * len(signatures)
+        pool = None
+        if parallel and self.multicall_workers > 1:
+            pool = ThreadPoolExecutor(self.multicall_workers,
+                                      thread_name_prefix='rpc-multicall')
+        try:
+            if atomic:
+                try:
+                    with self.env.db_transaction:
+                        self._multicall_run(req, signatures, results, pool,
+                                            atomic)
+                except _MulticallAborted as e:
+                    for idx, result in enumerate(results):
+                        if result is None:
+                            results[idx] = self._multicall_fault(
+                                RPCError("Not executed: call %d failed"
+                                         % e.index), 0)
+                        elif idx < e.index and 'result' in result \
+                                and not self._is_read_only(signatures[idx]):
+                            results[idx] = self._multicall_fault(
+                                RPCError("Rolled back: call %d failed"
+                                         % e.index), result['time'])
+            else:
+                self._multicall_run(req, signatures, results, pool, atomic)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return results
+
     def listMethods(self, req):
         """ This method returns a list of strings, one for each (non-system)
         method supported by the RPC server. """
@@ -371,3 +465,74 @@ class XMLRPCSystem(Component):
         indicate API breaking changes, while minor version changes are simple
         additions, bug fixes, etc. """
         return api_version
+
+    # Internal methods
+
+    def _is_read_only(self, signature):
+        name = self._multicall_name(signature)
+        return isinstance(name, str) and name in self._read_only_methods
+
+    def _multicall_name(self, signature):
+        if not isinstance(signature, dict):
+            return None
+        return signature.get('methodName') or signature.get('method')
+
+    def _multicall_run(self, req, signatures, results, pool, atomic):
+        written = False
+        batch = []
+        for idx, signature in enumerate(signatures):
+            # Once something was written within the transaction, reads
+            # have to use the same connection to see the changes.
+            if pool is not None and not (atomic and written) and \
+                    self._is_read_only(signature):
+                batch.append(idx)
+                continue
+            self._multicall_batch(req, signatures, results, pool, batch)
+            batch = []
+            result = results[idx] = self._multicall_call(req, signature)
+            if 'faultCode' in result and atomic:
+                raise _MulticallAborted(idx)
+            written = written or not self._is_read_only(signature)
+        self._multicall_batch(req, signatures, results, pool, batch)
+
+    def _multicall_batch(self, req, signatures, results, pool, batch):
+        futures = [(idx, pool.submit(self._multicall_call, req,
+                                     signatures[idx]))
+                   for idx in batch]
+        for idx, future in futures:
+            results[idx] = future.result()
+
+    def _multicall_call(self, req, signature):
+        start = time.time()
+        try:
+            name = self._multicall_name(signature)
+            if not name:
+                raise RPCError("Invalid call, expected a struct with "
+                               "'methodName' and 'params'")
+            result = self.get_method(name)(req,
+                                           signature.get('params') or [])
+        except Exception as e:
+            return self._multicall_fault(e, time.time() - start)
+        return {'result': result[0], 'time': time.time() - start}
+
+    def _multicall_fault(self, e, elapsed):
+        if isinstance(e, MethodNotFound):
+            code = -32601
+        elif isinstance(e, PermissionError):
+            code = 403
+        elif isinstance(e, ResourceNotFound):
+            code = 404
+        else:
+            self.log.error("multicallEx: %s",
+                           exception_to_unicode(e, traceback=True))
+            code = getattr(e, 'code', None) or 1
+        return {'faultCode': code, 'faultString': to_unicode(e),
+                'time': elapsed}
+
+
+class _MulticallAborted(Exception):
+    """ Raised to roll back an atomic `system.multicallEx`. """
+
+    def __init__(self, index):
+        Exception.__init__(self, index)
+        self.index = index
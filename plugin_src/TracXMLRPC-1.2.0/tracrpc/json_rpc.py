@@ -178,6 +178,11 @@ class JsonRpcProtocol(Component):
         * `{"__jsonclass__": ["binary", "<base64-encoded>"]} => Binary`
       * `"id"` is optional, and any marker value received with a
         request is returned with the response.
+      * Adding `"stream": true` to the request makes methods returning a
+        list of results send them as they are produced, using a chunked
+        response, instead of building the complete response first. If an
+        error occurs after results have been sent, the response holds the
+        partial `"result"` and the `"error"`.
     """)
 
     implements(IRPCProtocol)
@@ -256,6 +261,36 @@ class JsonRpcProtocol(Component):
                             cls=TracRpcJSONEncoder)
         self._send_response(req, response + '\n', rpcreq['mimetype'])
 
+    def send_rpc_result_stream(self, req, result):
+        """Send a JSON-RPC response serializing the items of the `result`
+        iterable one at a time."""
+        rpcreq = req.rpc
+        r_id = rpcreq.get('id')
+        encoder = TracRpcJSONEncoder()
+
+        def chunks():
+            # "error" comes last so that a failure while iterating can
+            # still be reported after part of the result has been sent.
+            yield '{"id": %s, "result": [' % encoder.encode(r_id)
+            sep = ''
+            try:
+                for item in result:
+                    yield sep + encoder.encode(item)
+                    sep = ', '
+            except Exception as e:
+                self.log.error("RPC(json) error while streaming result%s",
+                               exception_to_unicode(e, traceback=True))
+                error = self._json_error(e, r_id=r_id)['error']
+                yield '], "error": %s}\n' % encoder.encode(error)
+            else:
+                yield '], "error": null}\n'
+
+        req.send_response(200)
+        req.send_header('Content-Type', rpcreq['mimetype'])
+        req.end_headers()
+        req.write(chunk.encode('utf-8') for chunk in chunks())
+        raise RequestDone()
+
     def send_rpc_error(self, req, e):
         """Send a JSON-RPC fault message back to the caller. """
         rpcreq = req.rpc
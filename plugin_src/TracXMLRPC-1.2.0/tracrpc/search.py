@@ -58,5 +58,5 @@ class SearchRPC(Component):
         for source in self.search_sources:
             for result in source.get_search_results(req, query, filters) or []:
                 results.append(['/'.join(req.base_url.split('/')[0:3])
-                                + result[0]] + list(result[1:]))
+                                + result[0]] + list(result[1:5]))
         return results
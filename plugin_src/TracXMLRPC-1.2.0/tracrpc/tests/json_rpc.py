@@ -184,6 +184,25 @@ class JsonTestCase(TracRpcTestCase):
         self.assertEqual(None, result['error'])
         self.assertEqual(244, result['id'])
 
+    def test_call_stream(self):
+        data = {'method': 'system.listMethods', 'params': [], 'id': 245}
+        expected = self._anon_req(data)
+        data['stream'] = True
+        req = Request(self._testenv.url_anon, data=json_data(data),
+                      headers={'Content-Type': 'application/json'})
+        resp = urlopen(req)
+        self.assertEqual(None, resp.headers.get('Content-Length'))
+        result = _raw_json_load(resp)
+        self.assertEqual(expected, result)
+
+    def test_call_stream_error(self):
+        # errors raised before the first result are sent as usual
+        result = self._anon_req({'method': 'ticket.changeLog',
+                                 'params': [2147483647], 'id': 246,
+                                 'stream': True})
+        self.assertEqual(None, result['result'])
+        self.assertEqual(404, result['error']['code'])
+
     def test_multicall(self):
         data = {'method': 'system.multicall', 'params': [
                 {'method': 'wiki.getAllPages', 'params': [], 'id': 1},
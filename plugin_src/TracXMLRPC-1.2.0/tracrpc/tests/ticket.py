@@ -39,6 +39,53 @@ class RpcTicketTestCase(TracRpcTestCase):
         self.assertEqual('admin', attributes['reporter'])
         self.admin.ticket.delete(tid)
 
+    def test_getMany(self):
+        tid1 = self.admin.ticket.create("getMany one", "first",
+                                        {'type': 'task'})
+        tid2 = self.admin.ticket.create("getMany two", "second", {})
+        try:
+            tickets = self.admin.ticket.getMany([tid2, 9999, tid1])
+            self.assertEqual([tid2, tid1], [t[0] for t in tickets])
+            for ticket in tickets:
+                self.assertEqual(self.admin.ticket.get(ticket[0]),
+                                 ticket)
+        finally:
+            self.admin.ticket.delete(tid1)
+            self.admin.ticket.delete(tid2)
+
+    def test_getMany_fields(self):
+        tid = self.admin.ticket.create("getMany fields", "desc",
+                                       {'type': 'task'})
+        try:
+            tickets = self.admin.ticket.getMany([tid], ['summary', 'type'])
+            self.assertEqual(1, len(tickets))
+            _id, created, modified, attributes = tickets[0]
+            self.assertEqual(['_ts', 'changetime', 'summary', 'time',
+                              'type'], sorted(attributes))
+            self.assertEqual('getMany fields', attributes['summary'])
+            self.assertEqual('task', attributes['type'])
+        finally:
+            self.admin.ticket.delete(tid)
+
+    def test_getMany_since(self):
+        tid = self.admin.ticket.create("getMany since", "desc", {})
+        try:
+            created = self.admin.ticket.get(tid)[1]
+            time.sleep(1)
+            self.admin.ticket.update(tid, "a comment", {'type': 'task'})
+            tickets = self.admin.ticket.getMany([tid], [], created)
+            self.assertEqual(5, len(tickets[0]))
+            changelog = tickets[0][4]
+            self.assertEqual(self.admin.ticket.changeLog(tid), changelog)
+            self.assertEqual(['comment', 'type'],
+                             sorted(c[2] for c in changelog))
+            later = to_xmlrpc_datetime(to_datetime(None, utc) +
+                                       datetime.timedelta(seconds=60))
+            tickets = self.admin.ticket.getMany([tid], [], later)
+            self.assertEqual([], tickets[0][4])
+        finally:
+            self.admin.ticket.delete(tid)
+
     def test_create_empty_summary(self):
         try:
             self.admin.ticket.create("", "the description", {})
@@ -184,6 +231,49 @@ class TicketPolicy(Component):
             self.admin.ticket.delete(tid1)
             self.admin.ticket.delete(tid2)
 
+    def test_getRecentChangesPage(self):
+        tids = [self.admin.ticket.create("getRecentChangesPage %d" % i,
+                                         "", {}) for i in range(5)]
+        try:
+            since = self.admin.ticket.get(tids[0])[1]
+            ids = []
+            cursor = ''
+            pages = 0
+            while True:
+                page = self.admin.ticket.getRecentChangesPage(since, cursor,
+                                                              2)
+                ids.extend(page['tickets'])
+                pages += 1
+                cursor = page['cursor']
+                if not cursor:
+                    break
+            self.assertEqual(tids, ids)
+            self.assertEqual(3, pages)
+        finally:
+            for tid in tids:
+                self.admin.ticket.delete(tid)
+
+    def test_queryPage(self):
+        tids = [self.admin.ticket.create("queryPage %d" % i, "", {})
+                for i in range(5)]
+        qstr = 'summary^=queryPage&order=id&max=1'
+        try:
+            page = self.admin.ticket.queryPage(qstr, '', 3)
+            self.assertEqual(tids[:3], page['tickets'])
+            self.assertTrue(page['cursor'])
+            page = self.admin.ticket.queryPage(qstr, page['cursor'], 3)
+            self.assertEqual(tids[3:], page['tickets'])
+            self.assertEqual('', page['cursor'])
+            try:
+                self.admin.ticket.queryPage('status=new',
+                    self.admin.ticket.queryPage(qstr, '', 3)['cursor'])
+                self.fail("Exception not raised for cursor of other query")
+            except xmlrpclib.Fault as e:
+                self.assertIn("Cursor does not belong", unicode(e))
+        finally:
+            for tid in tids:
+                self.admin.ticket.delete(tid)
+
     def test_query_group_order_col(self):
         t1 = self.admin.ticket.create("1", "",
                         {'type': 'enhancement', 'owner': 'A'})
@@ -123,6 +123,40 @@ class RpcXmlTestCase(TracRpcTestCase):
         else:
             self.fail('xmlrpclib.Fault not raised')
 
+    def test_multicallEx_parallel(self):
+        calls = [{'methodName': 'wiki.getAllPages', 'params': []},
+                 {'methodName': 'ticket.status.getAll', 'params': []},
+                 {'methodName': 'ticket.get', 'params': [2147483647]},
+                 {'methodName': 'nonexisting', 'params': []}]
+        results = self.admin.system.multicallEx(calls, {'parallel': True})
+        self.assertEqual(4, len(results))
+        self.assertIn('WikiStart', results[0]['result'])
+        self.assertEqual(['accepted', 'assigned', 'closed', 'new',
+                          'reopened'], results[1]['result'])
+        self.assertEqual(404, results[2]['faultCode'])
+        self.assertEqual(-32601, results[3]['faultCode'])
+        for result in results:
+            self.assertIsInstance(result['time'], float)
+
+    def test_multicallEx_atomic(self):
+        summary = 'multicallEx atomic'
+        calls = [{'methodName': 'ticket.create',
+                  'params': [summary, 'first', {}]},
+                 {'methodName': 'ticket.query',
+                  'params': ['summary=' + summary]},
+                 {'methodName': 'ticket.get', 'params': [2147483647]},
+                 {'methodName': 'ticket.create',
+                  'params': [summary, 'second', {}]}]
+        results = self.admin.system.multicallEx(calls, {'atomic': True,
+                                                        'parallel': True})
+        self.assertIn('Rolled back', results[0]['faultString'])
+        # The read after the write sees the uncommitted ticket
+        self.assertEqual(1, len(results[1]['result']))
+        self.assertEqual(404, results[2]['faultCode'])
+        self.assertIn('Not executed', results[3]['faultString'])
+        self.assertEqual([],
+                         self.admin.ticket.query('summary=' + summary))
+
     @unittest.expectedFailure
     def test_xml_encoding_special_characters(self):
         tid1 = self.admin.ticket.create(
@@ -6,12 +6,14 @@ License: BSD
 (c) 2009      ::: www.CodeResort.com - BV Network AS (simon-code@bvnetwork.no)
 """
 
+import hashlib
 import inspect
 import io
 from datetime import datetime
 
 from trac.attachment import Attachment
 from trac.core import Component, TracError, implements
+from trac.db.api import DatabaseManager
 from trac.resource import Resource, ResourceNotFound
 from trac.ticket import model, query
 from trac.ticket.api import TicketSystem
@@ -30,8 +32,17 @@ else:
     from trac.ticket.notification import TicketChangeEvent
     TicketNotifyEmail = None
 
+try:
+    from trac.ticket.model import _db_str_to_datetime
+except ImportError:
+    def _db_str_to_datetime(value):
+        try:
+            return from_utimestamp(int(value))
+        except (TypeError, ValueError):
+            return None
+
 from .api import IXMLRPCHandler, Binary
-from .util import iteritems
+from .util import decode_cursor, encode_cursor, iteritems, to_b
 
 __all__ = ['TicketRPC']
 
@@ -47,9 +58,17 @@ class TicketRPC(Component):
     def xmlrpc_methods(self):
         yield (None, ((list,), (list, str)), self.query)
         yield (None, ((list, datetime),), self.getRecentChanges)
+        yield (None, ((dict, str), (dict, str, str), (dict, str, str, int)),
+                      self.queryPage)
+        yield (None, ((dict, datetime), (dict, datetime, str),
+                      (dict, datetime, str, int)),
+                      self.getRecentChangesPage)
         yield (None, ((list, int),), self.getAvailableActions)
         yield (None, ((list, int),), self.getActions)
         yield (None, ((list, int),), self.get)
+        yield (None, ((list, list),
+                      (list, list, list),
+                      (list, list, list, datetime)), self.getMany)
         yield ('TICKET_CREATE', ((int, str, str),
                                  (int, str, str, dict),
                                  (int, str, str, dict, bool),
@@ -82,32 +101,85 @@ class TicketRPC(Component):
         `max=0` will turn off paging and return all results.
         """
         q = query.Query.from_string(self.env, qstr)
-        ticket_realm = Resource('ticket')
-        out = []
-        for t in q.execute(req):
-            tid = t['id']
-            if 'TICKET_VIEW' in req.perm(ticket_realm(id=tid)):
-                out.append(tid)
-        return out
+        ids = [t['id'] for t in q.execute(req)]
+        for tid in self._filter_viewable(req, ids):
+            yield tid
+
+    def queryPage(self, req, qstr='status!=closed', cursor='', limit=1000):
+        """
+        Perform a ticket query one page at a time. Returns a dict with the
+        `tickets` ID's of the page and an opaque `cursor` to pass back to get
+        the next page, which is empty after the last page. `max` and `page`
+        in the query string are ignored; `limit` is the maximum number of
+        rows read per page (pages can hold fewer ID's when some tickets can't
+        be viewed).
+        Pages are read by position, so tickets changing while paging can
+        make results shift between pages.
+        """
+        limit = self._page_limit(limit)
+        position = decode_cursor(cursor) or {'o': 0}
+        if position.get('q') not in (None, self._query_key(qstr)):
+            raise TracError("Cursor does not belong to query %r" % qstr)
+        offset = int(position.get('o', 0))
+        q = query.Query.from_string(self.env, qstr)
+        sql, args = q.get_sql(req)
+        # One row beyond the page tells whether there is a next page,
+        # without counting the whole result set.
+        sql += " LIMIT %d OFFSET %d" % (limit + 1, offset)
+        with self.env.db_query as db:
+            cursor_ = db.cursor()
+            cursor_.execute(sql, args)
+            columns = [d[0] for d in cursor_.description]
+            id_idx = columns.index('id')
+            rows = cursor_.fetchmany(limit + 1)
+        tickets = self._filter_viewable(req, [int(row[id_idx])
+                                              for row in rows[:limit]])
+        next_cursor = ''
+        if len(rows) > limit:
+            next_cursor = encode_cursor({'q': self._query_key(qstr),
+                                         'o': offset + limit})
+        return {'tickets': tickets, 'cursor': next_cursor}
 
     def getRecentChanges(self, req, since):
         """Returns a list of IDs of tickets that have changed since timestamp."""
         since = to_utimestamp(since)
         query = 'SELECT id FROM ticket WHERE changetime >= %s'
-        if hasattr(self.env, 'db_query'):
-            generator = self.env.db_query(query, (since,))
+        ids = []
+        for row in self._iter_rows(query, (since,)):
+            ids.append(int(row[0]))
+            if len(ids) >= self._chunk_size:
+                for tid in self._filter_viewable(req, ids):
+                    yield tid
+                ids = []
+        for tid in self._filter_viewable(req, ids):
+            yield tid
+
+    def getRecentChangesPage(self, req, since, cursor='', limit=1000):
+        """Returns the IDs of tickets that have changed since timestamp, one
+        page at a time, oldest change first. Returns a dict with the `tickets`
+        ID's of the page and an opaque `cursor` to pass back to get the next
+        page, which is empty after the last page. Paging continues from the
+        last ticket seen (by change time and ID), so it is stable while
+        tickets are being changed."""
+        limit = self._page_limit(limit)
+        position = decode_cursor(cursor)
+        if position:
+            where = "changetime>%s OR (changetime=%s AND id>%s)"
+            args = (position['t'], position['t'], position['id'])
         else:
-            db = self.env.get_db_cnx()
-            cursor = db.cursor()
-            cursor.execute(query, (since,))
-            generator = cursor
-        result = []
-        ticket_realm = Resource('ticket')
-        for row in generator:
-            tid = int(row[0])
-            if 'TICKET_VIEW' in req.perm(ticket_realm(id=tid)):
-                result.append(tid)
-        return result
+            where = "changetime>=%s"
+            args = (to_utimestamp(since),)
+        rows = self.env.db_query("""
+            SELECT id, changetime FROM ticket WHERE %s
+            ORDER BY changetime, id LIMIT %d
+            """ % (where, limit + 1), args)
+        tickets = self._filter_viewable(req, [tid for tid, changetime
+                                                  in rows[:limit]])
+        next_cursor = ''
+        if len(rows) > limit:
+            tid, changetime = rows[limit - 1]
+            next_cursor = encode_cursor({'t': changetime, 'id': tid})
+        return {'tickets': tickets, 'cursor': next_cursor}
 
     def getAvailableActions(self, req, id):
         """ Deprecated - will be removed. Replaced by `getActions()`. """
@@ -145,6 +217,91 @@ class TicketRPC(Component):
         t['_ts'] = str(to_utimestamp(changetime))
         return (t.id, t['time'], changetime, t.values)
 
+    def getMany(self, req, ids, fields=[], since=None):
+        """ Fetch several tickets at once. Returns a list with one
+        [id, time_created, time_changed, attributes] element per ticket, as
+        for get(), in the order of `ids`. Tickets that don't exist or can't
+        be viewed are left out.
+        `fields` restricts the attributes to the given field names (`time`,
+        `changetime` and `_ts` are always returned); all fields are returned
+        when empty.
+        When `since` is given, a fifth item is added to each element with the
+        changelog entries at or after that time, in the form returned by
+        changeLog(). """
+        ids = [int(tid) for tid in ids]
+        template = model.Ticket(self.env)
+        if fields:
+            fields = set(fields) | set(['time', 'changetime'])
+            std_fields = [f for f in template.std_fields
+                          if f in fields or f in ('time', 'changetime')]
+            custom_fields = [f for f in template.custom_fields if f in fields]
+        else:
+            std_fields = template.std_fields
+            custom_fields = template.custom_fields
+        time_fields = template.time_fields
+        std_fields = [f for f in std_fields if f != 'id']
+
+        tickets = {}
+        for chunk in self._chunks(self._filter_viewable(req, ids)):
+            args = tuple(chunk)
+            marks = ','.join(['%s'] * len(chunk))
+            for row in self.env.db_query("""
+                    SELECT id,%s FROM ticket WHERE id IN (%s)
+                    """ % (','.join(std_fields), marks), args):
+                tid = row[0]
+                values = {}
+                for name, value in zip(std_fields, row[1:]):
+                    if name in time_fields:
+                        value = from_utimestamp(value)
+                    elif value is None:
+                        value = ''
+                    values[name] = value
+                tickets[tid] = values
+            if not custom_fields:
+                continue
+            args = tuple(tid for tid in chunk if tid in tickets)
+            if not args:
+                continue
+            for tid, name, value in self.env.db_query("""
+                    SELECT ticket,name,value FROM ticket_custom
+                    WHERE ticket IN (%s)
+                    """ % ','.join(['%s'] * len(args)), args):
+                if name not in custom_fields:
+                    continue
+                if name in time_fields:
+                    value = _db_str_to_datetime(value)
+                elif value is None:
+                    value = ''
+                tickets[tid][name] = value
+
+        # Defaults for custom fields without a ticket_custom row
+        defaults = {}
+        for field in template.fields:
+            if field['name'] in custom_fields:
+                default = template._custom_field_default(field)
+                if default:
+                    defaults[field['name']] = default
+        for values in tickets.values():
+            for name, default in iteritems(defaults):
+                values.setdefault(name, default)
+            values['_ts'] = str(to_utimestamp(values['changetime']))
+
+        changelogs = {}
+        if since is not None:
+            changelogs = self._get_changelogs(list(tickets), since,
+                                              time_fields)
+
+        result = []
+        for tid in ids:
+            values = tickets.get(tid)
+            if values is None:
+                continue
+            item = [tid, values['time'], values['changetime'], values]
+            if since is not None:
+                item.append(changelogs.get(tid, []))
+            result.append(item)
+        return result
+
     def create(self, req, summary, description, attributes={}, notify=False, when=None):
         """ Create a new ticket, returning the ticket ID.
         Overriding 'when' requires admin permission. """
@@ -165,7 +322,9 @@ class TicketRPC(Component):
             when = to_datetime(None, utc)
         t.insert(when=when)
         if notify:
-            self._notify_created_event(t, when, req.authname)
+            # Deferred until an atomic system.multicallEx is committed
+            DatabaseManager(self.env).call_after_commit(
+                lambda: self._notify_created_event(t, when, req.authname))
         return t.id
 
     def update(self, req, id, comment, attributes={}, notify=False, author='', when=None):
@@ -254,7 +413,9 @@ class TicketRPC(Component):
                 for controller in controllers:
                     controller.apply_action_side_effects(req, t, action)
         if notify:
-            self._notify_changed_event(t, when, author, comment)
+            # Deferred until an atomic system.multicallEx is committed
+            DatabaseManager(self.env).call_after_commit(
+                lambda: self._notify_changed_event(t, when, author, comment))
         return self.get(req, t.id)
 
     def delete(self, req, id):
@@ -318,6 +479,94 @@ class TicketRPC(Component):
 
     # Internal methods
 
+    # SQLite before 3.32 binds at most 999 parameters per statement
+    _chunk_size = 500
+
+    _max_page_limit = 10000
+
+    def _iter_rows(self, query, args):
+        """Iterate over the rows of `query` as they are read from the
+        database cursor."""
+        if hasattr(self.env, 'db_query'):
+            with self.env.db_query as db:
+                cursor = db.cursor()
+                cursor.execute(query, args)
+                for row in cursor:
+                    yield row
+        else:
+            db = self.env.get_db_cnx()
+            cursor = db.cursor()
+            cursor.execute(query, args)
+            for row in cursor:
+                yield row
+
+    def _page_limit(self, limit):
+        try:
+            limit = int(limit)
+        except (TypeError, ValueError):
+            limit = 0
+        if not 0 < limit <= self._max_page_limit:
+            raise TracError("Page limit must be between 1 and %d" %
+                            self._max_page_limit)
+        return limit
+
+    def _query_key(self, qstr):
+        return hashlib.sha1(to_b(qstr)).hexdigest()[:16]
+
+    def _filter_viewable(self, req, ids):
+        """Return the ticket `ids` the user can view, in order."""
+        resources = [Resource('ticket', tid) for tid in ids]
+        if hasattr(req.perm, 'filter'):
+            resources = req.perm.filter('TICKET_VIEW', resources)
+        else:
+            resources = [resource for resource in resources
+                         if 'TICKET_VIEW' in req.perm(resource)]
+        return [resource.id for resource in resources]
+
+    def _chunks(self, ids, size=None):
+        size = size or self._chunk_size
+        for idx in range(0, len(ids), size):
+            yield ids[idx:idx + size]
+
+    def _get_changelogs(self, ids, since, time_fields):
+        """Return the changelogs at or after `since` of tickets `ids` as a
+        dict of lists of (time, author, field, oldvalue, newvalue, permanent)
+        tuples, ordered as in `Ticket.get_changelog`."""
+        since_ts = to_utimestamp(since)
+        changelogs = {}
+        with self.env.db_query as db:
+            # each chunk is bound three times, once per SELECT of the UNION
+            for chunk in self._chunks(ids, self._chunk_size // 3):
+                marks = ','.join(['%s'] * len(chunk))
+                sids = tuple(str(tid) for tid in chunk)
+                for tid, t, author, field, oldvalue, newvalue, permanent \
+                        in db("""
+                        SELECT ticket, time, author, field, oldvalue,
+                          newvalue, 1 AS permanent
+                        FROM ticket_change WHERE ticket IN (%(marks)s)
+                          AND time>=%%s
+                          UNION
+                        SELECT %(id)s, time, author, 'attachment', null,
+                          filename, 0 AS permanent
+                        FROM attachment WHERE type='ticket'
+                          AND id IN (%(marks)s) AND time>=%%s
+                          UNION
+                        SELECT %(id)s, time, author, 'comment', null,
+                          description, 0 AS permanent
+                        FROM attachment WHERE type='ticket'
+                          AND id IN (%(marks)s) AND time>=%%s
+                        ORDER BY 1,2,7,3,4
+                        """ % {'marks': marks, 'id': db.cast('id', 'int')},
+                        tuple(chunk) + (since_ts,) + sids + (since_ts,) +
+                        sids + (since_ts,)):
+                    if field in time_fields:
+                        oldvalue = _db_str_to_datetime(oldvalue)
+                        newvalue = _db_str_to_datetime(newvalue)
+                    changelogs.setdefault(tid, []).append(
+                        (from_utimestamp(t), author, field, oldvalue or '',
+                         newvalue or '', permanent))
+        return changelogs
+
     def _extract_action_controls(self, widgets):
 
         def unescape(value):
@@ -6,10 +6,14 @@ License: BSD
 (c) 2009-2013 ::: www.CodeResort.com - BV Network AS (simon-code@bvnetwork.no)
 """
 
+import base64
 import functools
 import inspect
+import json
 import sys
 
+from trac.core import TracError
+from trac.util.text import to_unicode
 from trac.util.translation import dgettext, domain_functions
 
 
@@ -84,3 +88,25 @@ def to_b(value):
     if isinstance(value, bytes):
         return value
     raise TypeError(str(type(value)))
+
+
+def encode_cursor(position):
+    """Encode a `dict` describing a position in a result set as an opaque
+    continuation token."""
+    data = json.dumps(position, sort_keys=True, separators=(',', ':'))
+    return to_unicode(base64.urlsafe_b64encode(to_b(data)))
+
+
+def decode_cursor(token):
+    """Decode a token created by `encode_cursor`. Returns `None` for an
+    empty token and raises `TracError` for a malformed one."""
+    if not token:
+        return None
+    try:
+        position = json.loads(to_unicode(base64.urlsafe_b64decode(
+                                                        to_b(token))))
+    except (TypeError, ValueError):
+        raise TracError("Invalid cursor %r" % token)
+    if not isinstance(position, dict):
+        raise TracError("Invalid cursor %r" % token)
+    return position
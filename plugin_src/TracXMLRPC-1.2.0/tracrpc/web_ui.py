@@ -6,6 +6,7 @@ License: BSD
 (c) 2009      ::: www.CodeResort.com - BV Network AS (simon-code@bvnetwork.no)
 """
 
+import itertools
 import pkg_resources
 import types
 
@@ -70,6 +71,13 @@ class RPCWeb(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        paths = set(['rpc'])
+        for protocol in self.protocols:
+            for p_path, p_type in protocol.rpc_match():
+                paths.add(p_path)
+        return ['/%s' % p for p in paths] + ['/login/%s' % p for p in paths]
+
     def match_request(self, req):
         """ Look for available protocols serving at requested path and
             content-type. """
@@ -186,8 +194,17 @@ class RPCWeb(Component):
             self.log.debug("RPC(%s) call by '%s' %s", proto_id,
                            req.authname, method_name)
             try:
-                result = (XMLRPCSystem(self.env).get_method(method_name)(req, args))[0]
-                if isinstance(result, types.GeneratorType):
+                stream = bool(rpcreq.get('stream')) and \
+                         hasattr(protocol, 'send_rpc_result_stream')
+                method = XMLRPCSystem(self.env).get_method(method_name)
+                result = method(req, args, stream=stream)[0]
+                if not isinstance(result, types.GeneratorType):
+                    stream = False
+                elif stream:
+                    # Fetch the first item so that errors raised before any
+                    # result is produced are still sent as a fault
+                    result = self._prime_generator(result)
+                else:
                     result = list(result)
             except (TracError, PermissionError, ResourceNotFound):
                 raise
@@ -198,7 +215,10 @@ class RPCWeb(Component):
                                exception_to_unicode(e, traceback=True))
                 raise ServiceException(e)
             else:
-                protocol.send_rpc_result(req, result)
+                if stream:
+                    protocol.send_rpc_result_stream(req, result)
+                else:
+                    protocol.send_rpc_result(req, result)
         except RequestDone:
             raise
         except (TracError, PermissionError, ResourceNotFound) as e:
@@ -216,6 +236,13 @@ class RPCWeb(Component):
             self.log.exception("RPC(%s) Unhandled protocol error", proto_id)
             self._send_unknown_error(req, e)
 
+    def _prime_generator(self, result):
+        try:
+            first = next(result)
+        except StopIteration:
+            return iter(())
+        return itertools.chain((first,), result)
+
     def _send_unknown_error(self, req, e):
         """Last recourse if protocol cannot handle the RPC request | error"""
         method_name = req.rpc and req.rpc.get('method') or '(undefined)'
@@ -1,24 +1,168 @@
 # Copyright 2024 Hewlett Packard Enterprise Development LP.
 
 from trac.core import *
+from trac.resource import ResourceNotFound
+from trac.api import IEnvironmentSetupParticipant
+from trac.config import IntOption
+from trac.db.api import DatabaseManager
+from trac.db.schema import Column, Index, Table
 from trac.ticket.api import ITicketChangeListener
+from trac.web.api import IRequestFilter
 from trac.attachment import Attachment
+from trac.util.datefmt import datetime_now, to_utimestamp, utc
+from trac.util.text import exception_to_unicode
 
 import requests
 import json
 import os
 import io
+import threading
+import time
 
 url_base = 'https://127.0.0.1:8080/cmu/v1/'
 aliasurl = url_base+"systemgroups/compute?fields=nodes.name,nodes.aliases"
 session_key_file = '/opt/stat/.session_key'
 
+db_version_key = 'stathpcmdbplugin_version'
+db_version = 1
+
+schema = [
+    # Pending inventory captures, processed after the ticket is committed
+    Table('hpcm_inventory_queue', key='id')[
+        Column('id', auto_increment=True),
+        Column('ticket', type='int'),
+        Column('hostname'),
+        Column('time', type='int64'),
+        Column('next_attempt', type='int64'),
+        Column('attempts', type='int'),
+        Column('last_error'),
+        Index(['next_attempt'])],
+]
+
+# One inventory worker per environment and process; a new component
+# instance (e.g. after a trac.ini reload) takes over from the old one.
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+class HpcmAliasIndex(object):
+    """Bidirectional hostname <-> xname index built from the HPCM
+    `systemgroups/compute` document.
+
+    The index is refreshed at most once per `ttl` seconds; refreshes send
+    the `ETag` of the previous document so an unchanged inventory costs
+    a `304 Not Modified` instead of a full download. A failed refresh is
+    retried after `retry_delay` seconds, serving the stale index (if
+    any) meanwhile.
+    """
+
+    def __init__(self, ttl, retry_delay):
+        self.ttl = ttl
+        self.retry_delay = retry_delay
+        self.etag = None
+        self.fetched = 0
+        self.retry_at = 0
+        self.xnames = {}    # hostname -> xname
+        self.nodes = {}     # xname -> hostname
+        self.lock = threading.Lock()
+
+    def expired(self, now=None):
+        now = now or time.time()
+        return now - self.fetched >= self.ttl and now >= self.retry_at
+
+    def load(self, data, etag=None):
+        xnames = {}
+        nodes = {}
+        for node in data.get('nodes', ()):
+            name = node.get('name')
+            xname = (node.get('aliases') or {}).get('cm-geo-name')
+            if name and xname:
+                xnames[name] = xname
+                nodes[xname] = name
+        self.xnames = xnames
+        self.nodes = nodes
+        self.etag = etag
+        self.touch()
+
+    def touch(self):
+        self.fetched = time.time()
+        self.retry_at = 0
+
+    def failed(self):
+        self.retry_at = time.time() + self.retry_delay
+
+    def invalidate(self):
+        self.fetched = 0
+        self.retry_at = 0
+
+
 class StatHpcmDbPlugin(Component):
-    implements(ITicketChangeListener)
-    
-    def __init__(self): 
+    implements(IEnvironmentSetupParticipant, IRequestFilter,
+               ITicketChangeListener)
+
+    alias_cache_ttl = IntOption('hpcm', 'alias_cache_ttl', 300,
+        """Number of seconds the hostname/xname alias index is used
+        before it is revalidated against the HPCM REST API.""")
+
+    alias_retry_delay = IntOption('hpcm', 'alias_retry_delay', 10,
+        """Number of seconds before a failed refresh of the
+        hostname/xname alias index is retried.""")
+
+    request_timeout = IntOption('hpcm', 'request_timeout', 30,
+        """Timeout in seconds for requests to the HPCM REST API.""")
+
+    inventory_poll_interval = IntOption('hpcm', 'inventory_poll_interval',
+        30,
+        """Number of seconds the inventory worker sleeps between scans
+        of the inventory queue when it has not been woken up by a new
+        ticket.""")
+
+    inventory_max_attempts = IntOption('hpcm', 'inventory_max_attempts', 5,
+        """Number of times fetching the inventory of a ticket's node is
+        tried before the job is dropped from the queue.""")
+
+    inventory_retry_delay = IntOption('hpcm', 'inventory_retry_delay', 60,
+        """Base delay in seconds before a failed inventory capture is
+        retried. The delay doubles with every failed attempt.""")
+
+    def __init__(self):
         self.log.debug("HPCMDB, in StatHpcmDbPlugin")
-    
+        self._index = HpcmAliasIndex(self.alias_cache_ttl,
+                                     self.alias_retry_delay)
+        self._session = requests.Session()
+        self._session.verify = False
+        self._session_key = None
+        self._session_key_mtime = None
+        self._wakeup = threading.Event()
+
+    # IEnvironmentSetupParticipant methods
+
+    def environment_created(self):
+        self.upgrade_environment()
+
+    def environment_needs_upgrade(self):
+        return DatabaseManager(self.env).needs_upgrade(db_version,
+                                                       db_version_key)
+
+    def upgrade_environment(self):
+        dbm = DatabaseManager(self.env)
+        dbm.create_tables(schema)
+        dbm.set_database_version(db_version, db_version_key)
+
+    # IRequestFilter methods
+
+    def pre_process_request(self, req, handler):
+        # Resume processing the jobs queued before a restart, from the
+        # process serving the requests rather than from whichever
+        # process opened the environment (e.g. before forking).
+        self._start_inventory_worker()
+        return handler
+
+    def post_process_request(self, req, template, data, metadata):
+        return template, data, metadata
+
+    # ITicketChangeListener methods
+
     def ticket_changed(self, ticket, comment, author, old_values):
 
         if 'hostname' in old_values and not ticket['xname']:
@@ -32,7 +176,7 @@ class StatHpcmDbPlugin(Component):
             if node_value:
                 ticket['hostname']=node_value
                 ticket.save_changes()
-    
+
 
     def ticket_created(self, ticket):
 
@@ -41,22 +185,15 @@ class StatHpcmDbPlugin(Component):
             if xname_value :
                 ticket['xname'] = xname_value
                 ticket.save_changes()
-                data=self._hpcm_db_inventory(ticket['hostname'])
 
         if ticket['xname'] and not ticket['hostname']:
             node_value = self._hpcm_get_node(ticket['xname'])
-            if node_value: 
+            if node_value:
                 ticket['hostname'] = node_value
                 ticket.save_changes()
-                data=self._hpcm_db_inventory(ticket['hostname'])
-
-
-#        if data:
-#            # needs ticket.id which doesn't happen until after ticket created.
-#            #self._attach_data_to_ticket(ticket, data)
-#            pass
-        
 
+        if ticket['hostname'] and self._hpcm_get_xname(ticket['hostname']):
+            self.enqueue_inventory(ticket.id, ticket['hostname'])
 
     def ticket_deleted(self, ticket):
         pass
@@ -67,72 +204,246 @@ class StatHpcmDbPlugin(Component):
     def ticket_change_deleted(self, ticket, cdate, changes):
         pass
 
+    # Bulk lookup API
+
+    def get_xnames(self, hostnames):
+        """Return a `dict` mapping each known hostname in `hostnames` to
+        its xname. Unknown hostnames are omitted."""
+        index = self._hpcm_alias_index()
+        return dict((h, index.xnames[h]) for h in hostnames
+                    if h in index.xnames)
 
+    def get_nodes(self, xnames):
+        """Return a `dict` mapping each known xname in `xnames` to its
+        hostname. Unknown xnames are omitted."""
+        index = self._hpcm_alias_index()
+        return dict((x, index.nodes[x]) for x in xnames
+                    if x in index.nodes)
+
+    def invalidate_aliases(self):
+        """Force the next lookup to revalidate the alias index."""
+        self._index.invalidate()
 
     def _hpcm_get_xname(self, hostname):
-        
         try:
-            aliases=self._hpcm_db_get_aliases()
-            for node in aliases['nodes']:
-                if node['name'] == hostname:
-                    return node['aliases'].get('cm-geo-name', None)
+            return self._hpcm_alias_index().xnames.get(hostname)
         except Exception as e:
-            self.log.error("HPCMDB, Error in _hpcm_get_xname: %s, %s",e,)
+            self.log.error("HPCMDB, Error in _hpcm_get_xname: %s", e)
 
     def _hpcm_get_node(self, xname):
         try:
-            aliases=self._hpcm_db_get_aliases()
-            for node in aliases['nodes']:
-                if node['aliases'].get('cm-geo-name') == xname:
-                    return node['name']
+            return self._hpcm_alias_index().nodes.get(xname)
         except Exception as e:
             self.log.error(f"HPCMDB, Error in _hpcm_get_node: {e}")
-    
+
+    def _hpcm_alias_index(self):
+        index = self._index
+        if not index.expired():
+            return index
+        with index.lock:
+            # another thread may have refreshed while we waited
+            if index.expired():
+                self._hpcm_refresh_aliases(index)
+        return index
+
+    def _hpcm_refresh_aliases(self, index):
+        headers = {}
+        if index.etag and index.xnames:
+            headers['If-None-Match'] = index.etag
+        response = self._hpcm_db_request(aliasurl, headers)
+        if response is None:
+            # keep serving the stale index rather than hammering the API
+            index.failed()
+            return
+        if response.status_code == 304:
+            self.log.debug("HPCMDB, alias index not modified")
+            index.touch()
+            return
+        data = self._hpcm_db_json(response)
+        if data is None:
+            index.failed()
+            return
+        index.load(data, response.headers.get('ETag'))
+        self.log.debug("HPCMDB, alias index loaded %d nodes",
+                       len(index.xnames))
+
     def _hpcm_db_get_aliases(self):
 
         return(self._hpcm_db_get(aliasurl))
-        
-    def _hpcm_db_get(self, url):
 
-        if os.path.exists(session_key_file):
+    def _hpcm_read_session_key(self):
+        try:
+            mtime = os.path.getmtime(session_key_file)
+        except OSError:
+            self.log.error("HPCMDB, session key file %s not found",
+                           session_key_file)
+            return None
+        if mtime != self._session_key_mtime:
             with open(session_key_file, 'r') as file:
-                session_key = file.read().strip()
-        else:
-            sys.exit(1)
-        headers = {'X-Auth-Token': session_key}
-        response = requests.get(url, headers=headers, verify=False)
+                self._session_key = file.read().strip()
+            self._session_key_mtime = mtime
+        return self._session_key
 
+    def _hpcm_db_request(self, url, headers=None):
+        session_key = self._hpcm_read_session_key()
+        if session_key is None:
+            return None
+        headers = dict(headers or {}, **{'X-Auth-Token': session_key})
+        try:
+            response = self._session.get(url, headers=headers,
+                                         timeout=self.request_timeout)
+        except requests.RequestException as e:
+            self.log.error("HPCMDB, request to %s failed: %s", url, e)
+            return None
 
         if response.status_code == 403 or response.status_code == 401:  # Unauthorized access, indicating invalid session key
             self.log.debug("HPCMDB, Session key is invalid or expired.")
-            sys.exit(1)
+            # re-read the key file on the next request
+            self._session_key_mtime = None
+            return None
 
-        if response.status_code == 200:
-            try:
-                data = response.json()
-                return(data)
-            except ValueError:
-                self.log.debug("HPCMDB, Response is not valid JSON. Raw response:")
-                self.log.debug(response.text)
-                sys.exit(1)
-        else:
+        if response.status_code not in (200, 304):
             self.log.debug(f"HPCMDB, Failed with status code: {response.status_code}, Message: {response.text}")
-            sys.exit(1)
+            return None
+        return response
+
+    def _hpcm_db_json(self, response):
+        try:
+            return response.json()
+        except ValueError:
+            self.log.debug("HPCMDB, Response is not valid JSON. Raw response:")
+            self.log.debug(response.text)
+            return None
+
+    def _hpcm_db_get(self, url):
+        response = self._hpcm_db_request(url)
+        if response is not None and response.status_code == 200:
+            return self._hpcm_db_json(response)
 
     def _hpcm_db_inventory(self,hostname):
         inventoryurl=url_base+"nodes/"+hostname+"?fields=inventory"
         return(self._hpcm_db_get(inventoryurl))
-    
-    def _attach_data_to_ticket(self, ticket, data, filename='invnetory.json'):
+
+    def _attach_data_to_ticket(self, ticket_id, data, filename='inventory.json'):
         json_data = json.dumps(data, indent=4).encode('utf-8')
 
         json_file = io.BytesIO(json_data)
-        json_file.seek(0, io.SEEK_END)  
-        file_size = json_file.tell()     
+        json_file.seek(0, io.SEEK_END)
+        file_size = json_file.tell()
         json_file.seek(0)
 
+        attachment = Attachment(self.env, 'ticket', ticket_id)
+        attachment.author = 'hpcm'
+        attachment.description = 'HPCM node inventory'
+        attachment.insert(filename, json_file, file_size)
+
+    # Inventory queue
+
+    def enqueue_inventory(self, ticket_id, hostname):
+        """Queue capturing the HPCM inventory of `hostname` as an
+        attachment of ticket `ticket_id`.
+
+        The job is stored in the database, so it survives a restart,
+        and is processed by a background thread outside the request.
+        """
+        now = to_utimestamp(datetime_now(utc))
+        self.env.db_transaction("""
+            INSERT INTO hpcm_inventory_queue
+                (ticket, hostname, time, next_attempt, attempts)
+            VALUES (%s, %s, %s, %s, 0)
+            """, (ticket_id, hostname, now, now))
+        self._start_inventory_worker()
+        self._wakeup.set()
 
-#    attachment = Attachment(self.env, 'ticket', ticket.id)
+    def _start_inventory_worker(self):
+        worker = _workers.get(self.env.path)
+        if worker and worker[0] is self and worker[1].is_alive():
+            return
+        with _workers_lock:
+            worker = _workers.get(self.env.path)
+            if worker and worker[0] is self and worker[1].is_alive():
+                return
+            thread = threading.Thread(target=self._inventory_worker,
+                                      name='hpcm-inventory')
+            thread.daemon = True
+            _workers[self.env.path] = (self, thread)
+            thread.start()
 
-#    attachment.insert(filename, json_file, file_size)
+    def _inventory_worker_current(self):
+        worker = _workers.get(self.env.path)
+        return worker is not None and worker[0] is self
 
+    def _inventory_worker(self):
+        while self._inventory_worker_current():
+            # Cleared before looking for jobs, so that a job queued
+            # meanwhile wakes the worker up again right away.
+            self._wakeup.clear()
+            try:
+                while self._process_inventory_job():
+                    pass
+            except Exception as e:
+                self.log.error("HPCMDB, inventory worker error: %s",
+                               exception_to_unicode(e, traceback=True))
+            self._wakeup.wait(self.inventory_poll_interval)
+
+    def _claim_inventory_job(self):
+        """Claim the oldest due job, returning `(id, ticket, hostname,
+        attempts)` or `None`.
+
+        A claim pushes `next_attempt` forward so other processes
+        sharing the database skip the job while it is being handled.
+        """
+        now = to_utimestamp(datetime_now(utc))
+        lease = now + self.request_timeout * 2 * 1000000
+        with self.env.db_transaction as db:
+            for id_, tkt_id, hostname, next_attempt, attempts in db("""
+                    SELECT id, ticket, hostname, next_attempt, attempts
+                    FROM hpcm_inventory_queue WHERE next_attempt<=%s
+                    ORDER BY next_attempt, id
+                    """, (now,)):
+                cursor = db.cursor()
+                cursor.execute("""
+                    UPDATE hpcm_inventory_queue SET next_attempt=%s
+                    WHERE id=%s AND next_attempt=%s
+                    """, (lease, id_, next_attempt))
+                if cursor.rowcount == 1:
+                    return id_, tkt_id, hostname, attempts
+        return None
+
+    def _process_inventory_job(self):
+        job = self._claim_inventory_job()
+        if job is None:
+            return False
+        id_, tkt_id, hostname, attempts = job
+        try:
+            data = self._hpcm_db_inventory(hostname)
+            if data is None:
+                raise TracError("no inventory returned for %s" % hostname)
+            self._attach_data_to_ticket(tkt_id, data)
+        except ResourceNotFound:
+            self.log.info("HPCMDB, ticket #%s no longer exists, dropping "
+                          "inventory job", tkt_id)
+        except Exception as e:
+            attempts += 1
+            error = exception_to_unicode(e)
+            if attempts < self.inventory_max_attempts:
+                delay = self.inventory_retry_delay * 2 ** (attempts - 1)
+                self.log.warning("HPCMDB, inventory for #%s (%s) failed, "
+                                 "retrying in %ds: %s", tkt_id, hostname,
+                                 delay, error)
+                retry = to_utimestamp(datetime_now(utc)) + delay * 1000000
+                self.env.db_transaction("""
+                    UPDATE hpcm_inventory_queue
+                    SET next_attempt=%s, attempts=%s, last_error=%s
+                    WHERE id=%s
+                    """, (retry, attempts, error, id_))
+                return True
+            self.log.error("HPCMDB, giving up on inventory for #%s (%s) "
+                           "after %d attempts: %s", tkt_id, hostname,
+                           attempts, error)
+        else:
+            self.log.debug("HPCMDB, attached inventory of %s to #%s",
+                           hostname, tkt_id)
+        self.env.db_transaction(
+            "DELETE FROM hpcm_inventory_queue WHERE id=%s", (id_,))
+        return True
@@ -1,15 +1,25 @@
 # Copyright 2024 Hewlett Packard Enterprise Development LP.
 
 import json
-import requests
 from trac.core import Component, implements
 from trac.ticket.api import ITicketChangeListener
 from trac.wiki.api import IWikiChangeListener
 from trac.versioncontrol.api import IRepositoryChangeListener
 from trac.config import Option
+from trac.notification.dispatcher import DeliveryRejectedError, \
+                                         IOutboundSender, OutboundDispatcher, \
+                                         PartialDeliveryError
+
+# Mattermost rejects posts longer than this many characters
+MAX_POST_LENGTH = 16383
+
+# Client errors worth retrying: a bad token may be fixed in trac.ini
+# before the last attempt, the others are transient
+RETRIED_CLIENT_ERRORS = (401, 403, 408, 429)
 
 class MattermostNotifier(Component):
-    implements(ITicketChangeListener, IWikiChangeListener, IRepositoryChangeListener)
+    implements(ITicketChangeListener, IWikiChangeListener, IRepositoryChangeListener,
+               IOutboundSender)
 
     mattermost_api_url = Option('mattermost', 'api_url', '', doc="The Mattermost API URL")
     mattermost_token = Option('mattermost', 'token', '', doc="The Mattermost token")
@@ -20,22 +30,65 @@ class MattermostNotifier(Component):
             self.log.error("Mattermost API URL, token, or channel ID not configured.")
             return
 
+        # Delivered by the dispatcher's worker threads, see send_outbound
+        OutboundDispatcher(self.env).queue('mattermost', message)
+
+    # IOutboundSender methods
+
+    def get_outbound_channels(self):
+        yield 'mattermost'
+
+    def send_outbound(self, channel, messages, session):
+        if session is None:
+            raise Exception("The requests package is needed to post to Mattermost")
         headers = {
             'Authorization': f'Bearer {self.mattermost_token}',
             'Content-Type': 'application/json'
         }
 
-        payload = {
-            'channel_id': self.mattermost_channel_id,
-            'message': message
-        }
-
-        try:
-            response = requests.post(f'{self.mattermost_api_url}/api/v4/posts', data=json.dumps(payload), headers=headers)
+        # Only the messages of the posts not sent yet are retried, those
+        # of a post refused as invalid are dropped
+        delivered = 0
+        for message, count in self.digest(messages):
+            payload = {
+                'channel_id': self.mattermost_channel_id,
+                'message': message
+            }
+            try:
+                response = session.post(
+                    f'{self.mattermost_api_url}/api/v4/posts',
+                    data=json.dumps(payload), headers=headers, timeout=10)
+            except Exception as e:
+                raise PartialDeliveryError(delivered, str(e)) from e
             if response.status_code != 201:
-                self.log.error(f"Failed to send message to Mattermost: {response.status_code}, {response.text}")
-        except Exception as e:
-            self.log.error(f"Error sending message to Mattermost: {e}")
+                error = f"Failed to send message to Mattermost: {response.status_code}, {response.text}"
+                if 400 <= response.status_code < 500 and \
+                        response.status_code not in RETRIED_CLIENT_ERRORS:
+                    raise DeliveryRejectedError(delivered, count, error)
+                raise PartialDeliveryError(delivered, error)
+            delivered += count
+
+    def digest(self, messages):
+        """Combine a burst of messages into as few posts as fit.
+
+        Returns a list of `(post, count)` tuples, `count` being the number
+        of messages combined in `post`.
+        """
+        if len(messages) == 1:
+            return [(messages[0][:MAX_POST_LENGTH], 1)]
+        posts = []
+        post = f"**{len(messages)} updates**"
+        count = 0
+        for message in messages:
+            if count and len(post) + len(message) + 2 > MAX_POST_LENGTH:
+                posts.append((post, count))
+                post = message[:MAX_POST_LENGTH]
+                count = 1
+            else:
+                post = (post + "\n\n" + message)[:MAX_POST_LENGTH]
+                count += 1
+        posts.append((post, count))
+        return posts
 
     def format_changes(self, ticket, old_values):
         """Format the changes to display old and new values generically."""
@@ -4,9 +4,11 @@ from trac.ticket.api import ITicketChangeListener
 from trac.wiki.api import IWikiChangeListener
 from trac.versioncontrol.api import IRepositoryChangeListener
 from trac.config import Option
+from trac.notification.dispatcher import IOutboundSender, OutboundDispatcher
 
 class EmailNotifier(Component):
-    implements(ITicketChangeListener, IWikiChangeListener, IRepositoryChangeListener)
+    implements(ITicketChangeListener, IWikiChangeListener, IRepositoryChangeListener,
+               IOutboundSender)
 
     email_sender = Option('email', 'sender', '', doc="The sender email address")
     email_recipient = Option('email', 'recipient', '', doc="The recipient email address")
@@ -16,13 +18,30 @@ class EmailNotifier(Component):
             self.log.error("Sender or recipient email address not configured.")
             return
 
+        # Delivered by the dispatcher's worker threads, see send_outbound
+        OutboundDispatcher(self.env).queue('email', {'subject': subject, 'message': message})
+
+    # IOutboundSender methods
+
+    def get_outbound_channels(self):
+        yield 'email'
+
+    def send_outbound(self, channel, emails, session):
+        # A burst of events becomes one digest mail instead of one
+        # sendmail process per event.
+        if len(emails) == 1:
+            subject = emails[0]['subject']
+            message = emails[0]['message']
+        else:
+            subject = f"{len(emails)} STAT updates"
+            message = "\n\n".join(f"{e['subject']}\n{e['message']}" for e in emails)
+
         email_message = f"From: {self.email_sender}\nTo: {self.email_recipient}\nSubject: {subject}\n\n{message}"
 
-        try:
-            process = subprocess.Popen(['/usr/sbin/sendmail', '-t', '-oi'], stdin=subprocess.PIPE)
-            process.communicate(email_message.encode('utf-8'))
-        except Exception as e:
-            self.log.error(f"Error sending email: {e}")
+        process = subprocess.Popen(['/usr/sbin/sendmail', '-t', '-oi'], stdin=subprocess.PIPE)
+        process.communicate(email_message.encode('utf-8'))
+        if process.returncode:
+            raise Exception(f"sendmail exited with status {process.returncode}")
 
     def format_changes(self, ticket, old_values):
         """Format the changes to display old and new values generically."""
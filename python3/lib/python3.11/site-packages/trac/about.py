@@ -54,6 +54,9 @@ class AboutModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/about', '/about_trac']
+
     def match_request(self, req):
         return re.match(r'/about(?:_trac)?$', req.path_info)
 
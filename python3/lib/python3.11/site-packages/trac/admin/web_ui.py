@@ -68,6 +68,9 @@ class AdminModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/admin']
+
     def match_request(self, req):
         match = re.match('/admin(?:/([^/]+)(?:/([^/]+)(?:/(.+))?)?)?$',
                          req.path_info)
@@ -158,6 +158,9 @@ class AttachmentModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/attachment', '/raw-attachment', '/zip-attachment']
+
     def match_request(self, req):
         match = re.match(r'/(raw-|zip-)?attachment/([^/]+)(?:/(.*))?$',
                          req.path_info)
@@ -322,6 +325,18 @@ class AttachmentModule(Component):
         `resource_realm.realm` whose filename, description or author match
         the given terms.
         """
+        from trac.search.index import SearchIndex
+        hits = SearchIndex(self.env).search(terms, self.realm,
+                                            resource_realm.realm)
+        if hits is not None:
+            for filename, parent_realm, id, title, desc, author, time, \
+                    score, snippet in hits:
+                attachment = resource_realm(id=id).child(self.realm, filename)
+                if 'ATTACHMENT_VIEW' in req.perm(attachment):
+                    yield (get_resource_url(self.env, attachment, req.href),
+                           get_resource_shortname(self.env, attachment),
+                           from_utimestamp(time), author, snippet, score)
+            return
         with self.env.db_query as db:
             sql_query, args = search_to_sql(
                     db, ['filename', 'description', 'author'], terms)
@@ -1029,6 +1044,13 @@ class LegacyAttachmentPolicy(Component):
                 if decision is not None:
                     return decision
 
+    def check_permissions(self, action, username, resources, perm):
+        if action not in self._perm_maps:
+            return [None] * len(resources)
+        return [self.check_permission(action, username, resource,
+                                      perm(resource))
+                for resource in resources]
+
 
 class AttachmentAdmin(Component):
     """trac-admin command provider for attachment administration."""
@@ -19,7 +19,8 @@ from configparser import (ConfigParser, NoOptionError, NoSectionError,
                           ParsingError)
 
 from trac.admin import AdminCommandError, IAdminCommandProvider
-from trac.core import Component, ExtensionPoint, TracError, implements
+from trac.core import Component, ExtensionPoint, Interface, TracError, \
+                      implements
 from trac.util import AtomicFile, as_bool
 from trac.util.compat import wait_for_file_mtime_change
 from trac.util.html import tag
@@ -29,7 +30,7 @@ from trac.util.translation import N_, _, dgettext, tag_
 __all__ = ['Configuration', 'ConfigSection', 'Option', 'BoolOption',
            'IntOption', 'FloatOption', 'ListOption', 'ChoiceOption',
            'PathOption', 'ExtensionOption', 'OrderedExtensionsOption',
-           'ConfigurationError']
+           'ConfigurationError', 'IConfigurationChangeListener']
 
 _use_default = object()
 
@@ -76,6 +77,35 @@ class ConfigurationError(TracError):
         super().__init__(message, title, show_traceback)
 
 
+class IConfigurationChangeListener(Interface):
+    """Extension point interface for components that apply changes of
+    the configuration file to a running environment.
+
+    The environment is reloaded when the changed sections are not all
+    returned by `get_config_sections` of some listener, or read again
+    on each use (e.g. `[project]`). Changes to the `[components]`,
+    `[inherit]` and `[logging]` sections and to the `[trac] database`
+    option always reload it.
+
+    :since: 1.6
+    """
+
+    def get_config_sections():
+        """Return an iterable of the names of the sections whose changes
+        the component applies. Every option of these sections must then
+        be read again after the notification by all the components
+        using them, as the environment is not reloaded.
+        """
+
+    def config_sections_changed(changes):
+        """Called when options of the sections returned by
+        `get_config_sections` have been added, changed or removed.
+
+        `changes` is a `dict` mapping the name of each changed section
+        to the `set` of the names of the changed options.
+        """
+
+
 class UnicodeConfigParser(ConfigParser):
     """A Unicode-aware version of ConfigParser. Arguments are encoded to
     UTF-8 and return values are decoded from UTF-8.
@@ -144,6 +174,7 @@ class Configuration(object):
         self.filename = filename
         self.parser = UnicodeConfigParser()
         self._pristine_parser = None
+        self._parsed_parser = None
         self.parents = []
         self._lastmtime = 0
         self._sections = {}
@@ -361,6 +392,7 @@ class Configuration(object):
                 raise TracError(e) from e
             self._lastmtime = modtime
             self._pristine_parser = copy.deepcopy(self.parser)
+            self._parsed_parser = self._pristine_parser
             changed = True
 
         if changed:
@@ -373,6 +405,34 @@ class Configuration(object):
             self._sections = {}
         return changed
 
+    def reload_if_needed(self):
+        """Reparse the configuration file and its parents if they have
+        been modified, and return the changed options.
+
+        :return: a `dict` mapping the name of each section with options
+                 added, changed or removed to the `set` of the names of
+                 those options, or `None` if the files have not been
+                 modified. The `dict` is empty when the files have only
+                 been touched, e.g. to force a reload of the environment.
+        :since: 1.6
+        """
+        # Changes saved by this process are compared to the contents of
+        # the files when last read, as they were not notified either.
+        old_parsers = self._get_parsed_parsers()
+        if not self.parse_if_needed():
+            return None
+        old_values = _effective_values(old_parsers)
+        new_values = _effective_values(self._get_parsed_parsers())
+        changes = {}
+        for section in set(old_values) | set(new_values):
+            old_options = old_values.get(section, {})
+            new_options = new_values.get(section, {})
+            names = {name for name in set(old_options) | set(new_options)
+                          if old_options.get(name) != new_options.get(name)}
+            if names:
+                changes[section] = names
+        return changes
+
     def touch(self):
         if self.filename and self.exists \
                 and os.access(self.filename, os.W_OK):
@@ -418,6 +478,13 @@ class Configuration(object):
                 _parents.append(Configuration(filename))
         return _parents
 
+    def _get_parsed_parsers(self):
+        # Parsers of the files as read, in lookup order of the options.
+        parsers = [self._parsed_parser]
+        for parent in self.parents:
+            parsers.extend(parent._get_parsed_parsers())
+        return parsers
+
     def _write(self, parser):
         if not self.filename:
             return
@@ -427,6 +494,17 @@ class Configuration(object):
             parser.write(fd)
 
 
+def _effective_values(parsers):
+    values = {}
+    for parser in reversed(parsers):
+        if parser is None:  # Missing file
+            continue
+        for section in parser.sections():
+            values.setdefault(section, {}) \
+                  .update(parser.items(section, raw=True))
+    return values
+
+
 class Section(object):
     """Proxy for a specific configuration section.
 
@@ -29,7 +29,7 @@ from trac.db.schema import Table
 from trac.db.util import ConnectionWrapper
 from trac.util.concurrency import ThreadLocal
 from trac.util.html import tag
-from trac.util.text import unicode_passwd
+from trac.util.text import exception_to_unicode, unicode_passwd
 from trac.util.translation import _, tag_
 
 
@@ -62,7 +62,9 @@ class TransactionContextManager(DbContextManager):
     `~trac.db.util.ConnectionWrapper`.
 
     The outermost such context manager will perform a commit upon
-    normal exit or a rollback after an exception.
+    normal exit or a rollback after an exception, then call the
+    callbacks registered by `DatabaseManager.call_after_commit` if
+    committed.
     """
 
     def __enter__(self):
@@ -74,17 +76,28 @@ class TransactionContextManager(DbContextManager):
             else:
                 db = self.dbmgr.get_connection()
             self.dbmgr._transaction_local.wdb = self.db = db
+            self.dbmgr._transaction_local.after_commit = []
         return db
 
     def __exit__(self, et, ev, tb):
         if self.db:
+            after_commit = self.dbmgr._transaction_local.after_commit
             self.dbmgr._transaction_local.wdb = None
+            self.dbmgr._transaction_local.after_commit = None
             if et is None:
                 self.db.commit()
             else:
                 self.db.rollback()
             if not self.dbmgr._transaction_local.rdb:
                 self.db.close()
+            if et is None:
+                for callback in after_commit:
+                    try:
+                        callback()
+                    except Exception as e:
+                        self.dbmgr.log.error(
+                            "Exception caught after commit: %s",
+                            exception_to_unicode(e, traceback=True))
 
 
 class QueryContextManager(DbContextManager):
@@ -113,6 +126,18 @@ class QueryContextManager(DbContextManager):
 class ConnectionBase(object, metaclass=ABCMeta):
     """Abstract base class for database connection classes."""
 
+    #: Whether the database supports window functions such as
+    #: `COUNT(*) OVER ()`.
+    supports_window_functions = False
+
+    def streaming_cursor(self):
+        """Return a cursor reading the rows of a query from the server
+        as they are fetched, instead of all at once, if the database
+        supports it. Other queries can be executed on the connection
+        while the cursor is read.
+        """
+        return self.cursor()
+
     @abstractmethod
     def cast(self, column, type):
         """Returns a clause casting `column` as `type`."""
@@ -275,7 +300,8 @@ class DatabaseManager(Component):
 
     def __init__(self):
         self._cnx_pool = None
-        self._transaction_local = ThreadLocal(wdb=None, rdb=None)
+        self._transaction_local = ThreadLocal(wdb=None, rdb=None,
+                                              after_commit=None)
 
     def init_db(self):
         connector, args = self.get_connector()
@@ -408,6 +434,33 @@ class DatabaseManager(Component):
                                                col.name)
                     self.drop_tables((temp_table_name,))
 
+    @property
+    def in_transaction(self):
+        """Whether a transaction is in progress in the current thread,
+        whose changes are not visible to the other threads yet.
+
+        :since: 1.6
+        """
+        return self._transaction_local.wdb is not None
+
+    def call_after_commit(self, callback):
+        """Call `callback` without arguments once the transaction in
+        progress in the current thread is committed, or right away if
+        there is none. The call is dropped if the transaction is rolled
+        back.
+
+        Side effects of a change which must not happen unless the change
+        is committed (e.g. notifications) are deferred this way when the
+        change is part of a larger transaction.
+
+        :since: 1.6
+        """
+        after_commit = self._transaction_local.after_commit
+        if after_commit is None:
+            callback()
+        else:
+            after_commit.append(callback)
+
     def get_connection(self, readonly=False):
         """Get a database connection from the pool.
 
@@ -415,6 +415,13 @@ class MySQLConnection(ConnectionBase, ConnectionWrapper):
             cnx = pymysql.connect(db=path, user=user, passwd=password,
                                   host=host, port=port, **opts)
         self.schema = path
+        # Window functions are available since MySQL 8.0 and MariaDB 10.2
+        server_info = cnx.get_server_info()
+        match = re.match(r'(?:5\.5\.5-)?(\d+)\.(\d+)', server_info)
+        if match:
+            version = (int(match.group(1)), int(match.group(2)))
+            min_version = (10, 2) if 'MariaDB' in server_info else (8, 0)
+            self.supports_window_functions = version >= min_version
         ConnectionWrapper.__init__(self, cnx, log)
         self._is_closed = False
 
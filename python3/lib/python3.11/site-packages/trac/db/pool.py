@@ -14,6 +14,7 @@
 #
 # Author: Christopher Lenz <cmlenz@gmx.de>
 
+import collections
 import os
 import sys
 
@@ -25,6 +26,11 @@ from trac.util.text import exception_to_unicode
 from trac.util.translation import _
 
 
+#: Upper bounds in seconds of the buckets of the histogram of the times
+#: spent waiting for a connection; the last bucket has no upper bound.
+WAIT_TIME_BUCKETS = (0.001, 0.01, 0.1, 1, 10)
+
+
 class TimeoutError(TracError):
     """Exception raised by the connection pool when no connection has become
     available after a given timeout."""
@@ -64,6 +70,9 @@ class ConnectionPoolBackend(object):
         self._pool_key = []
         self._pool_time = []
         self._waiters = 0
+        self._stats = collections.Counter()
+        self._wait_time = 0
+        self._wait_histogram = [0] * (len(WAIT_TIME_BUCKETS) + 1)
 
     def get_cnx(self, connector, kwargs, timeout=None):
         cnx = None
@@ -82,12 +91,15 @@ class ConnectionPoolBackend(object):
                     cnx = self._take_cnx(connector, kwargs, key, tid)
                 if not cnx:
                     self._waiters += 1
-                    self._available.wait()
+                    waited = time_now()
+                    self._available.wait(timeout)
                     self._waiters -= 1
+                    self._record_wait(time_now() - waited)
                     cnx = self._take_cnx(connector, kwargs, key, tid)
                 num = 1
             if cnx:
                 self._active[(tid, key)] = (cnx, num)
+                self._stats['acquired'] += 1
 
         deferred = num == 1 and isinstance(cnx, tuple)
         exception = None
@@ -101,6 +113,7 @@ class ConnectionPoolBackend(object):
                     cnx.close()
                 if op in ('close', 'create'):
                     cnx = connector.get_connection(**kwargs)
+                    self._stats['created'] += 1
             except TracError as e:
                 exception = e
                 cnx = None
@@ -121,17 +134,53 @@ class ConnectionPoolBackend(object):
             # cnx couldn't be reused, clear placeholder
             with self._available:
                 del self._active[(tid, key)]
+                self._stats['acquired'] -= 1
+                self._stats['errors'] += 1
             if op == 'ping': # retry
-                return self.get_cnx(connector, kwargs)
+                return self.get_cnx(connector, kwargs, timeout)
 
         # if we didn't get a cnx after wait(), something's fishy...
         if isinstance(exception, TracError):
             raise exception
+        if not deferred:
+            with self._available:
+                self._stats['timeouts'] += 1
         timeout = time_now() - start
         errmsg = _("Unable to get database connection within %(time)d seconds.",
                    time=timeout)
         raise TimeoutError(errmsg) from exception
 
+    def get_stats(self):
+        """Return a `dict` with the current number of `active` and
+        `idle` connections and of `waiters`, the `maxsize` of the pool,
+        the number of connections `acquired` and `created`, of `errors`
+        and `timeouts` since the start of the process, and the number of
+        `waits` for a connection with their total `wait_time` in seconds
+        and their `wait_histogram`, a list of the number of waits that
+        took less than each of the `WAIT_TIME_BUCKETS`, plus the number
+        of longer waits.
+        """
+        with self._available:
+            stats = dict.fromkeys(('acquired', 'created', 'errors',
+                                   'timeouts'), 0)
+            stats.update(self._stats)
+            stats.update(active=len(self._active), idle=len(self._pool),
+                         waiters=self._waiters, maxsize=self._maxsize,
+                         waits=sum(self._wait_histogram),
+                         wait_time=self._wait_time,
+                         wait_histogram=list(self._wait_histogram))
+        return stats
+
+    def _record_wait(self, duration):
+        """Note: _available lock must be held when calling this method."""
+        self._wait_time += duration
+        for idx, bound in enumerate(WAIT_TIME_BUCKETS):
+            if duration < bound:
+                break
+        else:
+            idx = len(WAIT_TIME_BUCKETS)
+        self._wait_histogram[idx] += 1
+
     def _take_cnx(self, connector, kwargs, key, tid):
         """Note: _available lock must be held when calling this method."""
         # Second best option: Reuse a live pooled connection
@@ -204,6 +253,13 @@ _pool_size = int(os.environ.get('TRAC_DB_POOL_SIZE', 10))
 _backend = ConnectionPoolBackend(_pool_size)
 
 
+def get_pool_stats():
+    """Return the statistics of the connection pool of the process, as
+    returned by `ConnectionPoolBackend.get_stats`.
+    """
+    return _backend.get_stats()
+
+
 class ConnectionPool(object):
     def __init__(self, maxsize, connector, **kwargs):
         # maxsize not used right now but kept for api compatibility
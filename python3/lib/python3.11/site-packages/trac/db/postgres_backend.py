@@ -18,6 +18,7 @@ from ctypes.util import find_library
 import ctypes
 import os
 import re
+import uuid
 from pkg_resources import DistributionNotFound
 from subprocess import Popen, PIPE
 
@@ -319,6 +320,7 @@ class PostgreSQLConnection(ConnectionBase, ConnectionWrapper):
     """Connection wrapper for PostgreSQL."""
 
     poolable = True
+    supports_window_functions = True
 
     def __init__(self, path, log=None, user=None, password=None, host=None,
                  port=None, params={}):
@@ -344,6 +346,13 @@ class PostgreSQLConnection(ConnectionBase, ConnectionWrapper):
     def cursor(self):
         return IterableCursor(self.cnx.cursor(), self.log)
 
+    def streaming_cursor(self):
+        # Named cursors are server-side cursors. Their `description` is
+        # only set once rows have been fetched.
+        cursor = self.cnx.cursor('trac_%s' % uuid.uuid4().hex)
+        cursor.itersize = 1000
+        return IterableCursor(cursor, self.log)
+
     def cast(self, column, type):
         # Temporary hack needed for the union of selects in the search module
         return 'CAST(%s AS %s)' % (column, _type_map.get(type, type))
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 Hewlett Packard Enterprise Development LP.
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at https://trac.edgewall.org/wiki/TracLicense.
+
+"""Profile of the SQL queries executed by the request handlers.
+
+When `[trac] profile_sql` is enabled, the queries executed while
+processing each request are recorded by fingerprint, i.e. with their
+literal values and parameters replaced by `?`, and added up per request
+handler. Queries executed many times by a single request usually come
+from plugins reading data item by item in a loop (the "N+1" pattern).
+
+Each process shows its own statistics, with those of the database
+connection pool, in the ''Database'' administration panel. It also
+writes them regularly to the `cache/dbprofile` directory of the
+environment, where `trac-admin $ENV db profile` adds up the statistics
+of all the processes serving the environment.
+
+Independently of the profile, the queries slower than `[trac]
+slow_sql_threshold` and those executed more than `[trac]
+repeated_sql_threshold` times by a single request are logged.
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from trac.admin.api import AdminCommandError, IAdminCommandProvider, \
+                           IAdminPanelProvider
+from trac.config import BoolOption, IntOption
+from trac.core import Component, implements
+from trac.db.pool import WAIT_TIME_BUCKETS, get_pool_stats
+from trac.db.util import QueryRecorder
+from trac.util import AtomicFile
+from trac.util.text import print_table, printout, shorten_line
+from trac.util.translation import _
+from trac.web.api import IRequestFilter
+from trac.web.chrome import add_notice
+
+
+__all__ = ['QueryProfiler']
+
+
+class QueryProfiler(Component):
+    """Record the SQL queries executed by each request handler."""
+
+    implements(IAdminCommandProvider, IAdminPanelProvider, IRequestFilter)
+
+    profile = BoolOption('trac', 'profile_sql', False,
+        """Record the number, time and returned rows of the SQL queries
+        executed by each request handler, grouped by query. The
+        statistics are shown in the ''Database'' administration panel and
+        by `trac-admin $ENV db profile`. (''since 1.6'')""")
+
+    slow_threshold = IntOption('trac', 'slow_sql_threshold', 0,
+        """Log at WARNING level the SQL queries taking at least this
+        number of milliseconds, with the request executing them. Set to
+        `0` to disable. (''since 1.6'')""")
+
+    repeated_threshold = IntOption('trac', 'repeated_sql_threshold', 0,
+        """Log at WARNING level the SQL queries executed at least this
+        number of times by a single request, which usually reads data
+        item by item in a loop instead of reading it at once. Set to `0`
+        to disable. (''since 1.6'')""")
+
+    #: Minimum interval in seconds between two writes of the statistics
+    #: of the process to the `cache/dbprofile` directory.
+    dump_interval = 30
+
+    #: Maximum number of distinct queries recorded per process.
+    max_queries = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._reset()
+        self._dumped = None
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('db profile clear', '',
+               """Clear the SQL query statistics of all the processes""",
+               None, self._do_profile_clear)
+        yield ('db profile', '[handler]',
+               """Show the SQL queries executed by the request handlers
+
+               Adds up the statistics written by the processes serving
+               the environment when [trac] profile_sql is enabled. The
+               most time consuming queries of all the handlers are listed,
+               unless a request handler is specified.
+               """,
+               self._complete_profile, self._do_profile)
+
+    # IAdminPanelProvider methods
+
+    def get_admin_panels(self, req):
+        if 'TRAC_ADMIN' in req.perm('admin', 'general/database'):
+            yield ('general', _("General"), 'database', _("Database"))
+
+    def render_admin_panel(self, req, cat, page, path_info):
+        req.perm('admin', 'general/database').require('TRAC_ADMIN')
+        if req.method == 'POST':
+            if req.args.get('clear'):
+                self.clear()
+                add_notice(req, _("The SQL query statistics have been "
+                                  "cleared."))
+            req.redirect(req.href.admin(cat, page))
+        profile = self.get_profile()
+        return 'admin_database.html', {
+            'enabled': self.profile,
+            'pool': get_pool_stats(),
+            'wait_buckets': WAIT_TIME_BUCKETS,
+            'handlers': self._sorted_handlers(profile),
+            'queries': self._sorted_queries(profile)[:50],
+            'recent': list(reversed(self._recent)),
+        }
+
+    # IRequestFilter methods
+
+    def pre_process_request(self, req, handler):
+        if handler is not None:
+            self._local.handler = handler.__class__.__name__
+        return handler
+
+    def post_process_request(self, req, template, data, metadata):
+        return template, data, metadata
+
+    # Public API
+
+    @contextmanager
+    def profile_request(self, req):
+        """Record the SQL queries executed by the current thread while
+        processing `req`, if enabled by the configuration."""
+        profile = self.profile
+        slow = self.slow_threshold
+        if not profile and slow <= 0 and self.repeated_threshold <= 0:
+            yield
+            return
+        self._local.handler = None
+        recorder = QueryRecorder(slow / 1000 if slow > 0 else None)
+        start = time.perf_counter()
+        try:
+            with recorder:
+                yield
+        finally:
+            self._request_done(req, self._local.handler or '-', recorder,
+                               time.perf_counter() - start, profile)
+
+    def get_profile(self):
+        """Return the statistics of this process, a `dict` mapping the
+        name of each request handler to a `dict` with the number of
+        `requests`, of `queries` and their `time`, and the statistics of
+        the distinct `fingerprints`: their number of executions, time,
+        rows and maximum number of executions by a single request.
+        """
+        with self._lock:
+            return {name: dict(stats, fingerprints={
+                        fp: list(values)
+                        for fp, values in stats['fingerprints'].items()})
+                    for name, stats in self._handlers.items()}
+
+    def clear(self):
+        """Clear the statistics of this process and remove those written
+        by all the processes, which clear theirs when they notice it."""
+        with self._lock:
+            self._reset()
+        for path in self._get_dump_files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # Internal methods
+
+    def _reset(self):
+        self._handlers = {}
+        self._num_queries = 0
+        self._recent = collections.deque(maxlen=20)
+
+    def _request_done(self, req, handler, recorder, duration, profile):
+        self.log.debug("%d SQL queries in %.1f ms while processing %s %s "
+                       "(%.1f ms)", recorder.count, recorder.time * 1000,
+                       req.method, req.path_info, duration * 1000)
+        for query_time, sql in recorder.slow:
+            self.log.warning("Slow SQL query (%.1f ms) in %s %s by %s: %s",
+                             query_time * 1000, req.method, req.path_info,
+                             handler, sql)
+        threshold = self.repeated_threshold
+        if threshold > 0:
+            for fp, (count, query_time, rows) in recorder.queries.items():
+                if count >= threshold:
+                    self.log.warning("SQL query executed %d times (%.1f ms) "
+                                     "in %s %s by %s: %s", count,
+                                     query_time * 1000, req.method,
+                                     req.path_info, handler, fp)
+        if profile:
+            self._add(req, handler, recorder, duration)
+            self._dump_if_needed()
+
+    def _add(self, req, handler, recorder, duration):
+        with self._lock:
+            stats = self._handlers.get(handler)
+            if stats is None:
+                stats = self._handlers[handler] = {
+                    'requests': 0, 'queries': 0, 'time': 0,
+                    'fingerprints': {}}
+            stats['requests'] += 1
+            stats['queries'] += recorder.count
+            stats['time'] += recorder.time
+            fingerprints = stats['fingerprints']
+            for fp, (count, query_time, rows) in recorder.queries.items():
+                values = fingerprints.get(fp)
+                if values is None:
+                    if self._num_queries >= self.max_queries:
+                        continue
+                    self._num_queries += 1
+                    values = fingerprints[fp] = [0, 0, 0, 0]
+                values[0] += count
+                values[1] += query_time
+                values[2] += rows
+                values[3] = max(values[3], count)
+            self._recent.append((time.time(), req.method, req.path_info,
+                                 handler, recorder.count, recorder.time,
+                                 duration))
+
+    def _dump_if_needed(self):
+        now = time.time()
+        if self._dumped and now - self._dumped[0] < self.dump_interval:
+            return
+        path = os.path.join(self._get_dump_dir(), '%d.json' % os.getpid())
+        if self._dumped and self._dumped[1] == path and \
+                not os.path.exists(path):
+            # Removed by `clear()` in another process.
+            with self._lock:
+                self._reset()
+        self._dumped = (now, path)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with AtomicFile(path) as f:
+                json.dump({'pid': os.getpid(), 'time': now,
+                           'pool': get_pool_stats(),
+                           'handlers': self.get_profile()}, f)
+        except OSError as e:
+            self.log.warning("Can't write the SQL query statistics to %s: "
+                             "%s", path, e)
+
+    def _get_dump_dir(self):
+        return os.path.join(self.env.cache_dir, 'dbprofile')
+
+    def _get_dump_files(self):
+        dump_dir = self._get_dump_dir()
+        try:
+            names = os.listdir(dump_dir)
+        except OSError:
+            return []
+        return [os.path.join(dump_dir, name) for name in sorted(names)
+                if name.endswith('.json')]
+
+    def _load_dumps(self):
+        dumps = []
+        for path in self._get_dump_files():
+            try:
+                with open(path, encoding='utf-8') as f:
+                    dumps.append(json.load(f))
+            except (OSError, ValueError) as e:
+                self.log.warning("Can't read the SQL query statistics from "
+                                 "%s: %s", path, e)
+        return dumps
+
+    def _merge_profiles(self, profiles):
+        merged = {}
+        for profile in profiles:
+            for name, stats in profile.items():
+                total = merged.setdefault(name, {
+                    'requests': 0, 'queries': 0, 'time': 0,
+                    'fingerprints': {}})
+                for key in ('requests', 'queries', 'time'):
+                    total[key] += stats[key]
+                for fp, values in stats['fingerprints'].items():
+                    total_values = total['fingerprints'] \
+                                   .setdefault(fp, [0, 0, 0, 0])
+                    for idx in range(3):
+                        total_values[idx] += values[idx]
+                    total_values[3] = max(total_values[3], values[3])
+        return merged
+
+    def _sorted_handlers(self, profile):
+        return sorted(((name, stats['requests'], stats['queries'],
+                        stats['time']) for name, stats in profile.items()),
+                      key=lambda row: row[3], reverse=True)
+
+    def _sorted_queries(self, profile, handler=None):
+        return sorted(((fp, name, count, query_time, rows,
+                        count / stats['requests'], max_count)
+                       for name, stats in profile.items()
+                       if handler is None or name == handler
+                       for fp, (count, query_time, rows, max_count)
+                       in stats['fingerprints'].items()),
+                      key=lambda row: row[3], reverse=True)
+
+    def _complete_profile(self, args):
+        if len(args) == 1:
+            return ['clear'] + \
+                   list(self._merge_profiles(dump['handlers']
+                                             for dump in self._load_dumps()))
+
+    def _do_profile(self, handler=None):
+        dumps = self._load_dumps()
+        if not dumps:
+            printout(_("No SQL query statistics found. Enable [trac] "
+                       "profile_sql and send some requests to the web "
+                       "server."))
+            return
+        profile = self._merge_profiles(dump['handlers'] for dump in dumps)
+        if handler is not None and handler not in profile:
+            raise AdminCommandError(_("No SQL query statistics for the "
+                                      "request handler %(name)s.",
+                                      name=handler))
+        ms = lambda seconds: '%.1f' % (seconds * 1000)
+
+        printout(_("Connection pools:"))
+        print_table([(dump['pid'],
+                      time.strftime('%Y-%m-%d %H:%M:%S',
+                                    time.localtime(dump['time'])),
+                      dump['pool']['active'], dump['pool']['idle'],
+                      dump['pool']['maxsize'], dump['pool']['waits'],
+                      ms(dump['pool']['wait_time']),
+                      dump['pool']['timeouts'])
+                     for dump in dumps],
+                    [_("Process"), _("Updated"), _("Active"), _("Idle"),
+                     _("Size"), _("Waits"), _("Wait (ms)"), _("Timeouts")])
+        if handler is None:
+            printout(_("Request handlers:"))
+            print_table([(name, requests, queries,
+                          '%.1f' % (queries / requests), ms(query_time))
+                         for name, requests, queries, query_time
+                         in self._sorted_handlers(profile)],
+                        [_("Handler"), _("Requests"), _("Queries"),
+                         _("Per request"), _("Time (ms)")])
+            queries = self._sorted_queries(profile)[:20]
+            width = 100
+        else:
+            queries = self._sorted_queries(profile, handler)
+            width = None
+        printout(_("SQL queries:"))
+        print_table([(name, count, '%.1f' % per_request, max_count,
+                      ms(query_time), rows,
+                      shorten_line(fp, width) if width else fp)
+                     for fp, name, count, query_time, rows, per_request,
+                         max_count in queries],
+                    [_("Handler"), _("Count"), _("Per request"), _("Max"),
+                     _("Time (ms)"), _("Rows"), _("Query")])
+
+    def _do_profile_clear(self):
+        self.clear()
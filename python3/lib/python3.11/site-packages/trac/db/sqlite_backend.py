@@ -291,6 +291,7 @@ class SQLiteConnection(ConnectionBase, ConnectionWrapper):
     __slots__ = ['_active_cursors', '_eager']
 
     poolable = sqlite_version >= (3, 3, 8)
+    supports_window_functions = sqlite_version >= (3, 25, 0)
 
     def __init__(self, path, log=None, params={}):
         self.cnx = None
@@ -336,6 +337,12 @@ class SQLiteConnection(ConnectionBase, ConnectionWrapper):
         cursor.cnx = self
         return IterableCursor(cursor, self.log)
 
+    def streaming_cursor(self):
+        cursor = self.cnx.cursor(PyFormatCursor)
+        self._active_cursors[cursor] = True
+        cursor.cnx = self
+        return IterableCursor(cursor, self.log)
+
     def rollback(self):
         for cursor in self._active_cursors:
             cursor.close()
@@ -15,14 +15,27 @@
 #
 # Author: Christopher Lenz <cmlenz@gmx.de>
 
+import functools
 import re
+import time
 from contextlib import closing
 
+from trac.util.concurrency import threading
+
 _sql_escape_percent_re = re.compile("""
     '(?:[^']+|'')*' |
     `(?:[^`]+|``)*` |
     "(?:[^"]+|"")*" """, re.VERBOSE)
 
+_sql_values_re = re.compile(r"""
+    '(?:[^']|'')*' |
+    \b[0-9]+(?:\.[0-9]+)?\b |
+    %s """, re.VERBOSE)
+
+_sql_value_list_re = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+_query_recorders = threading.local()
+
 
 def sql_escape_percent(sql):
     def repl(match):
@@ -54,6 +67,39 @@ class IterableCursor(object):
             yield row
 
     def execute(self, sql, args=None):
+        recorder = getattr(_query_recorders, 'current', None)
+        if recorder is None:
+            return self._execute(sql, args)
+        rows = None
+        start = time.perf_counter()
+        try:
+            result = self._execute(sql, args)
+            rows = self._get_rowcount()
+            return result
+        finally:
+            recorder.record(sql, time.perf_counter() - start, rows)
+
+    def executemany(self, sql, args):
+        recorder = getattr(_query_recorders, 'current', None)
+        if recorder is None:
+            return self._executemany(sql, args)
+        rows = None
+        start = time.perf_counter()
+        try:
+            result = self._executemany(sql, args)
+            rows = self._get_rowcount(many=True)
+            return result
+        finally:
+            recorder.record(sql, time.perf_counter() - start, rows)
+
+    def _get_rowcount(self, many=False):
+        rows = getattr(self.cursor, 'rows', None)
+        if rows is not None and not many:  # Prefetched by `EagerCursor`
+            return len(rows)
+        rowcount = getattr(self.cursor, 'rowcount', -1)
+        return rowcount if rowcount >= 0 else None
+
+    def _execute(self, sql, args=None):
         if self.log:
             self.log.debug('SQL: %s', sql)
             try:
@@ -73,7 +119,7 @@ class IterableCursor(object):
             return self.cursor.execute(sql_escape_percent(sql), args)
         return self.cursor.execute(sql)
 
-    def executemany(self, sql, args):
+    def _executemany(self, sql, args):
         if self.log:
             self.log.debug('SQL: %r', sql)
             self.log.debug('args: %r', args)
@@ -159,3 +205,83 @@ class ConnectionWrapper(object):
         if self.readonly and not dql:
             raise ValueError("a 'readonly' connection can only do a SELECT")
         return dql
+
+
+class QueryRecorder(object):
+    """Statistics of the SQL queries executed by the current thread while
+    the recorder is active, grouped by `sql_fingerprint`.
+
+    The recorder is activated as a context manager::
+
+        with QueryRecorder() as recorder:
+            ...
+        for fingerprint, (count, time, rows) in recorder.queries.items():
+            ...
+
+    `time` is in seconds and `rows` is the number of rows returned or
+    affected, when the database driver reports it.
+
+    :param slow_threshold: if not `None`, the queries which took at
+                           least that number of seconds are kept in
+                           `slow` as `(time, sql)` tuples.
+    :since: 1.6
+    """
+
+    def __init__(self, slow_threshold=None):
+        self.queries = {}
+        self.count = 0
+        self.time = 0
+        self.slow_threshold = slow_threshold
+        self.slow = []
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = getattr(_query_recorders, 'current', None)
+        _query_recorders.current = self
+        return self
+
+    def __exit__(self, et, ev, tb):
+        _query_recorders.current = self._previous
+        self._previous = None
+
+    def record(self, sql, duration, rows=None):
+        """Add an execution of `sql` which took `duration` seconds and
+        returned or affected `rows` rows."""
+        fingerprint = sql_fingerprint(sql)
+        stats = self.queries.get(fingerprint)
+        if stats is None:
+            stats = self.queries[fingerprint] = [0, 0, 0]
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] += rows or 0
+        self.count += 1
+        self.time += duration
+        if self.slow_threshold is not None and \
+                duration >= self.slow_threshold:
+            self.slow.append((duration, sql))
+
+
+def get_query_recorder():
+    """Return the active `QueryRecorder` of the current thread, or `None`.
+
+    :since: 1.6
+    """
+    return getattr(_query_recorders, 'current', None)
+
+
+@functools.lru_cache(maxsize=1024)
+def sql_fingerprint(sql):
+    """Return the `sql` query with its literal values and parameters
+    replaced by `?`, lists of them by `(?, ...)` and its whitespace
+    normalized, so that the executions of a query with different values
+    share the same fingerprint.
+
+    >>> sql_fingerprint("SELECT * FROM ticket WHERE id IN (%s,%s) AND "
+    ...                 "status='new'")
+    'SELECT * FROM ticket WHERE id IN (?, ...) AND status=?'
+
+    :since: 1.6
+    """
+    sql = _sql_values_re.sub('?', sql)
+    sql = _sql_value_list_re.sub('(?, ...)', sql)
+    return ' '.join(sql.split())
@@ -34,21 +34,23 @@ from trac.admin.api import (AdminCommandError, IAdminCommandProvider,
 from trac.api import IEnvironmentSetupParticipant, ISystemInfoProvider
 from trac.cache import CacheManager, cached
 from trac.config import BoolOption, ChoiceOption, ConfigSection, \
-                        Configuration, IntOption, Option, PathOption
-from trac.core import Component, ComponentManager, ExtensionPoint, \
-                      TracBaseError, TracError, implements
+                        Configuration, IConfigurationChangeListener, \
+                        IntOption, Option, PathOption
+from trac.core import Component, ComponentManager, ComponentMeta, \
+                      ExtensionPoint, TracBaseError, TracError, implements
 from trac.db.api import (DatabaseManager, QueryContextManager,
                          TransactionContextManager, parse_connection_uri)
 from trac.db.convert import copy_tables
-from trac.loader import load_components
+from trac.loader import import_times, load_components
 from trac.util import as_bool, backup_config_file, copytree, create_file, \
                       get_pkginfo, is_path_below, lazy, makedirs
 from trac.util.compat import close_fds
 from trac.util.concurrency import threading
 from trac.util.datefmt import pytz
 from trac.util.text import exception_to_unicode, path_to_unicode, printerr, \
-                           printferr, printfout, printout
+                           printferr, printfout, printout, print_table
 from trac.util.translation import _, N_
+from trac.web.assets import MANIFEST_NAME, build_assets
 from trac.web.chrome import Chrome
 from trac.web.href import Href
 
@@ -83,6 +85,11 @@ class Environment(Component, ComponentManager):
 
     system_info_providers = ExtensionPoint(ISystemInfoProvider)
     setup_participants = ExtensionPoint(IEnvironmentSetupParticipant)
+    config_change_listeners = ExtensionPoint(IConfigurationChangeListener)
+
+    # Sections read again on each use, whose changes apply without
+    # reloading the environment.
+    _live_config_sections = ('header_logo', 'mainnav', 'metanav', 'project')
 
     components_section = ConfigSection('components',
         """Enable or disable components provided by Trac and plugins.
@@ -297,6 +304,36 @@ class Environment(Component, ComponentManager):
         return sorted(set(info),
                       key=lambda args: (args[0] != 'Trac', args[0].lower()))
 
+    def apply_config_changes(self, changes):
+        """Notify the components of the changes of the configuration
+        returned by `Configuration.reload_if_needed`.
+
+        Return `False` without notifying the components if the changes
+        can't be applied to the running environment, which must then be
+        reloaded: the set of enabled components, the plugins, the logging
+        and the database connection are only set up at startup, and the
+        sections which are neither read on each use nor handled by an
+        `IConfigurationChangeListener` may have been read once.
+
+        :since: 1.6
+        """
+        if {'components', 'inherit', 'logging'} & set(changes) or \
+                'database' in changes.get('trac', ()):
+            return False
+        applied = set(self._live_config_sections)
+        for listener in self.config_change_listeners:
+            applied.update(listener.get_config_sections())
+        if not applied.issuperset(changes):
+            return False
+        for listener in self.config_change_listeners:
+            sections = set(listener.get_config_sections())
+            notified = {section: names for section, names in changes.items()
+                                       if section in sections}
+            if notified:
+                with self.component_guard(listener):
+                    listener.config_sections_changed(notified)
+        return True
+
     # ISystemInfoProvider methods
 
     def get_system_info(self):
@@ -630,6 +667,15 @@ class Environment(Component, ComponentManager):
         """
         return self._get_path_to_dir('files', 'attachments')
 
+    @lazy
+    def cache_dir(self):
+        """Absolute path to the cache directory, holding data that can be
+        rebuilt. It is created on demand.
+
+        :since: 1.6
+        """
+        return self._get_path_to_dir('cache')
+
     @lazy
     def conf_dir(self):
         """Absolute path to the conf directory.
@@ -849,14 +895,20 @@ def open_environment(env_path=None, use_cache=False):
     if use_cache:
         with env_cache_lock:
             env = env_cache.get(env_path)
-            if env and env.config.parse_if_needed():
-                # The environment configuration has changed, so shut it down
-                # and remove it from the cache so that it gets reinitialized
+            changes = env.config.reload_if_needed() if env else None
+            if changes is not None and \
+                    (not changes or not env.apply_config_changes(changes)):
+                # The environment configuration has changed or has been
+                # touched, so shut it down and remove it from the cache so
+                # that it gets reinitialized
                 env.log.info('Reloading environment due to configuration '
                              'change')
                 env.shutdown()
                 del env_cache[env_path]
                 env = None
+            elif changes:
+                env.log.info('Applied configuration change of section(s) '
+                             '%s', ', '.join(sorted(changes)))
             if env is None:
                 env = env_cache.setdefault(env_path,
                                            open_environment(env_path))
@@ -912,9 +964,17 @@ class EnvironmentAdmin(Component):
                the database, particularly when doing an in-place conversion.
                """,
                self._complete_convert_db, self._do_convert_db)
-        yield ('deploy', '<directory>',
-               'Extract static resources from Trac and all plugins',
-               None, self._do_deploy)
+        yield ('deploy', '<directory> [--fingerprint]',
+               """Extract static resources from Trac and all plugins
+
+               With the --fingerprint option, the style sheets and
+               scripts are also copied to names containing a hash of
+               their content, the text resources are precompressed and
+               the names are listed in htdocs/manifest.json. Set the
+               [trac] htdocs_manifest option to that file to reference
+               the fingerprinted names, which can be cached forever.
+               """,
+               self._complete_deploy, self._do_deploy)
         yield ('hotcopy', '<backupdir> [--no-database]',
                """Make a hot backup copy of an environment
 
@@ -923,6 +983,14 @@ class EnvironmentAdmin(Component):
                specified.
                """,
                None, self._do_hotcopy)
+        yield ('plugin profile', '',
+               """Show the time spent loading each plugin
+
+               Lists the time spent by this process importing the modules
+               of each plugin, and the time spent activating their enabled
+               components in a newly opened environment.
+               """,
+               None, self._do_plugin_profile)
         yield ('upgrade', '[--no-backup]',
                """Upgrade database to current version
 
@@ -943,7 +1011,16 @@ class EnvironmentAdmin(Component):
         if len(args) == 2:
             return get_dir_list(args[1])
 
-    def _do_deploy(self, dest):
+    def _complete_deploy(self, args):
+        if len(args) == 1:
+            return get_dir_list(args[0])
+        elif len(args) == 2:
+            return ['--fingerprint']
+
+    def _do_deploy(self, dest, fingerprint=None):
+        if fingerprint not in (None, '--fingerprint'):
+            raise AdminCommandError(_("Invalid argument '%(arg)s'",
+                                      arg=fingerprint), show_usage=True)
         target = os.path.normpath(dest)
         chrome_target = os.path.join(target, 'htdocs')
         script_target = os.path.join(target, 'cgi-bin')
@@ -986,6 +1063,13 @@ class EnvironmentAdmin(Component):
                     dest = os.path.join(chrome_target, key)
                     copytree(source, dest, overwrite=True)
 
+        if fingerprint:
+            printout(_("Fingerprinting resources."))
+            manifest = build_assets(chrome_target)
+            printout(_("Fingerprinted %(num)s resources, listed in "
+                       "%(manifest)s.", num=len(manifest),
+                       manifest=os.path.join(chrome_target, MANIFEST_NAME)))
+
         # Create and copy scripts
         makedirs(script_target, overwrite=True)
         printout(_("Creating scripts."))
@@ -1056,6 +1140,63 @@ class EnvironmentAdmin(Component):
         printout(_("Hotcopy done."))
         return retval
 
+    def _do_plugin_profile(self):
+        def plugin_of(module_name):
+            for name in import_times:
+                if module_name == name or module_name.startswith(name + '.'):
+                    return name
+            return module_name
+
+        # Existing components are activated again in a new environment,
+        # which shares the logger of this one.
+        handlers = list(self.env.log.handlers)
+        env = Environment(self.env.path)
+        activation = {}
+        components = {}
+        try:
+            for cls in ComponentMeta._components:
+                plugin = plugin_of(cls.__module__)
+                components[plugin] = components.get(plugin, 0) + 1
+                if cls in env.components or not env.is_component_enabled(cls):
+                    continue
+                start = time.perf_counter()
+                try:
+                    env[cls]
+                except Exception as e:
+                    printerr(_("Can't activate %(component)s: %(error)s",
+                               component=cls.__module__ + '.' + cls.__name__,
+                               error=exception_to_unicode(e)))
+                activation[plugin] = activation.get(plugin, 0) + \
+                                     time.perf_counter() - start
+        finally:
+            # Only close the handlers added by the new environment, the
+            # others are detached while it shuts down.
+            for handler in env.log.handlers[:]:
+                if handler not in handlers:
+                    handler.close()
+                env.log.removeHandler(handler)
+            try:
+                env.shutdown()
+            finally:
+                for handler in handlers:
+                    env.log.addHandler(handler)
+
+        plugins = set(import_times) | set(activation)
+        rows = sorted(((name, import_times.get(name, 0),
+                        activation.get(name, 0), components.get(name, 0))
+                       for name in plugins),
+                      key=lambda row: row[1] + row[2], reverse=True)
+        total_import = sum(row[1] for row in rows)
+        total_activation = sum(row[2] for row in rows)
+        ms = lambda seconds: '%.1f' % (seconds * 1000)
+        print_table([(name, ms(imp), ms(act), num)
+                     for name, imp, act, num in rows
+                     if ms(imp + act) != ms(0)] +
+                    [(_("Total"), ms(total_import), ms(total_activation),
+                      sum(components.values()))],
+                    [_("Plugin module"), _("Import (ms)"),
+                     _("Activation (ms)"), _("Components")])
+
     def _do_upgrade(self, no_backup=None):
         if no_backup not in (None, '-b', '--no-backup'):
             raise AdminCommandError(_("Invalid arguments"), show_usage=True)
@@ -15,30 +15,65 @@
 # Author: Christopher Lenz <cmlenz@gmx.de>
 
 from glob import glob
+import importlib
 import importlib.util
+import json
 import os.path
 import pkg_resources
 from pkg_resources import working_set, DistributionNotFound, \
                           VersionConflict, UnknownExtra
 import sys
+import time
 
 from trac.core import ComponentMeta
-from trac.util import get_doc, get_module_metadata, get_module_path, \
-                      get_pkginfo, get_sources
+from trac.util import AtomicFile, get_doc, get_module_metadata, \
+                      get_module_path, get_pkginfo, get_sources
 from trac.util.text import exception_to_unicode, to_unicode
 
 __all__ = ['load_components']
 
 
+#: Seconds spent by this process importing each plugin module, by name
+#: of the module. Modules imported before loading the plugins are absent.
+import_times = {}
+
+_manifest_version = 1
+
+
 def _enable_plugin(env, module):
     """Enable the given plugin module if it wasn't disabled explicitly."""
     if env.is_component_enabled(module) is None:
         env.enable_component(module)
 
 
+def _import_plugin(name):
+    """Import the module `name`, recording the time spent."""
+    if name in sys.modules:
+        return sys.modules[name]
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    import_times[name] = time.perf_counter() - start
+    return module
+
+
 def load_eggs(entry_point_name):
-    """Loader that loads any eggs on the search path and `sys.path`."""
+    """Loader that loads any eggs on the search path and `sys.path`.
+
+    Resolving the plugin distributions and their entry points is costly,
+    so the result is kept in the `cache/plugins.json` file of the
+    environment, along with the modification times of the search path
+    entries and of the locations of the distributions. As long as these
+    didn't change, the entry points are imported directly. Delete the
+    file to force a new resolution, e.g. after installing a plugin in a
+    directory of `sys.path` which didn't contain any plugin yet.
+    """
     def _load_eggs(env, search_path, auto_enable=None):
+        manifest_path = os.path.join(env.cache_dir, 'plugins.json')
+        manifest = _read_manifest(env, manifest_path, search_path)
+        if manifest is not None:
+            _load_manifest(env, manifest, auto_enable)
+            return
+
         # Note that the following doesn't seem to support unicode search_path
         distributions, errors = working_set.find_plugins(
             pkg_resources.Environment(search_path)
@@ -72,22 +107,117 @@ def load_eggs(entry_point_name):
 
         if auto_enable:
             auto_enable = os.path.normcase(auto_enable)
+        entries = []
         for entry in sorted(working_set.iter_entry_points(entry_point_name),
                             key=lambda entry: entry.name):
             env.log.debug('Loading plugin "%s" from "%s"',
                           entry.name, entry.dist.location)
             try:
-                entry.load(require=True)
+                entry.require()
+                _import_plugin(entry.module_name)
+                entry.resolve()
             except Exception as e:
                 _log_error(entry, e)
                 deregister_components(entry)
             else:
+                entries.append([entry.name, entry.module_name,
+                                list(entry.attrs), entry.dist.location])
                 if os.path.normcase(os.path.dirname(entry.dist.location)) == \
                         auto_enable:
                     _enable_plugin(env, entry.module_name)
+
+        # The entries which failed to load are left out, until installing
+        # their requirements changes the stamp of the manifest.
+        _write_manifest(env, manifest_path, search_path,
+                        [dist.location for dist in distributions], entries)
     return _load_eggs
 
 
+def _manifest_stamp(search_path, locations):
+    """Return the modification times and sizes of the entries of the
+    `search_path` directories, and the modification times of the
+    distribution `locations` and of their directories."""
+    stamp = [_manifest_version, sys.version, sys.hexversion]
+    for path in search_path:
+        try:
+            with os.scandir(path) as it:
+                for entry in sorted(it, key=lambda entry: entry.name):
+                    st = entry.stat()
+                    stamp.append([entry.path, st.st_mtime_ns, st.st_size])
+        except OSError:
+            stamp.append([path, None])
+    paths = set(locations)
+    paths.update(os.path.dirname(location) for location in locations)
+    for path in sorted(paths):
+        try:
+            stamp.append([path, os.stat(path).st_mtime_ns])
+        except OSError:
+            stamp.append([path, None])
+    return stamp
+
+
+def _read_manifest(env, path, search_path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        locations = manifest['locations']
+        valid = manifest['stamp'] == _manifest_stamp(search_path, locations)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        env.log.warning("Ignoring the plugin manifest %s: %s", path,
+                        exception_to_unicode(e))
+        return None
+    if not valid:
+        env.log.info("Plugins changed, rebuilding the plugin manifest")
+        return None
+    return manifest
+
+
+def _write_manifest(env, path, search_path, distributions, entries):
+    locations = sorted({location for name, module_name, attrs, location
+                        in entries})
+    manifest = {
+        'stamp': _manifest_stamp(search_path, locations),
+        'locations': locations,
+        'distributions': distributions,
+        'entries': entries,
+    }
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with AtomicFile(path) as f:
+            json.dump(manifest, f)
+    except OSError as e:
+        env.log.warning("Can't write the plugin manifest %s: %s", path,
+                        exception_to_unicode(e))
+
+
+def _load_manifest(env, manifest, auto_enable=None):
+    for location in manifest['distributions']:
+        for dist in pkg_resources.find_distributions(location, only=True):
+            if dist not in working_set:
+                env.log.debug('Adding plugin "%s" from "%s"', dist, location)
+                working_set.add(dist)
+
+    if auto_enable:
+        auto_enable = os.path.normcase(auto_enable)
+    for name, module_name, attrs, location in manifest['entries']:
+        env.log.debug('Loading plugin "%s" from "%s"', name, location)
+        try:
+            module = _import_plugin(module_name)
+            for attr in attrs:
+                module = getattr(module, attr)
+        except Exception as e:
+            env.log.error('Skipping "%s": %s', name,
+                          exception_to_unicode(e, traceback=True))
+            for c in ComponentMeta._components:
+                if c.__module__ == module_name and c.__name__ in attrs:
+                    ComponentMeta.deregister(c)
+        else:
+            if os.path.normcase(os.path.dirname(location)) == auto_enable:
+                _enable_plugin(env, module_name)
+
+
 def load_py_files():
     """Loader that look for Python source files in the plugins directories,
     which simply get imported, thereby registering them with the component
@@ -110,7 +240,10 @@ def load_py_files():
                               plugin_name, plugin_file)
                 try:
                     if plugin_name not in sys.modules:
+                        start = time.perf_counter()
                         load_source(plugin_name, plugin_file)
+                        import_times[plugin_name] = \
+                            time.perf_counter() - start
                 except (ImportError, VersionConflict) as e:
                     env.log.error('Skipping "%s": %s', plugin_name,
                                   exception_to_unicode(e))
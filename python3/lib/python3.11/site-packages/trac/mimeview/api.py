@@ -64,7 +64,8 @@ import mimetypes
 import re
 from collections import namedtuple
 
-from trac.config import IntOption, ListOption, Option
+from trac.config import BoolOption, IConfigurationChangeListener, \
+                        IntOption, ListOption, Option
 from trac.core import Component, ExtensionPoint, Interface, TracError, \
                       implements
 from trac.resource import Resource
@@ -618,6 +619,8 @@ class Content(object):
 class Mimeview(Component):
     """Generic HTML renderer for data, typically source code."""
 
+    implements(IConfigurationChangeListener)
+
     required = True
 
     renderers = ExtensionPoint(IHTMLPreviewRenderer)
@@ -656,10 +659,25 @@ class Mimeview(Component):
         binary data.
         """)
 
+    gzip_downloads = BoolOption('mimeviewer', 'gzip_downloads', 'true',
+        """Compress converted content sent for download, like the CSV
+        exports of ticket queries and reports, with gzip when the browser
+        accepts it. Disable it if a front-end web server already
+        compresses the responses. (''since 1.6'')""")
+
     def __init__(self):
         self._mime_map = None
         self._mime_map_patterns = None
 
+    # IConfigurationChangeListener methods
+
+    def get_config_sections(self):
+        return ['mimeviewer']
+
+    def config_sections_changed(self, changes):
+        self._mime_map = None
+        self._mime_map_patterns = None
+
     # Public API
 
     def get_supported_conversions(self, mimetype):
@@ -1034,31 +1052,49 @@ class Mimeview(Component):
 
         `selector` can be either a key or a MIME Type."""
         from trac.web.chrome import Chrome
-        from trac.web.api import RequestDone
         iterable = Chrome(self.env).use_chunked_encoding
         content, output_type, ext = self.convert_content(req, in_type, content,
                                                          selector,
                                                          iterable=iterable)
-        if iterable:
-            def encoder(content):
-                for chunk in content:
-                    if isinstance(chunk, str):
-                        chunk = chunk.encode('utf-8')
-                    yield chunk
-            content = encoder(content)
+        self.send_download(req, content, output_type,
+                           '%s.%s' % (filename, ext) if filename else None)
+
+    def send_download(self, req, content, mimetype, filename=None):
+        """Send `content` (`str`, `bytes` or an iterable of them) as an
+        attachment, compressed with gzip if enabled and accepted by the
+        client. Iterables are streamed if `[trac] use_chunked_encoding`
+        is enabled.
+
+        :since: 1.6
+        """
+        from trac.web.api import RequestDone, gzip_chunks
+        from trac.web.chrome import Chrome
+        def encoder(content):
+            for chunk in content:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                yield chunk
+        if isinstance(content, (str, bytes)):
+            content = [content]
+        content = encoder(content)
+        gzip = self.gzip_downloads and req.accepts_gzip
+        if gzip:
+            content = gzip_chunks(content)
+        if Chrome(self.env).use_chunked_encoding:
             length = None
         else:
-            if isinstance(content, str):
-                content = content.encode('utf-8')
+            content = b''.join(content)
             length = len(content)
         req.send_response(200)
-        req.send_header('Content-Type', output_type)
+        req.send_header('Content-Type', mimetype)
+        if gzip:
+            req.send_header('Content-Encoding', 'gzip')
+        req.send_header('Vary', 'Accept-Encoding')
         if length is not None:
             req.send_header('Content-Length', length)
         if filename:
             req.send_header('Content-Disposition',
-                            content_disposition('attachment',
-                                                '%s.%s' % (filename, ext)))
+                            content_disposition('attachment', filename))
         req.end_headers()
         req.write(content)
         raise RequestDone
@@ -23,7 +23,8 @@ from pygments.styles import get_all_styles, get_style_by_name
 
 from trac.api import ISystemInfoProvider
 from trac.core import *
-from trac.config import ConfigSection, ListOption, Option
+from trac.config import ConfigSection, IConfigurationChangeListener, \
+                        ListOption, Option
 from trac.mimeview.api import IHTMLPreviewRenderer, Mimeview
 from trac.prefs import IPreferencePanelProvider
 from trac.util import get_pkginfo, lazy
@@ -40,9 +41,9 @@ __all__ = ['PygmentsRenderer']
 class PygmentsRenderer(Component):
     """HTML renderer for syntax highlighting based on Pygments."""
 
-    implements(ISystemInfoProvider, IHTMLPreviewRenderer,
-               IPreferencePanelProvider, IRequestHandler,
-               ITemplateProvider)
+    implements(IConfigurationChangeListener, ISystemInfoProvider,
+               IHTMLPreviewRenderer, IPreferencePanelProvider,
+               IRequestHandler, ITemplateProvider)
 
     is_valid_default_handler = False
 
@@ -98,6 +99,15 @@ class PygmentsRenderer(Component):
   </body>
 </html>"""
 
+    # IConfigurationChangeListener methods
+
+    def get_config_sections(self):
+        return ['mimeviewer', 'pygments-lexer']
+
+    def config_sections_changed(self, changes):
+        del self._types
+        del self._lexer_options
+
     # ISystemInfoProvider methods
 
     def get_system_info(self):
@@ -164,6 +174,9 @@ class PygmentsRenderer(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/pygments']
+
     def match_request(self, req):
         match = re.match(r'/pygments/([-\w]+)\.css', req.path_info)
         if match:
@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 Hewlett Packard Enterprise Development LP.
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at https://trac.edgewall.org/wiki/TracLicense.
+
+"""Non-blocking delivery of outbound messages (chat webhooks, e-mail).
+
+Change listeners hand their messages to the `OutboundDispatcher` which
+returns immediately; a small pool of worker threads delivers them in the
+background, retrying failures with exponential backoff and coalescing
+bursts of messages for the same channel into a single delivery.
+Messages queued within a transaction are only handed over once the
+transaction is committed.
+"""
+
+import collections
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+
+from trac.config import IConfigurationChangeListener, IntOption, Option
+from trac.core import Component, ExtensionPoint, Interface, implements
+from trac.db.api import DatabaseManager
+from trac.util.text import exception_to_unicode
+
+
+__all__ = ['DeliveryRejectedError', 'IOutboundSender', 'OutboundDispatcher',
+           'OutboundQueue', 'PartialDeliveryError']
+
+
+class PartialDeliveryError(Exception):
+    """Raised by `IOutboundSender.send_outbound` when only the first
+    `delivered` payloads of the batch have been delivered, so that only
+    the others are retried."""
+
+    def __init__(self, delivered, message):
+        super().__init__(message)
+        self.delivered = delivered
+
+
+class DeliveryRejectedError(PartialDeliveryError):
+    """Raised by `IOutboundSender.send_outbound` when the `rejected`
+    payloads following the first `delivered` ones have been refused
+    for good (e.g. a `4xx` response), so that they are dropped instead
+    of retried. The payloads following them are delivered again."""
+
+    def __init__(self, delivered, rejected, message):
+        super().__init__(delivered, message)
+        self.rejected = rejected
+
+
+class IOutboundSender(Interface):
+    """Deliver messages queued on the `OutboundDispatcher`."""
+
+    def get_outbound_channels():
+        """Return an iterable of the channel names handled by this
+        sender."""
+
+    def send_outbound(channel, payloads, session):
+        """Deliver `payloads`, the list of messages queued on `channel`
+        in order, possibly as a single digest.
+
+        Raise an exception to have the whole batch retried later,
+        a `PartialDeliveryError` to have only the payloads not delivered
+        yet retried, or a `DeliveryRejectedError` to drop the payloads
+        that will never be accepted.
+
+        :param session: a keep-alive `requests.Session` owned by the
+                        calling worker thread, or `None` if `requests`
+                        is not installed.
+        """
+
+
+class OutboundQueue(object):
+    """Bounded message queue served by worker threads.
+
+    `send` is called as `send(channel, payloads, session)` by a worker
+    with the payloads queued on `channel`, at most `max_batch` of them.
+    Messages that don't fit in memory are spilled as JSON files to
+    `spool_dir` (if given) and read back when the queue drains; spilled
+    files left over by a previous process are picked up at start.
+
+    The class does not depend on a Trac environment, so that standalone
+    services like the Slack proxy can use it too.
+    """
+
+    def __init__(self, send, log, workers=2, maxsize=1000, max_batch=50,
+                 coalesce_delay=2, max_retries=5, retry_delay=10,
+                 spool_dir=None):
+        self.send = send
+        self.log = log
+        self.workers = max(1, workers)
+        self.maxsize = max(1, maxsize)
+        self.max_batch = max(1, max_batch)
+        self.coalesce_delay = coalesce_delay
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.spool_dir = spool_dir
+        self._messages = collections.deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._local = threading.local()
+        self._stopped = False
+        self.stats = collections.Counter()
+
+    def put(self, channel, payload):
+        """Queue `payload` for delivery on `channel`. Never blocks on the
+        network."""
+        message = {'channel': channel, 'payload': payload, 'attempts': 0,
+                   'not_before': 0}
+        with self._cond:
+            if len(self._messages) >= self.maxsize:
+                self._spill(message)
+            else:
+                self._messages.append(message)
+                self.stats['queued'] += 1
+            self._cond.notify()
+        self.start()
+
+    def start(self):
+        with self._cond:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            if self._stopped or len(self._threads) >= self.workers:
+                return
+            if not self._threads:
+                self._unspill()
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run,
+                                          name='outbound-dispatcher')
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def configure(self, workers=None, maxsize=None, max_batch=None,
+                  coalesce_delay=None, max_retries=None, retry_delay=None):
+        """Change the settings given by the keyword arguments of
+        `__init__`. Extra workers exit once they are idle."""
+        with self._cond:
+            if workers is not None:
+                self.workers = max(1, workers)
+            if maxsize is not None:
+                self.maxsize = max(1, maxsize)
+            if max_batch is not None:
+                self.max_batch = max(1, max_batch)
+            if coalesce_delay is not None:
+                self.coalesce_delay = coalesce_delay
+            if max_retries is not None:
+                self.max_retries = max_retries
+            if retry_delay is not None:
+                self.retry_delay = retry_delay
+            running = bool(self._threads)
+            self._cond.notify_all()
+        if running:
+            self.start()
+
+    def stop(self):
+        """Ask the workers to exit once they are idle."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        return len(self._messages)
+
+    # Internal methods
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            channel = batch[0]['channel']
+            payloads = [message['payload'] for message in batch]
+            try:
+                self.send(channel, payloads, self._session())
+            except DeliveryRejectedError as e:
+                self.stats['sent'] += e.delivered
+                end = e.delivered + e.rejected
+                self._failed(channel, batch[e.delivered:end], e)
+                self._requeue(batch[end:])
+            except PartialDeliveryError as e:
+                self.stats['sent'] += e.delivered
+                self._failed(channel, batch[e.delivered:], e)
+            except Exception as e:
+                self._failed(channel, batch, e)
+            else:
+                self.stats['sent'] += len(batch)
+                self.stats['deliveries'] += 1
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                first = self._wait_for_message()
+                if first is None:
+                    return None
+                if self.coalesce_delay and not first['attempts']:
+                    # Give a burst (e.g. a batch modify) the chance to
+                    # land before the batch is cut.
+                    deadline = time.time() + self.coalesce_delay
+                    while time.time() < deadline:
+                        self._cond.wait(deadline - time.time())
+                channel = first['channel']
+                now = time.time()
+                batch = []
+                rest = collections.deque()
+                for message in self._messages:
+                    if len(batch) < self.max_batch and \
+                            message['channel'] == channel and \
+                            message['not_before'] <= now:
+                        batch.append(message)
+                    else:
+                        rest.append(message)
+                self._messages = rest
+                if len(self._messages) < self.maxsize:
+                    self._unspill()
+                if batch:  # else another worker took them meanwhile
+                    return batch
+
+    def _wait_for_message(self):
+        # Called with self._cond held.
+        while True:
+            if self._stopped and not self._messages:
+                return None
+            if len(self._threads) > self.workers:
+                # The number of workers has been lowered.
+                self._threads.remove(threading.current_thread())
+                return None
+            now = time.time()
+            for message in self._messages:
+                if message['not_before'] <= now:
+                    return message
+            if len(self._messages) < self.maxsize:
+                self._unspill()
+                if any(m['not_before'] <= now for m in self._messages):
+                    continue
+            if self._messages:
+                delay = min(m['not_before'] for m in self._messages) - now
+                self._cond.wait(max(delay, 0.1))
+            elif self.spool_dir:
+                # Look for messages spooled by other processes now and
+                # then.
+                self._cond.wait(60)
+            else:
+                self._cond.wait()
+
+    def _failed(self, channel, batch, e):
+        if not batch:
+            return
+        attempts = batch[0]['attempts'] + 1
+        if isinstance(e, DeliveryRejectedError):
+            self.stats['dropped'] += len(batch)
+            self.log.error("Dropping %d message(s) for %s rejected by the "
+                           "recipient: %s", len(batch), channel,
+                           exception_to_unicode(e))
+            return
+        if attempts > self.max_retries:
+            self.stats['dropped'] += len(batch)
+            self.log.error("Dropping %d message(s) for %s after %d "
+                           "attempts: %s", len(batch), channel, attempts,
+                           exception_to_unicode(e))
+            return
+        delay = self.retry_delay * 2 ** (attempts - 1)
+        self.stats['retried'] += len(batch)
+        self.log.warning("Delivery of %d message(s) for %s failed, retrying "
+                         "in %ds: %s", len(batch), channel, delay,
+                         exception_to_unicode(e))
+        not_before = time.time() + delay
+        for message in batch:
+            message['attempts'] = attempts
+            message['not_before'] = not_before
+        self._requeue(batch)
+
+    def _requeue(self, batch):
+        if not batch:
+            return
+        with self._cond:
+            self._messages.extendleft(reversed(batch))
+            self._cond.notify()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            # Imported on first use, as the import is slow
+            try:
+                import requests
+            except ImportError:
+                return None
+            session = self._local.session = requests.Session()
+        return session
+
+    def _spill(self, message):
+        if not self.spool_dir:
+            self.stats['dropped'] += 1
+            self.log.error("Outbound queue full, dropping message for %s",
+                           message['channel'])
+            return
+        try:
+            if not os.path.isdir(self.spool_dir):
+                os.makedirs(self.spool_dir)
+            name = '%020d-%s.json' % (time.time() * 1e6, uuid.uuid4().hex)
+            path = os.path.join(self.spool_dir, name)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(message, f)
+            os.rename(path + '.tmp', path)
+        except (OSError, TypeError, ValueError) as e:
+            self.stats['dropped'] += 1
+            self.log.error("Can't spool message for %s: %s",
+                           message['channel'], exception_to_unicode(e))
+        else:
+            self.stats['spilled'] += 1
+
+    def _unspill(self):
+        # Called with self._cond held.
+        if not self.spool_dir:
+            return
+        room = self.maxsize - len(self._messages)
+        for path in sorted(glob.glob(os.path.join(self.spool_dir,
+                                                  '*.json')))[:room]:
+            # Renaming claims the file against other processes sharing
+            # the spool directory.
+            claimed = '%s.%d' % (path, os.getpid())
+            try:
+                os.rename(path, claimed)
+                with open(claimed, encoding='utf-8') as f:
+                    message = json.load(f)
+                os.unlink(claimed)
+            except (OSError, ValueError) as e:
+                self.log.warning("Can't read spooled message %s: %s",
+                                 path, exception_to_unicode(e))
+                continue
+            self._messages.append(message)
+
+
+class OutboundDispatcher(Component):
+    """Queue outbound messages and deliver them from worker threads.
+
+    Senders implement `IOutboundSender` and call `queue(channel,
+    payload)` from their change listeners instead of talking to the
+    remote service directly.
+    """
+
+    implements(IConfigurationChangeListener)
+
+    senders = ExtensionPoint(IOutboundSender)
+
+    workers = IntOption('outbound', 'workers', 2,
+        """Number of worker threads delivering outbound messages.""")
+
+    queue_size = IntOption('outbound', 'queue_size', 1000,
+        """Maximum number of messages held in memory. Further messages
+        are spooled to `spool_dir`.""")
+
+    spool_dir = Option('outbound', 'spool_dir', 'files/outbound',
+        """Directory holding the messages that did not fit in memory,
+        until they are delivered. Relative paths are resolved against the
+        environment directory. Set to empty to drop such messages
+        instead. Messages held in memory are lost when the process exits
+        before delivering them.""")
+
+    coalesce_delay = IntOption('outbound', 'coalesce_delay', 2,
+        """Number of seconds to wait for more messages on the same
+        channel before delivering, so that bursts are sent as a single
+        digest.""")
+
+    max_batch = IntOption('outbound', 'max_batch', 50,
+        """Maximum number of messages combined into one delivery.""")
+
+    max_retries = IntOption('outbound', 'max_retries', 5,
+        """Number of times a failed delivery is retried before the
+        messages are dropped.""")
+
+    retry_delay = IntOption('outbound', 'retry_delay', 10,
+        """Delay in seconds before the first retry of a failed delivery.
+        The delay doubles with every further attempt.""")
+
+    def __init__(self):
+        self._queue = OutboundQueue(self._send, self.log,
+                                    spool_dir=self._get_spool_dir())
+        self._configure()
+
+    # IConfigurationChangeListener methods
+
+    def get_config_sections(self):
+        return ['outbound']
+
+    def config_sections_changed(self, changes):
+        self._configure()
+        self._queue.spool_dir = self._get_spool_dir()
+
+    def queue(self, channel, payload):
+        """Queue a JSON-serializable `payload` for delivery by the sender
+        handling `channel`, once the current transaction, if any, is
+        committed."""
+        DatabaseManager(self.env).call_after_commit(
+            lambda: self._queue.put(channel, payload))
+
+    @property
+    def stats(self):
+        """Counters of queued, sent, retried, spilled and dropped
+        messages, plus the current queue length."""
+        return dict(self._queue.stats, pending=len(self._queue))
+
+    # Internal methods
+
+    def _configure(self):
+        self._queue.configure(workers=self.workers,
+                              maxsize=self.queue_size,
+                              max_batch=self.max_batch,
+                              coalesce_delay=self.coalesce_delay,
+                              max_retries=self.max_retries,
+                              retry_delay=self.retry_delay)
+
+    def _get_spool_dir(self):
+        spool_dir = self.spool_dir
+        if spool_dir and not os.path.isabs(spool_dir):
+            spool_dir = os.path.join(self.env.path, spool_dir)
+        return spool_dir or None
+
+    def _send(self, channel, payloads, session):
+        for sender in self.senders:
+            if channel in sender.get_outbound_channels():
+                sender.send_outbound(channel, payloads, session)
+                return
+        self.log.error("No sender for outbound channel %s, dropping %d "
+                       "message(s)", channel, len(payloads))
@@ -26,7 +26,6 @@ from trac.config import ExtensionOption, OrderedExtensionsOption
 from trac.core import *
 from trac.resource import Resource, get_resource_name
 from trac.util import file_or_std, lazy
-from trac.util.datefmt import time_now
 from trac.util.text import path_to_unicode, print_table, printout, \
                            stream_encoding, to_unicode, wrap
 from trac.util.translation import _, N_
@@ -161,6 +160,28 @@ class IPermissionPolicy(Interface):
         this will probably change in the future (e.g. `'VIEW' in ...`).
         """
 
+    def check_permissions(action, username, resources, perm):
+        """Check that the action can be performed by username on each of
+        the resources, in a single pass (optional).
+
+        Policies that can decide for many resources more efficiently
+        than one by one, e.g. with a single database query, implement
+        this method. It is used by `PermissionCache.filter` to check
+        permissions in list views.
+
+        :param resources: the list of resources on which the check
+                          applies.
+        :param perm: the permission cache for that username, which can be
+                     used as `perm(resource)` for doing secondary checks
+                     on one of the resources.
+
+        :return: a list with the decision (`True`, `False` or `None`)
+                 for each of the resources, in order, as
+                 `check_permission` would return it.
+
+        :since: 1.6
+        """
+
 
 class DefaultPermissionStore(Component):
     """Default implementation of permission storage and group management.
@@ -203,16 +224,32 @@ class DefaultPermissionStore(Component):
 
         Users are returned as a list of usernames.
         """
-        # get_user_permissions() takes care of the magic 'authenticated'
-        # group. The optimized loop we had before didn't. This is very
-        # inefficient, but it works.
-        result = set()
-        users = {u[0] for u in self.env.get_known_users()}
-        for user in users:
-            user_perms = self.get_user_permissions(user)
-            for group in permissions:
-                if group in user_perms:
-                    result.add(user)
+        # Collect the subjects granted one of the permissions, directly
+        # or as members of a group that is granted one.
+        members = {}
+        subjects = set()
+        for subject, action in self._all_permissions:
+            if not action.isupper():
+                members.setdefault(action, set()).add(subject)
+            elif action in permissions:
+                subjects.add(subject)
+        pending = list(subjects)
+        while pending:
+            for subject in members.get(pending.pop(), ()):
+                if subject not in subjects:
+                    subjects.add(subject)
+                    pending.append(subject)
+        # Other group providers take care of the magic 'anonymous' and
+        # 'authenticated' groups.
+        providers = [p for p in self.group_providers if p is not self]
+        result = []
+        for user, name, email in self.env.get_known_users():
+            if user in subjects or \
+                    any(group in subjects
+                        for provider in providers
+                        for group in provider.get_permission_groups(user)
+                                     or ()):
+                result.append(user)
         return sorted(result)
 
     def get_all_permissions(self):
@@ -291,36 +328,16 @@ class DefaultPermissionPolicy(Component):
 
     implements(IPermissionPolicy)
 
-    # Number of seconds a cached user permission set is valid for.
-    CACHE_EXPIRY = 5
-    # How frequently to clear the entire permission cache
-    CACHE_REAP_TIME = 60
-
-    def __init__(self):
-        self.permission_cache = {}
-        self.last_reap = time_now()
-
     # IPermissionPolicy methods
 
     def check_permission(self, action, username, resource, perm):
-        now = time_now()
-
-        if now - self.last_reap > self.CACHE_REAP_TIME:
-            self.permission_cache = {}
-            self.last_reap = time_now()
-
-        timestamp, permissions = \
-            self.permission_cache.get(username, (0, None))
-
-        # Cache hit?
-        if now - timestamp > self.CACHE_EXPIRY:
-            # No, pull permissions from database.
-            permissions = PermissionSystem(self.env). \
-                          get_user_permissions(username)
-            self.permission_cache[username] = (now, permissions)
-
+        permissions = PermissionSystem(self.env).get_permission_set(username)
         return action in permissions or None
 
+    def check_permissions(self, action, username, resources, perm):
+        decision = self.check_permission(action, username, None, perm)
+        return [decision] * len(resources)
+
 
 class PermissionSystem(Component):
     """Permission management sub-system."""
@@ -346,15 +363,6 @@ class PermissionSystem(Component):
         in which they will be applied. These components manage fine-grained
         access control to Trac resources.""")
 
-    # Number of seconds a cached user permission set is valid for.
-    CACHE_EXPIRY = 5
-    # How frequently to clear the entire permission cache
-    CACHE_REAP_TIME = 60
-
-    def __init__(self):
-        self.permission_cache = {}
-        self.last_reap = time_now()
-
     # Public API
 
     def grant_permission(self, username, action):
@@ -384,11 +392,24 @@ class PermissionSystem(Component):
                 raise PermissionExistsError(
                     _("The user %(user)s is already in the group %(group)s.",
                       user=username, group=action))
+        self.invalidate_cache()
 
     def revoke_permission(self, username, action):
         """Revokes the permission of the specified user to perform an
         action."""
         self.store.revoke_permission(username, action)
+        self.invalidate_cache()
+
+    def invalidate_cache(self):
+        """Drop the permissions cached for all users, in all processes.
+
+        Called when a permission is granted or revoked. Permission store
+        and group provider components must call it when permissions or
+        group memberships change by other means.
+
+        :since: 1.6
+        """
+        del self._permission_cache
 
     def get_actions_dict(self, skip=None):
         """Get all actions from permission requestors as a `dict`.
@@ -482,6 +503,21 @@ class PermissionSystem(Component):
             return {p: True for p in user_permissions
                             if undefined or p in actions}
 
+    def get_permission_set(self, username):
+        """Return the actions granted to `username` as a `frozenset`,
+        with meta permissions expanded.
+
+        The sets are cached until `invalidate_cache()` is called.
+
+        :since: 1.6
+        """
+        actions_cache = self._permission_cache[0]
+        permissions = actions_cache.get(username)
+        if permissions is None:
+            permissions = frozenset(self.get_user_permissions(username))
+            actions_cache[username] = permissions
+        return permissions
+
     def get_permission_groups(self, username):
         """Return a sorted list of groups that `username` belongs to.
 
@@ -510,14 +546,13 @@ class PermissionSystem(Component):
 
         Users are returned as a list of user names.
         """
-        now = time_now()
-        if now - self.last_reap > self.CACHE_REAP_TIME:
-            self.permission_cache = {}
-            self.last_reap = now
-        timestamp, permissions = self.permission_cache.get(permission,
-                                                           (0, None))
-        if now - timestamp <= self.CACHE_EXPIRY:
-            return permissions
+        # The users are cached along with the known users they were
+        # computed from, as new users are not announced to the cache.
+        users_cache = self._permission_cache[1]
+        known_users = self.env.get_known_users(as_dict=True)
+        cached_known_users, users = users_cache.get(permission, (None, None))
+        if cached_known_users is known_users:
+            return users
 
         parent_map = {}
         for parent, children in self.get_actions_dict().items():
@@ -532,9 +567,9 @@ class PermissionSystem(Component):
                     append_with_parents(action)
         append_with_parents(permission)
 
-        perms = self.store.get_users_with_permissions(satisfying_perms) or []
-        self.permission_cache[permission] = (now, perms)
-        return perms
+        users = self.store.get_users_with_permissions(satisfying_perms) or []
+        users_cache[permission] = (known_users, users)
+        return users
 
     def expand_actions(self, actions):
         """Helper method for expanding all meta actions."""
@@ -571,6 +606,47 @@ class PermissionSystem(Component):
                        username, action, resource)
         return False
 
+    def check_permissions(self, action, username, resources, perm=None):
+        """Return a list of booleans telling whether the action is
+        allowed on each of the given resources.
+
+        Policies implementing the optional `check_permissions` method
+        decide for all the resources left undecided by the previous
+        policies at once, the others are asked for each resource.
+
+        :since: 1.6
+        """
+        if username is None:
+            username = 'anonymous'
+        resources = [None if resource and resource.realm is None
+                     else resource for resource in resources]
+        decisions = [None] * len(resources)
+        pending = list(range(len(resources)))
+        for policy in self.policies:
+            if not pending:
+                break
+            subset = [resources[i] for i in pending]
+            if hasattr(policy, 'check_permissions'):
+                results = policy.check_permissions(action, username, subset,
+                                                   perm)
+            else:
+                results = [policy.check_permission(
+                               action, username, resource,
+                               perm(resource) if perm else None)
+                           for resource in subset]
+            undecided = []
+            for i, decision in zip(pending, results):
+                if decision is None:
+                    undecided.append(i)
+                else:
+                    decisions[i] = decision
+            self.log.debug("%s decided %s performing %s on %d of %d "
+                           "resources", policy.__class__.__name__, username,
+                           action, len(pending) - len(undecided),
+                           len(pending))
+            pending = undecided
+        return [bool(decision) for decision in decisions]
+
     # IPermissionRequestor methods
 
     def get_permission_actions(self):
@@ -579,6 +655,15 @@ class PermissionSystem(Component):
         actions = self.get_actions(skip=self)
         return [('TRAC_ADMIN', actions)]
 
+    # Internal methods
+
+    @cached
+    def _permission_cache(self):
+        # Action sets keyed by username and users keyed by action. A
+        # value computed while the cache is invalidated goes to the
+        # dicts of the previous generation, which are dropped.
+        return {}, {}
+
 
 class PermissionCache(object):
     """Cache that maintains the permissions of a single user.
@@ -672,6 +757,41 @@ class PermissionCache(object):
 
     __contains__ = has_permission
 
+    def filter(self, action, resources):
+        """Return the list of `resources` on which `action` is allowed,
+        in order.
+
+        This is equivalent to `[r for r in resources if action in
+        perm(r)]`, but lets the permission policies check the resources
+        in a single pass:
+
+            tickets = perm.filter('TICKET_VIEW', resources)
+
+        :since: 1.6
+        """
+        resources = list(resources)
+        decisions = [None] * len(resources)
+        pending = []
+        for i, resource in enumerate(resources):
+            cached = self._cache.get((self.username, hash(resource), action))
+            if cached and cached[1] == resource:
+                decisions[i] = cached[0]
+            else:
+                pending.append(i)
+                # Avoid recursion in policies that call has_permission.
+                self._cache[(self.username, hash(resource), action)] = \
+                    (False, resource)
+        if pending:
+            results = PermissionSystem(self.env).check_permissions(
+                action, self.username, [resources[i] for i in pending], self)
+            for i, decision in zip(pending, results):
+                resource = resources[i]
+                decisions[i] = decision
+                self._cache[(self.username, hash(resource), action)] = \
+                    (decision, resource)
+        return [resource for resource, decision in zip(resources, decisions)
+                         if decision]
+
     def require(self, action, realm_or_resource=None, id=False, version=False,
                 message=None):
         resource = self._normalize_resource(realm_or_resource, id, version)
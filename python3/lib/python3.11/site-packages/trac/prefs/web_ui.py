@@ -54,6 +54,9 @@ class PreferencesModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/prefs']
+
     def match_request(self, req):
         match = re.match('/prefs(?:/([^/]+))?$', req.path_info)
         if match:
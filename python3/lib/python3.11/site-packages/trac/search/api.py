@@ -37,7 +37,9 @@ class ISearchSource(Interface):
         being the name of the tuples returned by `get_search_events`.
 
         The events returned by this function must be tuples of the form
-        `(href, title, date, author, excerpt).`
+        `(href, title, date, author, excerpt).` Sources ranking their
+        results by relevance can append a positive `score` to the tuple:
+        scored results are listed first, highest score first.
         """
 
 
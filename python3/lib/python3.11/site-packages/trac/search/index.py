@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 Hewlett Packard Enterprise Development LP.
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at https://trac.edgewall.org/wiki/TracLicense.
+
+"""Full-text index of tickets, wiki pages and attachments.
+
+The searchable text of every ticket (with its comments and custom
+fields), wiki page and attachment description is kept in the
+`search_doc` table, which is indexed by a database specific
+`ISearchIndexBackend`: SQLite FTS5 or PostgreSQL `tsvector`. The index
+is built with `trac-admin $ENV search reindex` and then kept up to date
+by change listeners. When `[search] use_fulltext_index` is enabled the
+ticket, wiki and attachment search sources query it instead of running
+`LIKE '%term%'` over the whole history.
+"""
+
+from trac.admin.api import IAdminCommandProvider
+from trac.attachment import IAttachmentChangeListener
+from trac.cache import cached
+from trac.config import BoolOption, IntOption, Option
+from trac.core import Component, ExtensionPoint, Interface, TracError, \
+                      implements
+from trac.db.api import DatabaseManager, parse_connection_uri
+from trac.db.schema import Column, Index, Table
+from trac.ticket.api import ITicketChangeListener, TicketSystem
+from trac.util.text import printout
+from trac.util.translation import _
+from trac.wiki.api import IWikiChangeListener
+
+
+__all__ = ['ISearchIndexBackend', 'SearchIndex']
+
+
+class ISearchIndexBackend(Interface):
+    """Full-text indexing of the `search_doc` table for a database
+    backend."""
+
+    def get_supported_schemes():
+        """Return the database schemes (e.g. `'sqlite'`) the backend can
+        index."""
+
+    def create_index(db):
+        """Create the structures indexing the `title` and `body` columns
+        of the (empty) `search_doc` table."""
+
+    def drop_index(db):
+        """Drop the structures created by `create_index`."""
+
+    def index_documents(db, docs):
+        """Index the `search_doc` rows `docs`, a list of `(id, title,
+        body)` tuples, after they have been inserted."""
+
+    def unindex_documents(db, docs):
+        """Remove the `search_doc` rows `docs`, a list of `(id, title,
+        body)` tuples, from the index before they are deleted."""
+
+    def search(db, terms, realm, parent_realm, limit):
+        """Return up to `limit` documents of `realm` (and `parent_realm`
+        if not `None`) containing all `terms`, best match first, as
+        `(id, score, snippet)` tuples. A higher `score` is a better
+        match."""
+
+
+class SearchIndex(Component):
+    """Maintain the full-text index and search it."""
+
+    implements(IAdminCommandProvider, IAttachmentChangeListener,
+               ITicketChangeListener, IWikiChangeListener)
+
+    backends = ExtensionPoint(ISearchIndexBackend)
+
+    table = Table('search_doc', key='id')[
+        Column('id', auto_increment=True),
+        Column('realm'),
+        Column('parent_realm'),
+        Column('parent_id'),
+        Column('name'),
+        Column('title'),
+        Column('body'),
+        Column('author'),
+        Column('time', type='int64'),
+        Index(['realm', 'parent_realm', 'parent_id', 'name'], unique=True),
+    ]
+
+    enabled = BoolOption('search', 'use_fulltext_index', 'false',
+        """Search tickets, wiki pages and attachments using the full-text
+        index instead of matching every term with `LIKE` against the
+        whole history. Results are then ranked by relevance. Has no
+        effect until the index has been built with
+        `trac-admin $ENV search reindex`.
+        (''since 1.6'')""")
+
+    max_results = IntOption('search', 'fulltext_max_results', 1000,
+        """Maximum number of results returned by the full-text index for
+        each kind of resource. (''since 1.6'')""")
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('search reindex', '',
+               """Rebuild the full-text search index
+
+               Indexes all tickets, wiki pages and attachment
+               descriptions. The index is kept up to date from then on.
+               """,
+               None, self._do_reindex)
+        yield ('search drop', '',
+               "Drop the full-text search index",
+               None, self._do_drop)
+
+    def _do_reindex(self):
+        count = self.reindex()
+        printout(_("Indexed %(num)s documents.", num=count))
+
+    def _do_drop(self):
+        self.drop()
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        self._update('ticket', ticket.id)
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        self._update('ticket', ticket.id)
+
+    def ticket_deleted(self, ticket):
+        self._update('ticket', ticket.id)
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        self._update('ticket', ticket.id)
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        self._update('ticket', ticket.id)
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        self._update('wiki', page.name)
+
+    def wiki_page_changed(self, page, version, t, comment, author):
+        self._update('wiki', page.name)
+
+    def wiki_page_deleted(self, page):
+        self._update('wiki', page.name)
+
+    def wiki_page_version_deleted(self, page):
+        self._update('wiki', page.name)
+
+    def wiki_page_renamed(self, page, old_name):
+        self._update('wiki', old_name)
+        self._update('wiki', page.name)
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        pass
+
+    # IAttachmentChangeListener methods
+
+    def attachment_added(self, attachment):
+        self._update('attachment', attachment.filename,
+                     attachment.parent_realm, attachment.parent_id)
+
+    def attachment_deleted(self, attachment):
+        self._update('attachment', attachment.filename,
+                     attachment.parent_realm, attachment.parent_id)
+
+    def attachment_moved(self, attachment, old_parent_realm, old_parent_id,
+                         old_filename):
+        self._update('attachment', old_filename, old_parent_realm,
+                     old_parent_id)
+        self._update('attachment', attachment.filename,
+                     attachment.parent_realm, attachment.parent_id)
+
+    # Public API
+
+    @property
+    def backend(self):
+        """The `ISearchIndexBackend` for the database, or `None`."""
+        scheme = parse_connection_uri(
+            DatabaseManager(self.env).connection_uri)[0]
+        for backend in self.backends:
+            if scheme in backend.get_supported_schemes():
+                return backend
+        return None
+
+    @cached
+    def exists(self):
+        """Whether the index has been built."""
+        with self.env.db_query as db:
+            return db.has_table(self.table.name)
+
+    def search(self, terms, realm, parent_realm=None):
+        """Return the documents of `realm` matching all search `terms`,
+        best match first, or `None` if the full-text index isn't in use.
+
+        Documents are `(name, parent_realm, parent_id, title, body,
+        author, time, score, snippet)` tuples.
+        """
+        backend = self.backend
+        if not self.enabled or not self.exists or backend is None:
+            return None
+        with self.env.db_query as db:
+            hits = backend.search(db, terms, realm, parent_realm,
+                                  self.max_results)
+            if not hits:
+                return []
+            ranks = {doc_id: (score, snippet)
+                     for doc_id, score, snippet in hits}
+            docs = {}
+            ids = list(ranks)
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                for row in db("""
+                        SELECT id, name, parent_realm, parent_id, title,
+                               body, author, time
+                        FROM search_doc WHERE id IN (%s)
+                        """ % ','.join(['%s'] * len(chunk)), chunk):
+                    docs[row[0]] = row[1:] + ranks[row[0]]
+        return [docs[doc_id] for doc_id in ids if doc_id in docs]
+
+    def reindex(self):
+        """Drop and rebuild the whole index. Returns the number of
+        documents indexed."""
+        backend = self.backend
+        if backend is None:
+            raise TracError(_("No full-text index backend available for "
+                              "this database."))
+        dbm = DatabaseManager(self.env)
+        count = 0
+        with self.env.db_transaction as db:
+            if db.has_table(self.table.name):
+                backend.drop_index(db)
+                dbm.drop_tables([self.table])
+            dbm.create_tables([self.table])
+            backend.create_index(db)
+            del self.exists
+            for docs in (self._ticket_documents(db),
+                         self._wiki_documents(db),
+                         self._attachment_documents(db)):
+                batch = []
+                for doc in docs:
+                    batch.append(doc)
+                    if len(batch) >= 500:
+                        count += self._insert(db, backend, batch)
+                        batch = []
+                count += self._insert(db, backend, batch)
+        self.log.info("Rebuilt the full-text index with %d documents", count)
+        return count
+
+    def drop(self):
+        """Drop the index. Changes are no longer indexed."""
+        backend = self.backend
+        with self.env.db_transaction as db:
+            if db.has_table(self.table.name):
+                if backend is not None:
+                    backend.drop_index(db)
+                DatabaseManager(self.env).drop_tables([self.table])
+            del self.exists
+
+    # Internal methods
+
+    def _update(self, realm, name, parent_realm='', parent_id=''):
+        """Reindex a single resource after it changed."""
+        if not self.exists:
+            return
+        backend = self.backend
+        if backend is None:
+            return
+        with self.env.db_transaction as db:
+            old = db("""
+                SELECT id, title, body FROM search_doc
+                WHERE realm=%s AND parent_realm=%s AND parent_id=%s
+                AND name=%s
+                """, (realm, parent_realm, parent_id, str(name)))
+            if old:
+                backend.unindex_documents(db, old)
+                db("DELETE FROM search_doc WHERE id=%s", (old[0][0],))
+            if realm == 'ticket':
+                docs = self._ticket_documents(db, int(name))
+            elif realm == 'wiki':
+                docs = self._wiki_documents(db, name)
+            else:
+                docs = self._attachment_documents(db, parent_realm,
+                                                  parent_id, name)
+            self._insert(db, backend, list(docs))
+
+    def _insert(self, db, backend, docs):
+        if not docs:
+            return 0
+        indexed = []
+        cursor = db.cursor()
+        for doc in docs:
+            cursor.execute("""
+                INSERT INTO search_doc (realm, parent_realm, parent_id, name,
+                                        title, body, author, time)
+                VALUES (%s,%s,%s,%s,%s,%s,%s,%s)
+                """, doc)
+            indexed.append((db.get_last_id(cursor, 'search_doc'), doc[4],
+                            doc[5]))
+        backend.index_documents(db, indexed)
+        return len(indexed)
+
+    def _ticket_documents(self, db, tkt_id=None):
+        """Generate the `search_doc` rows of all tickets, or of ticket
+        `tkt_id`."""
+        custom_fields = [f['name'] for f in TicketSystem(self.env).fields
+                         if f.get('custom')]
+        if tkt_id is not None:
+            ranges = [(tkt_id, tkt_id)]
+        else:
+            max_id = db("SELECT MAX(id) FROM ticket")[0][0] or 0
+            ranges = [(start, start + 499) for start in range(1, max_id + 1,
+                                                               500)]
+        for start, end in ranges:
+            texts = {}
+            for ticket, value in db("""
+                    SELECT ticket, newvalue FROM ticket_change
+                    WHERE ticket>=%s AND ticket<=%s AND field='comment'
+                    AND newvalue!=''
+                    ORDER BY ticket, time
+                    """, (start, end)):
+                texts.setdefault(ticket, []).append(value)
+            if custom_fields:
+                for ticket, value in db("""
+                        SELECT ticket, value FROM ticket_custom
+                        WHERE ticket>=%s AND ticket<=%s AND name IN (%s)
+                        AND value!=''
+                        """ % ('%s', '%s', ','.join(['%s'] *
+                                                   len(custom_fields))),
+                        [start, end] + custom_fields):
+                    texts.setdefault(ticket, []).append(value)
+            for id_, summary, description, keywords, reporter, cc, time in \
+                    db("""
+                    SELECT id, summary, description, keywords, reporter, cc,
+                           time
+                    FROM ticket WHERE id>=%s AND id<=%s ORDER BY id
+                    """, (start, end)):
+                body = [description]
+                body.extend(texts.get(id_, []))
+                body.extend([keywords, reporter, cc, str(id_)])
+                yield ('ticket', '', '', str(id_), summary or '',
+                       '\n'.join(text for text in body if text), reporter,
+                       time)
+
+    def _wiki_documents(self, db, name=None):
+        """Generate the `search_doc` rows of the latest version of all wiki
+        pages, or of page `name`."""
+        sql = """
+            SELECT w1.name, w1.text, w1.author, w1.time
+            FROM wiki w1,(SELECT name, max(version) AS ver
+                          FROM wiki GROUP BY name) w2
+            WHERE w1.version = w2.ver AND w1.name = w2.name"""
+        args = ()
+        if name is not None:
+            sql += " AND w1.name=%s"
+            args = (name,)
+        for name, text, author, time in db(sql, args):
+            yield ('wiki', '', '', name, name, text or '', author, time)
+
+    def _attachment_documents(self, db, parent_realm=None, parent_id=None,
+                              filename=None):
+        """Generate the `search_doc` rows of all attachments, or of a
+        single attachment."""
+        sql = "SELECT type, id, filename, description, author, time " \
+              "FROM attachment"
+        args = ()
+        if filename is not None:
+            sql += " WHERE type=%s AND id=%s AND filename=%s"
+            args = (parent_realm, str(parent_id), filename)
+        for type_, id_, filename, description, author, time in db(sql, args):
+            yield ('attachment', type_, id_, filename, filename,
+                   '\n'.join(text for text in (filename, description, author)
+                             if text), author, time)
+
+
+class SQLiteSearchBackend(Component):
+    """Index `search_doc` with an SQLite FTS5 table using `search_doc` as
+    external content."""
+
+    implements(ISearchIndexBackend)
+
+    def get_supported_schemes(self):
+        yield 'sqlite'
+
+    def create_index(self, db):
+        try:
+            db("""CREATE VIRTUAL TABLE search_fts USING fts5(
+                      title, body, content='search_doc', content_rowid='id')
+               """)
+        except self.env.db_exc.OperationalError as e:
+            raise TracError(_("SQLite FTS5 is not available: %(err)s",
+                              err=str(e)))
+
+    def drop_index(self, db):
+        db("DROP TABLE IF EXISTS search_fts")
+
+    def index_documents(self, db, docs):
+        db.executemany("""
+            INSERT INTO search_fts (rowid, title, body) VALUES (%s,%s,%s)
+            """, docs)
+
+    def unindex_documents(self, db, docs):
+        db.executemany("""
+            INSERT INTO search_fts (search_fts, rowid, title, body)
+            VALUES ('delete',%s,%s,%s)
+            """, docs)
+
+    def search(self, db, terms, realm, parent_realm, limit):
+        # Each term is matched as a phrase prefix; all terms must match.
+        query = ' '.join('"%s"*' % term.replace('"', '""') for term in terms)
+        sql = """
+            SELECT d.id, bm25(search_fts, 10.0, 1.0),
+                   snippet(search_fts, -1, '', '', ' ... ', 40)
+            FROM search_fts INNER JOIN search_doc AS d
+              ON d.id = search_fts.rowid
+            WHERE search_fts MATCH %s AND d.realm=%s"""
+        args = [query, realm]
+        if parent_realm is not None:
+            sql += " AND d.parent_realm=%s"
+            args.append(parent_realm)
+        sql += " ORDER BY bm25(search_fts, 10.0, 1.0) LIMIT %s"
+        args.append(limit)
+        # bm25() is lower for better matches.
+        return [(doc_id, -rank, snippet)
+                for doc_id, rank, snippet in db(sql, args)]
+
+
+class PostgreSQLSearchBackend(Component):
+    """Index `search_doc` with a `tsvector` column and a GIN index."""
+
+    implements(ISearchIndexBackend)
+
+    text_search_config = Option('search', 'postgresql_text_search_config',
+                                'simple',
+        """PostgreSQL text search configuration used by the full-text
+        index, e.g. `simple` or `english`. Rebuild the index after
+        changing it. (''since 1.6'')""")
+
+    def get_supported_schemes(self):
+        yield 'postgres'
+
+    def create_index(self, db):
+        db("ALTER TABLE search_doc ADD COLUMN tsv tsvector")
+        db("CREATE INDEX search_doc_tsv_idx ON search_doc USING GIN (tsv)")
+
+    def drop_index(self, db):
+        pass
+
+    def index_documents(self, db, docs):
+        ids = [doc[0] for doc in docs]
+        db("""UPDATE search_doc SET tsv =
+                setweight(to_tsvector(%%s, COALESCE(title, '')), 'A') ||
+                setweight(to_tsvector(%%s, COALESCE(body, '')), 'B')
+              WHERE id IN (%s)
+           """ % ','.join(['%s'] * len(ids)),
+           [self.text_search_config] * 2 + ids)
+
+    def unindex_documents(self, db, docs):
+        pass
+
+    def search(self, db, terms, realm, parent_realm, limit):
+        config = self.text_search_config
+        query = ' && '.join(['plainto_tsquery(%s, %s)'] * len(terms))
+        args = [config]
+        for term in terms:
+            args.extend([config, term])
+        sql = """
+            SELECT d.id, ts_rank(d.tsv, q.query),
+                   ts_headline(%%s, d.body, q.query,
+                               'StartSel="", StopSel="", MaxWords=40')
+            FROM search_doc AS d, (SELECT %s AS query) AS q
+            WHERE d.tsv @@ q.query AND d.realm=%%s""" % query
+        args.append(realm)
+        if parent_realm is not None:
+            sql += " AND d.parent_realm=%s"
+            args.append(parent_realm)
+        sql += " ORDER BY 2 DESC LIMIT %s"
+        args.append(limit)
+        return db(sql, args)
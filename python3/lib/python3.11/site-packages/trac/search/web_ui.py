@@ -79,6 +79,9 @@ class SearchModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/search']
+
     def match_request(self, req):
         return re.match(r'/search(?:/opensearch)?$', req.path_info) \
                is not None
@@ -234,7 +237,10 @@ class SearchModule(Component):
         for source in self.search_sources:
             results.extend(source.get_search_results(req, terms, filters)
                            or [])
-        return sorted(results, key=lambda x: x[2], reverse=True)
+        # Results ranked by the full-text index come first, best match
+        # first, then the remaining results, most recent first.
+        return sorted(results, key=lambda x: (x[5] if len(x) > 5 else 0,
+                                              x[2]), reverse=True)
 
     def _prepare_results(self, req, filters, results):
         page = req.args.getint('page', 1, min=1)
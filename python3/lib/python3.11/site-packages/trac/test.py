@@ -145,6 +145,9 @@ class MockPerm(object):
         pass
     assert_permission = require
 
+    def filter(self, action, resources):
+        return list(resources)
+
 
 def MockRequest(env, **kwargs):
     """Request object for testing. Keyword arguments populate an
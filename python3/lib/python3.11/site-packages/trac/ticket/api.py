@@ -21,8 +21,8 @@ from datetime import datetime
 
 from trac.cache import cached
 from trac.config import (
-    BoolOption, ConfigSection, IntOption, ListOption, Option,
-    OrderedExtensionsOption)
+    BoolOption, ConfigSection, IConfigurationChangeListener, IntOption,
+    ListOption, Option, OrderedExtensionsOption)
 from trac.core import *
 from trac.perm import IPermissionRequestor, PermissionCache, PermissionSystem
 from trac.resource import IResourceManager
@@ -205,8 +205,8 @@ class IMilestoneChangeListener(Interface):
 
 
 class TicketSystem(Component):
-    implements(IPermissionRequestor, IWikiSyntaxProvider, IResourceManager,
-               ITicketManipulator)
+    implements(IConfigurationChangeListener, IPermissionRequestor,
+               IWikiSyntaxProvider, IResourceManager, ITicketManipulator)
 
     change_listeners = ExtensionPoint(ITicketChangeListener)
     milestone_change_listeners = ExtensionPoint(IMilestoneChangeListener)
@@ -338,7 +338,12 @@ class TicketSystem(Component):
 
     def reset_ticket_fields(self):
         """Invalidate ticket field cache."""
+        from trac.ticket.resultcache import ResultCache
         del self.fields
+        # The results may show the renamed or deleted field values.
+        result_cache = self.env[ResultCache]
+        if result_cache:
+            result_cache.invalidate()
 
     @cached
     def fields(self):
@@ -581,6 +586,18 @@ class TicketSystem(Component):
             yield _("Must be less than or equal to %(num)s characters",
                     num=self.max_comment_size)
 
+    # IConfigurationChangeListener methods
+
+    def get_config_sections(self):
+        return ['ticket', 'ticket-custom']
+
+    def config_sections_changed(self, changes):
+        if 'ticket-custom' in changes:
+            del self.custom_fields
+        if 'ticket-custom' in changes or \
+                'allowed_empty_fields' in changes.get('ticket', ()):
+            self.reset_ticket_fields()
+
     # IPermissionRequestor methods
 
     def get_permission_actions(self):
@@ -50,6 +50,9 @@ class BatchModifyModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/batchmodify']
+
     def match_request(self, req):
         return req.path_info == '/batchmodify'
 
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 Hewlett Packard Enterprise Development LP.
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at https://trac.edgewall.org/wiki/TracLicense.
+
+"""Materialized, one-column-per-field copy of the `ticket_custom` table.
+
+Custom field values live in `ticket_custom`, one row per ticket and
+field, so ticket queries need one join (or a pivot over the whole
+table) per custom column. When the `ticket_custom_wide` table exists it
+holds one row per ticket with a column for each custom field, is kept
+up to date by the `Ticket` model and can be used by queries instead.
+"""
+
+from trac.admin.api import IAdminCommandProvider
+from trac.cache import cached
+from trac.config import BoolOption
+from trac.core import Component, implements
+from trac.db.api import DatabaseManager
+from trac.db.schema import Column, Index, Table
+from trac.ticket.api import TicketSystem
+from trac.util.text import printout
+from trac.util.translation import _
+
+
+__all__ = ['CustomFieldTable']
+
+
+class CustomFieldTable(Component):
+    """Maintain the `ticket_custom_wide` table and tell queries when they
+    can use it.
+
+    The table is created and filled with `trac-admin $ENV ticket
+    custom_table rebuild`. From then on, ticket changes are written to
+    it as well as to `ticket_custom`, until it is dropped again with
+    `trac-admin $ENV ticket custom_table drop`.
+    """
+
+    implements(IAdminCommandProvider)
+
+    table_name = 'ticket_custom_wide'
+
+    enabled = BoolOption('ticket', 'use_custom_fields_table', 'false',
+        """Use the `ticket_custom_wide` table, with one row per ticket and
+        one indexed column per custom field, in ticket queries and
+        roadmap statistics instead of joining `ticket_custom` once per
+        custom field. Has no effect until the table has been built with
+        `trac-admin $ENV ticket custom_table rebuild`. Fields added to
+        `[ticket-custom]` after the table was built are queried from
+        `ticket_custom` until the table is rebuilt.
+        (''since 1.6'')""")
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('ticket custom_table rebuild', '',
+               """Rebuild the materialized custom field table
+
+               Creates the `ticket_custom_wide` table with a column for
+               each custom field and fills it from `ticket_custom`.
+               Run again after adding custom fields.
+               """,
+               None, self._do_rebuild)
+        yield ('ticket custom_table drop', '',
+               "Drop the materialized custom field table",
+               None, self._do_drop)
+
+    def _do_rebuild(self):
+        count = self.rebuild()
+        printout(_("Materialized %(fields)s custom fields for %(num)s "
+                   "tickets.", fields=len(self.columns), num=count))
+
+    def _do_drop(self):
+        self.drop()
+
+    # Public API
+
+    @cached
+    def columns(self):
+        """Names of the custom fields held by the table, an empty tuple if
+        the table doesn't exist."""
+        with self.env.db_query as db:
+            if not db.has_table(self.table_name):
+                return ()
+            return tuple(name
+                         for name in db.get_column_names(self.table_name)
+                         if name != 'ticket')
+
+    def covers(self, names):
+        """Return whether queries on the custom fields `names` should
+        read from the table."""
+        if not self.enabled:
+            return False
+        columns = self.columns
+        return bool(columns) and all(name in columns for name in names)
+
+    def update(self, db, tkt_id, values):
+        """Copy custom field database `values` (a dict) of ticket `tkt_id`
+        into the table, within the transaction `db` that writes them to
+        `ticket_custom`. Does nothing if the table doesn't exist."""
+        columns = self.columns
+        names = [name for name in values if name in columns]
+        if not names:
+            return
+        table = db.quote(self.table_name)
+        args = [values[name] for name in names]
+        if db("SELECT ticket FROM %s WHERE ticket=%%s" % table, (tkt_id,)):
+            db("UPDATE %s SET %s WHERE ticket=%%s"
+               % (table, ','.join('%s=%%s' % db.quote(name)
+                                  for name in names)),
+               args + [tkt_id])
+        else:
+            db("INSERT INTO %s (ticket,%s) VALUES (%%s,%s)"
+               % (table, ','.join(db.quote(name) for name in names),
+                  ','.join(['%s'] * len(names))),
+               [tkt_id] + args)
+
+    def delete(self, db, tkt_id):
+        """Remove ticket `tkt_id` from the table, within the transaction
+        `db` that deletes the ticket."""
+        if self.columns:
+            db("DELETE FROM %s WHERE ticket=%%s"
+               % db.quote(self.table_name), (tkt_id,))
+
+    def rebuild(self):
+        """Create the table for the current custom fields and fill it
+        from `ticket_custom`. Returns the number of tickets copied."""
+        fields = TicketSystem(self.env).custom_fields
+        names = [f['name'] for f in fields]
+        table = Table(self.table_name, key='ticket')[
+            [Column('ticket', type='int')] +
+            [Column(name) for name in names] +
+            # Large text values can't be indexed by all backends.
+            [Index([f['name']]) for f in fields
+                                if f['type'] != 'textarea']]
+        dbm = DatabaseManager(self.env)
+        with self.env.db_transaction as db:
+            dbm.drop_tables([self.table_name])
+            del self.columns
+            if not names:
+                return 0
+            dbm.create_tables([table])
+            db("""INSERT INTO %s (ticket,%s)
+                  SELECT ticket,%s FROM ticket_custom
+                  WHERE name IN (%s) GROUP BY ticket
+                  """ % (db.quote(self.table_name),
+                         ','.join(db.quote(name) for name in names),
+                         ','.join("MAX(CASE WHEN name='%s' THEN value END)"
+                                  % name for name in names),
+                         ','.join("'%s'" % name for name in names)))
+            count = db("SELECT COUNT(*) FROM %s"
+                       % db.quote(self.table_name))[0][0]
+        self.log.info("Rebuilt %s with %d custom fields for %d tickets",
+                      self.table_name, len(names), count)
+        return count
+
+    def drop(self):
+        """Drop the table. Ticket changes are no longer copied to it."""
+        with self.env.db_transaction:
+            DatabaseManager(self.env).drop_tables([self.table_name])
+            del self.columns
@@ -23,7 +23,8 @@ from functools import partial
 from pkg_resources import resource_filename
 
 from trac.api import IEnvironmentSetupParticipant
-from trac.config import ConfigSection, Configuration, ConfigurationError
+from trac.config import ConfigSection, Configuration, ConfigurationError, \
+                        IConfigurationChangeListener
 from trac.core import *
 from trac.perm import PermissionCache, PermissionSystem
 from trac.resource import ResourceNotFound
@@ -123,7 +124,8 @@ class ConfigurableTicketWorkflow(Component):
     [wiki:TracIni#ticket-workflow-section trac.ini] configuration file.
     """
 
-    implements(IEnvironmentSetupParticipant, ITicketActionController)
+    implements(IConfigurationChangeListener, IEnvironmentSetupParticipant,
+               ITicketActionController)
 
     ticket_workflow_section = ConfigSection('ticket-workflow',
         """The workflow for tickets is controlled by plugins. By default,
@@ -141,6 +143,16 @@ class ConfigurableTicketWorkflow(Component):
         self.log.debug('Workflow actions at initialization: %s\n',
                        self.actions)
 
+    # IConfigurationChangeListener methods
+
+    def get_config_sections(self):
+        return ['ticket-workflow']
+
+    def config_sections_changed(self, changes):
+        self.actions = self.get_all_actions()
+        self.log.debug('Workflow actions after configuration change: %s\n',
+                       self.actions)
+
     # IEnvironmentSetupParticipant methods
 
     def environment_created(self):
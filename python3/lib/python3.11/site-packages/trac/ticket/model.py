@@ -25,6 +25,7 @@ from trac.cache import cached
 from trac.core import TracError
 from trac.resource import Resource, ResourceExistsError, ResourceNotFound
 from trac.ticket.api import TicketSystem
+from trac.ticket.customtable import CustomFieldTable
 from trac.util import as_int, embedded_numbers, to_list
 from trac.util.datefmt import (datetime_now, from_utimestamp, parse_date,
                                to_utimestamp, utc, utcmax)
@@ -315,6 +316,8 @@ class Ticket(object):
                        VALUES (%s, %s, %s)
                     """, [(tkt_id, c, db_values.get(c))
                           for c in custom_fields])
+                CustomFieldTable(self.env).update(
+                    db, tkt_id, {c: db_values.get(c) for c in custom_fields})
 
         self.id = int(tkt_id)
         self._old = {}
@@ -414,6 +417,9 @@ class Ticket(object):
                       VALUES (%s, %s, %s, %s, %s, %s)
                       """, (self.id, db_values['changetime'], author, name,
                             old_db_val, db_val))
+            CustomFieldTable(self.env).update(
+                db, self.id, {name: db_values.get(name) for name in self._old
+                              if name in self.custom_fields})
 
             # always save comment, even if empty
             # (numbering support for timeline)
@@ -498,6 +504,7 @@ class Ticket(object):
             db("DELETE FROM ticket WHERE id=%s", (self.id,))
             db("DELETE FROM ticket_change WHERE ticket=%s", (self.id,))
             db("DELETE FROM ticket_custom WHERE ticket=%s", (self.id,))
+            CustomFieldTable(self.env).delete(db, self.id)
 
         for listener in TicketSystem(self.env).change_listeners:
             listener.ticket_deleted(self)
@@ -567,6 +574,8 @@ class Ticket(object):
                         db("""UPDATE ticket_custom SET value=%s
                               WHERE ticket=%s AND name=%s
                               """, (oldvalue, self.id, field))
+                        CustomFieldTable(self.env).update(
+                            db, self.id, {field: oldvalue})
 
             # Delete the change
             db("DELETE FROM ticket_change WHERE ticket=%s AND time=%s",
@@ -29,7 +29,9 @@ from trac.db import get_column_names
 from trac.mimeview.api import IContentConverter, Mimeview
 from trac.resource import Resource
 from trac.ticket.api import TicketSystem, translation_deactivated
+from trac.ticket.customtable import CustomFieldTable
 from trac.ticket.model import Milestone, _datetime_to_db_str
+from trac.ticket.resultcache import ResultCache
 from trac.ticket.roadmap import group_milestones
 from trac.util import Ranges, as_bool, as_int
 from trac.util.datefmt import (datetime_now, from_utimestamp,
@@ -67,7 +69,7 @@ class Query(object):
 
     def __init__(self, env, report=None, constraints=None, cols=None,
                  order=None, desc=0, group=None, groupdesc=0, verbose=0,
-                 rows=None, page=None, max=None, format=None):
+                 rows=None, page=None, max=None, format=None, after=None):
         self.env = env
         self.id = report  # if not None, it's the corresponding saved query
         constraints = constraints or []
@@ -133,6 +135,16 @@ class Query(object):
         if self.group not in field_names:
             self.group = None
 
+        # Keyset pagination: continue after the ticket at position `after`
+        # ("<changetime>:<id>" or "<id>") instead of skipping `offset`
+        # tickets, so that deep pages are as cheap as the first one.
+        self.after = after or None
+        self.next_after = None
+        if self.after:
+            self._seek = self._parse_after(self.after)
+            self.has_more_pages = False
+            self.offset = 0
+
         constraint_cols = {}
         for clause in self.constraints:
             for col in sorted(clause):
@@ -147,7 +159,7 @@ class Query(object):
 
     @classmethod
     def from_string(cls, env, string, **kw):
-        kw_strs = ['order', 'group', 'page', 'max', 'format']
+        kw_strs = ['order', 'group', 'page', 'max', 'format', 'after']
         kw_arys = ['rows']
         kw_bools = ['desc', 'groupdesc', 'verbose']
         kw_synonyms = {'row': 'rows'}
@@ -263,6 +275,29 @@ class Query(object):
             cols[-1] = self.order
         return cols
 
+    @property
+    def _can_seek(self):
+        # Whether the position of a ticket in the results is given by its
+        # changetime and id, as needed by keyset pagination.
+        return self.order in ('changetime', 'id') and not self.group and \
+               bool(self.max)
+
+    def _parse_after(self, after):
+        if not self._can_seek:
+            raise TracError(_("Keyset pagination requires ordering by "
+                              "changetime or id, without grouping and "
+                              "with a maximum number of tickets per "
+                              "page."))
+        try:
+            seek = tuple(int(value) for value in after.split(':'))
+        except ValueError:
+            seek = ()
+        if len(seek) != (2 if self.order == 'changetime' else 1) or \
+                any(abs(value) >= 2 ** 63 for value in seek):
+            raise TracError(_("Query position %(after)s is invalid.",
+                              after=after))
+        return seek
+
     def count(self, req=None, cached_ids=None, authname=None):
         """Get the number of matching tickets for the present query.
         """
@@ -281,52 +316,172 @@ class Query(object):
         """
         if req is not None:
             href = req.href
+            authname = req.authname
 
-        self.num_items = 0
+        def execute():
+            results = self._execute(req, cached_ids, authname, href)
+            return results, self.num_items, self.has_more_pages, \
+                   self.next_after
+        # Constraints like `today..` select other tickets the next day.
+        time_bounds = self._get_time_bounds(req)
+        if time_bounds != self._get_time_bounds(req):
+            # Constraints like `-1w..` move with the current time.
+            values = execute()
+        else:
+            key = ('query',
+                   self.get_href(Href(''), format='', after=self.after),
+                   authname, tuple(cached_ids or ()),
+                   href.base if href else None, time_bounds)
+            values = ResultCache(self.env).get(key, execute)
+        results, self.num_items, self.has_more_pages, self.next_after = values
+        return [dict(result) for result in results]
+
+    def _get_time_bounds(self, req):
+        """Return the bounds of the constraints on time fields, resolved
+        at the current time."""
+        def parse(value):
+            try:
+                return user_time(req, parse_date, value) if value else None
+            except TracError:
+                return None
+        bounds = []
+        for clause in self.constraints:
+            for name, values in sorted(clause.items()):
+                if name in self.time_fields:
+                    for value in values:
+                        value = value.lstrip('!')
+                        if '..' in value:
+                            start, end = value.split('..', 1)
+                        else:
+                            start, end = value, ''
+                        bounds.append((name, parse(start.strip()),
+                                       parse(end.strip())))
+        return tuple(bounds)
+
+    def execute_iter(self, req=None, cached_ids=None, authname=None,
+                     href=None, chunk_size=1000):
+        """Generate lists of at most `chunk_size` matching tickets.
+
+        Unlike `execute`, the tickets are read from the database as the
+        lists are consumed, the total number of tickets isn't computed
+        and the results are not cached.
+        """
+        if req is not None:
+            href = req.href
         sql, args = self.get_sql(req, cached_ids, authname)
-        self.num_items = self._count(sql, args)
-
-        if self.num_items <= self.max:
-            self.has_more_pages = False
-
-        if self.has_more_pages:
-            max = self.max
-            if self.group:
-                max += 1
-            sql += " LIMIT %d OFFSET %d" % (max, self.offset)
-            if (self.page > int(ceil(float(self.num_items) / self.max)) and
-                self.num_items != 0):
-                raise TracError(_("Page %(page)s is beyond the number of "
-                                  "pages in the query", page=self.page))
+        if self.after:
+            sql += " LIMIT %d" % self.max
+        elif self.has_more_pages:
+            sql += " LIMIT %d OFFSET %d" % (self.max, self.offset)
+        with self.env.db_query as db:
+            cursor = db.streaming_cursor()
+            try:
+                cursor.execute(sql, args)
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    yield self._convert_rows(get_column_names(cursor), rows,
+                                             href)
+            finally:
+                cursor.close()
 
-        results = []
+    def _execute(self, req, cached_ids, authname, href):
+        self.num_items = 0
+        sql, args = self.get_sql(req, cached_ids, authname)
         with self.env.db_query as db:
+            if self.after:
+                # Fetch one more ticket to know whether there is a next page
+                sql += " LIMIT %d" % (self.max + 1)
+                num_items_col = False
+            elif self.has_more_pages and db.supports_window_functions:
+                # Get the page and the total number of tickets at once
+                sql = "SELECT COUNT(*) OVER () AS _num_items," + \
+                      sql[len("SELECT "):]
+                sql += " LIMIT %d OFFSET %d" % (self._page_size, self.offset)
+                num_items_col = True
+            else:
+                self.num_items = self._count(sql, args)
+                self._check_page()
+                if self.has_more_pages:
+                    sql += " LIMIT %d OFFSET %d" % (self._page_size,
+                                                    self.offset)
+                num_items_col = False
+
             cursor = db.cursor()
             cursor.execute(sql, args)
             columns = get_column_names(cursor)
-            fields = [self.fields.by_name(column, None) for column in columns]
-
-            for row in cursor:
-                result = {}
-                for name, field, val in zip(columns, fields, row):
-                    if name == 'reporter':
-                        val = val or 'anonymous'
-                    elif name == 'id':
-                        val = int(val)
-                        if href is not None:
-                            result['href'] = href.ticket(val)
-                    elif name in self.time_fields:
-                        val = from_utimestamp(int(val)) if val else None
-                    elif field and field['type'] == 'checkbox':
-                        val = as_bool(val)
-                    elif val is None:
-                        val = ''
-                    result[name] = val
-                results.append(result)
-            return results
+            rows = cursor.fetchall()
+
+        if num_items_col:
+            columns = columns[1:]
+            if rows:
+                self.num_items = rows[0][0]
+            elif self.offset:
+                # Beyond the last page, or the tickets are gone meanwhile
+                self.num_items = self._count(*self.get_sql(req, cached_ids,
+                                                           authname))
+            self._check_page()
+            rows = [row[1:] for row in rows]
+
+        results = self._convert_rows(columns, rows, href)
+        if self.after:
+            self.num_items = None
+            if len(results) > self.max:
+                del results[self.max:]
+                self.next_after = self._get_position(results[-1])
+        elif self._can_seek and results and self.has_more_pages and \
+                self.offset + len(results) < self.num_items:
+            # Let the next page continue with keyset pagination.
+            self.next_after = self._get_position(results[-1])
+        return results
+
+    def _get_position(self, ticket):
+        if self.order == 'changetime':
+            return '%d:%d' % (to_utimestamp(ticket['changetime']),
+                              ticket['id'])
+        else:
+            return '%d' % ticket['id']
+
+    @property
+    def _page_size(self):
+        # One more ticket tells whether the last group continues on the
+        # next page.
+        return self.max + 1 if self.group else self.max
+
+    def _check_page(self):
+        if self.num_items <= self.max:
+            self.has_more_pages = False
+        if self.has_more_pages and \
+                self.page > int(ceil(float(self.num_items) / self.max)) and \
+                self.num_items != 0:
+            raise TracError(_("Page %(page)s is beyond the number of "
+                              "pages in the query", page=self.page))
+
+    def _convert_rows(self, columns, rows, href):
+        fields = [self.fields.by_name(column, None) for column in columns]
+        results = []
+        for row in rows:
+            result = {}
+            for name, field, val in zip(columns, fields, row):
+                if name == 'reporter':
+                    val = val or 'anonymous'
+                elif name == 'id':
+                    val = int(val)
+                    if href is not None:
+                        result['href'] = href.ticket(val)
+                elif name in self.time_fields:
+                    val = from_utimestamp(int(val)) if val else None
+                elif field and field['type'] == 'checkbox':
+                    val = as_bool(val)
+                elif val is None:
+                    val = ''
+                result[name] = val
+            results.append(result)
+        return results
 
     def get_href(self, href, id=None, order=None, desc=None, format=None,
-                 max=None, page=None):
+                 max=None, page=None, after=None):
         """Create a link corresponding to this query.
 
         :param href: the `Href` object used to build the URL
@@ -337,6 +492,9 @@ class Query(object):
         :param max: optionally override the max items per page
         :param page: optionally specify which page of results (defaults to
                      the first)
+        :param after: optionally continue after the given position,
+                      like `next_after` after `execute` (keyset
+                      pagination)
 
         Note: `get_resource_url` of a 'query' resource?
         """
@@ -384,6 +542,7 @@ class Query(object):
             ('col', cols),
             ('row', self.rows),
             ('page', page),
+            ('after', after),
             ('format', format),
         ])
         return href.query(args)
@@ -424,7 +583,9 @@ class Query(object):
                                  if f['type'] == 'text' and
                                     f.get('format') == 'list'}
         cols_custom = [k for k in cols if k in custom_fields]
-        use_joins = len(cols_custom) <= 1
+        custom_table = CustomFieldTable(self.env)
+        use_table = bool(cols_custom) and custom_table.covers(cols_custom)
+        use_joins = not use_table and len(cols_custom) <= 1
         enum_columns = [col for col in ('resolution', 'priority', 'severity',
                                         'type')
                             if col not in custom_fields and
@@ -440,7 +601,14 @@ class Query(object):
             sql.append(",priority.value AS _priority_value")
 
         with self.env.db_query as db:
-            if use_joins:
+            if use_table:
+                # Use the materialized table with a column per custom field
+                sql.extend(",c.%(qk)s AS %(qk)s" % {'qk': db.quote(k)}
+                           for k in cols_custom)
+                sql.append("\nFROM ticket AS t"
+                           "\n  LEFT OUTER JOIN %s AS c ON c.ticket=t.id"
+                           % db.quote(custom_table.table_name))
+            elif use_joins:
                 # Use LEFT OUTER JOIN for ticket_custom table
                 sql.extend(",%(qk)s.value AS %(qk)s" % {'qk': db.quote(k)}
                            for k in cols_custom)
@@ -637,11 +805,25 @@ class Query(object):
             clauses = list(filter(None, map(get_clause_sql, self.constraints)))
             if clauses:
                 sql.append("\nWHERE ")
+                if self.after:
+                    sql.append("(")
                 sql.append(" OR ".join('(%s)' % c for c in clauses))
                 if cached_ids:
                     sql.append(" OR ")
                     sql.append("t.id in (%s)" %
                                (','.join(str(id) for id in cached_ids)))
+            if self.after:
+                sql.append(") AND " if clauses else "\nWHERE ")
+                op = '<' if self.desc else '>'
+                if self.order == 'changetime':
+                    # Ties on changetime are ordered by ascending id
+                    sql.append("(t.changetime%s%%s OR (t.changetime=%%s AND "
+                               "t.id>%%s))" % op)
+                    args.extend([self._seek[0], self._seek[0],
+                                 self._seek[1]])
+                else:
+                    sql.append("t.id%s%%s" % op)
+                    args.append(self._seek[0])
 
             sql.append("\nORDER BY ")
             order_cols = [(self.order, self.desc)]
@@ -808,15 +990,31 @@ class Query(object):
                 last_group_is_partial = True
                 del groupsequence[-1][1][-1]  # remove the additional ticket
 
-        results = Paginator(tickets,
-                            self.page - 1,
-                            self.max,
-                            self.num_items)
+        if self.after:
+            # The total number of tickets isn't known, only whether there
+            # is a next page.
+            results = Paginator(tickets, 0, self.max, len(tickets))
+            if self.next_after:
+                results.num_pages = 2
+        else:
+            results = Paginator(tickets,
+                                self.page - 1,
+                                self.max,
+                                self.num_items)
 
-        if req:
-            if results.has_next_page:
+        if req and self.after:
+            if self.next_after:
                 next_href = self.get_href(req.href, max=self.max,
-                                          page=self.page + 1)
+                                          after=self.next_after)
+                add_link(req, 'next', next_href, _("Next Page"))
+        elif req:
+            if results.has_next_page:
+                if self.next_after:
+                    next_href = self.get_href(req.href, max=self.max,
+                                              after=self.next_after)
+                else:
+                    next_href = self.get_href(req.href, max=self.max,
+                                              page=self.page + 1)
                 add_link(req, 'next', next_href, _("Next Page"))
 
             if results.has_previous_page:
@@ -827,7 +1025,7 @@ class Query(object):
             results.show_index = False
 
         pagedata = []
-        shown_pages = results.get_shown_pages(21)
+        shown_pages = results.get_shown_pages(21) if not self.after else []
         for page in shown_pages:
             pagedata.append([self.get_href(context.href, page=page), None,
                              str(page), _("Page %(num)d", num=page)])
@@ -913,6 +1111,9 @@ class QueryModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/query']
+
     def match_request(self, req):
         return req.path_info == '/query'
 
@@ -977,7 +1178,8 @@ class QueryModule(Component):
         query = Query(self.env, report_id,
                       constraints, cols, order, as_bool(args.get('desc')),
                       group, as_bool(args.get('groupdesc')),
-                      as_bool(args.get('verbose')), rows, page, max)
+                      as_bool(args.get('verbose')), rows, page, max,
+                      after=args.get('after'))
 
         if 'update' in req.args:
             # Reset session vars
@@ -1190,18 +1392,18 @@ class QueryModule(Component):
 
             chrome = Chrome(self.env)
             context = web_context(req)
-            results = query.execute(req)
             fields = dict((f['name'], f) for f in query.fields)
-            for result in results:
-                ticket = Resource(self.realm, result['id'])
-                if 'TICKET_VIEW' in req.perm(ticket):
+            for results in query.execute_iter(req):
+                lines = []
+                for result in self._filter_viewable(req, results):
+                    ticket = Resource(self.realm, result['id'])
                     values = []
                     for col in cols:
                         value = result[col]
                         field = fields.get(col)
                         if col in ('cc', 'owner', 'reporter'):
-                            value = chrome.format_emails(context.child(ticket),
-                                                         value)
+                            value = chrome.format_emails(
+                                context.child(ticket), value)
                         elif col in query.time_fields:
                             format = query.fields.by_name(col).get('format')
                             value = user_time(req, format_date_or_datetime,
@@ -1209,10 +1411,19 @@ class QueryModule(Component):
                         elif field and field['type'] == 'checkbox':
                             value = '1' if value else '0'
                         values.append(value)
-                    yield writerow(values)
+                    lines.append(writerow(values))
+                yield b''.join(lines)
 
         return iterate(), '%s;charset=utf-8' % mimetype
 
+    def _filter_viewable(self, req, results):
+        """Return the `results` of a query the user can view."""
+        viewable = set(req.perm.filter('TICKET_VIEW',
+                                       [Resource(self.realm, result['id'])
+                                        for result in results]))
+        return [result for result in results
+                if Resource(self.realm, result['id']) in viewable]
+
     def _export_rss(self, req, query):
         context = web_context(req, 'query', absurls=True)
         query_href = query.get_href(context.href)
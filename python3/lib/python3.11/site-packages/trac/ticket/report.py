@@ -23,10 +23,12 @@ import re
 from trac.config import IntOption
 from trac.core import *
 from trac.db.api import get_column_names
+from trac.mimeview.api import Mimeview
 from trac.perm import IPermissionRequestor
 from trac.resource import Resource, ResourceNotFound
 from trac.ticket.api import TicketSystem
 from trac.ticket.model import Report
+from trac.ticket.resultcache import ResultCache
 from trac.util import as_int, content_disposition
 from trac.util.datefmt import format_datetime, format_time, from_utimestamp
 from trac.util.html import tag
@@ -46,6 +48,10 @@ SORT_COLUMN = '@SORT_COLUMN@'
 LIMIT_OFFSET = '@LIMIT_OFFSET@'
 
 
+class _ReportError(Exception):
+    """The execution of a report failed. Not meant to leave the module."""
+
+
 def cell_value(v):
     """Normalize a cell value for display.
     >>> (cell_value(None), cell_value(0), cell_value(1), cell_value('v'))
@@ -90,6 +96,19 @@ def sql_skeleton(sql):
 
 _order_by_re = re.compile(r'ORDER\s+BY', re.MULTILINE)
 
+# Top-level select list of a query skeleton, see `sql_skeleton`
+_select_list_re = re.compile(r'\s*SELECT\s+(?:ALL\s+)?(.*?)\s+FROM\b',
+                             re.IGNORECASE | re.DOTALL)
+
+_set_operation_re = re.compile(r'\b(?:UNION|INTERSECT|EXCEPT)\b',
+                               re.IGNORECASE)
+
+# Functions returning the current time in SQLite (`'now'`), PostgreSQL
+# and MySQL
+_now_re = re.compile(r"\bnow\b|\bcurrent_(?:date|time|timestamp)\b|"
+                     r"\blocaltime(?:stamp)?\b|\bsysdate\b|"
+                     r"\bunix_timestamp\s*\(\s*\)", re.IGNORECASE)
+
 
 def split_sql(sql, clause_re, skel=None):
     """Split an SQL query according to a toplevel clause regexp.
@@ -147,6 +166,9 @@ class ReportModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/report']
+
     def match_request(self, req):
         match = re.match(r'/report(?:/(?:([0-9]+)|%s))?$'
                          % self.REPORT_LIST_ID, req.path_info)
@@ -429,6 +451,24 @@ class ReportModule(Component):
         data.update({'args': args, 'title': sub_vars(title, args),
                      'description': sub_vars(description or '', args)})
 
+        if format in ('csv', 'tab') and not limit and not sort_col:
+            # Stream the rows, errors are reported by the paginated path
+            chunks = self._iter_report_chunks(id, sql, args)
+            try:
+                cols = next(chunks)
+            except Exception as e:
+                self.log.warning("Report {%d} can't be streamed: %s", id,
+                                 exception_to_unicode(e))
+            else:
+                rows = self._iter_authorized_rows(req, context, cols, chunks)
+                if format == 'csv':
+                    self._send_csv(req, cols, rows, mimetype='text/csv',
+                                   filename='report_%s.csv' % id)
+                else:
+                    self._send_csv(req, cols, rows, '\t',
+                                   mimetype='text/tab-separated-values',
+                                   filename='report_%s.tsv' % id)
+
         try:
             res = self.execute_paginated_report(req, id, sql, args, limit,
                                                 offset)
@@ -681,6 +721,29 @@ class ReportModule(Component):
         :param limit: Maximum number of results to return (optional).
         :param offset: Offset to start of results (optional).
         """
+        if id == self.REPORT_LIST_ID or _now_re.search(sql):
+            # The results of a report selecting tickets relative to the
+            # current time change with it.
+            return self._execute_paginated_report(req, id, sql, args, limit,
+                                                  offset)
+        key = ('report', id, sql, tuple(sorted(args.items())), limit,
+               offset, req.args.get('sort'), req.args.get('asc'),
+               req.authname)
+        def execute():
+            res = self._execute_paginated_report(req, id, sql, args, limit,
+                                                 offset)
+            if len(res) == 2:  # errors are not cached
+                raise _ReportError(res)
+            return res
+        try:
+            cols, rows, num_items, missing_args, limit_offset = \
+                ResultCache(self.env).get(key, execute)
+        except _ReportError as e:
+            return e.args[0]
+        return list(cols), list(rows), num_items, list(missing_args), \
+               limit_offset
+
+    def _execute_paginated_report(self, req, id, sql, args, limit, offset):
         sql, args, missing_args = self.sql_sub_vars(sql, args)
         if not sql:
             raise TracError(_("Report {%(num)s} has no SQL query.", num=id))
@@ -698,6 +761,20 @@ class ReportModule(Component):
             if id == self.REPORT_LIST_ID or limit == 0:
                 sql = base_sql
             else:
+                if db.supports_window_functions and \
+                        not req.args.get('sort') and \
+                        LIMIT_OFFSET not in sql and \
+                        'LIMIT' not in sql_skeleton(sql).upper():
+                    # Without a sort column to insert, the page and the
+                    # number of tickets can be obtained at once
+                    res = self._execute_single_pass_report(cursor, id,
+                                                           base_sql, args,
+                                                           limit, offset)
+                    if res is not None and len(res) == 2:  # error
+                        return res
+                    elif res is not None:
+                        return res[:3] + (missing_args,) + res[3:]
+
                 # The number of tickets is obtained
                 count_sql = 'SELECT COUNT(*) FROM (\n%s\n) AS tab' % base_sql
                 self.log.debug("Report {%d} SQL (count): %s", id, count_sql)
@@ -795,6 +872,110 @@ class ReportModule(Component):
 
         return cols, rows, num_items, missing_args, limit_offset
 
+    def _iter_report_chunks(self, id, sql, args, chunk_size=1000):
+        """Execute the report and generate its column names, then lists
+        of at most `chunk_size` rows read from the database as they are
+        consumed.
+        """
+        sql, args, missing_args = self.sql_sub_vars(sql, args)
+        if not sql:
+            raise TracError(_("Report {%(num)s} has no SQL query.", num=id))
+        sql = sql.replace(SORT_COLUMN, '1').replace(LIMIT_OFFSET, '')
+        self.log.debug("Report {%d} SQL (streamed): %s", id, sql)
+        with self.env.db_query as db:
+            cursor = db.streaming_cursor()
+            try:
+                cursor.execute(sql, args)
+                rows = cursor.fetchmany(chunk_size)
+                yield get_column_names(cursor)
+                while rows:
+                    yield rows
+                    rows = cursor.fetchmany(chunk_size)
+            finally:
+                cursor.close()
+
+    def _iter_authorized_rows(self, req, context, cols, chunks):
+        """Generate the rows of the report `chunks` the user can view,
+        with e-mail addresses formatted as in the report view."""
+        chrome = Chrome(self.env)
+        stripped = [col.strip('_') for col in cols]
+        id_idx = [idx for idx, col in enumerate(cols)
+                  if col in ('report', 'ticket', 'id', '_id')]
+        email_idx = [idx for idx, col in enumerate(stripped)
+                     if col in ('reporter', 'cc', 'owner')]
+        def column(row, name):
+            values = [row[idx] for idx, col in enumerate(stripped)
+                      if col == name]
+            return cell_value(values[-1]) if values else ''
+        for rows in chunks:
+            resources = []
+            for row in rows:
+                id = cell_value(row[id_idx[-1]]) if id_idx else None
+                realm = column(row, 'realm') or TicketSystem.realm
+                parent_realm = column(row, 'parent_realm')
+                if parent_realm:
+                    parent = Resource(parent_realm, column(row, 'parent_id'))
+                    resources.append(Resource(realm, id, parent=parent))
+                else:
+                    resources.append(Resource(realm, id))
+            viewable = set()
+            for realm in {resource.realm for resource in resources}:
+                viewable.update(req.perm.filter(
+                    realm.upper() + '_VIEW',
+                    [resource for resource in resources
+                              if resource.realm == realm]))
+            for row, resource in zip(rows, resources):
+                if resource not in viewable:
+                    continue
+                if email_idx:
+                    row = list(row)
+                    for idx in email_idx:
+                        row[idx] = chrome.format_emails(
+                            context.child(resource), cell_value(row[idx]))
+                yield row
+
+    def _execute_single_pass_report(self, cursor, id, sql, args, limit,
+                                    offset):
+        """Fetch a page of the report along with the total number of
+        results, using a window function.
+
+        Returns `(cols, rows, num_items, limit_offset)`, `(exception,
+        sql)` on error or `None` if the page is beyond the last one or
+        the query is not a plain `SELECT` the window function can be
+        added to.
+        """
+        # The window function is added to the select list of the report
+        # itself, so that the database keeps using its ORDER BY for the
+        # LIMIT.
+        skel = sql_skeleton(sql)
+        match = _select_list_re.match(skel)
+        if not match or _set_operation_re.search(skel):
+            return None
+        select_list = match.group(1)
+        if select_list == '*' or \
+                select_list.upper().startswith('DISTINCT'):
+            return None
+        page_sql = '%s, COUNT(*) OVER () AS __num_items__%s\n' \
+                   'LIMIT %d OFFSET %d' \
+                   % (sql[:match.end(1)], sql[match.end(1):], limit, offset)
+        self.log.debug("Report {%d} SQL (single pass): %s", id, page_sql)
+        try:
+            cursor.execute(page_sql, args)
+        except Exception as e:
+            self.log.warning('Exception caught while executing Report '
+                             '{%d}: %r, args %r%s', id, page_sql, args,
+                             exception_to_unicode(e, traceback=True))
+            return e, page_sql
+        rows = cursor.fetchall() or []
+        cols = get_column_names(cursor)[:-1]
+        num_items = rows[0][-1] if rows else 0
+        if offset and num_items <= limit:
+            return None
+        limit_offset = ''
+        if num_items > limit:
+            limit_offset = 'LIMIT %d OFFSET %d' % (limit, offset)
+        return cols, [row[:-1] for row in rows], num_items, limit_offset
+
     # Regular expression for default values of report variables,
     # as defined in SQL comments:
     #
@@ -916,23 +1097,9 @@ class ReportModule(Component):
                                for i, cell in enumerate(row)
                                if cols[i] not in self._html_cols)
 
-        data = iterate()
-        if Chrome(self.env).use_chunked_encoding:
-            length = None
-        else:
-            data = b''.join(data)
-            length = len(data)
-
-        req.send_response(200)
-        req.send_header('Content-Type', mimetype + ';charset=utf-8')
-        if length is not None:
-            req.send_header('Content-Length', length)
-        if filename:
-            req.send_header('Content-Disposition',
-                            content_disposition('attachment', filename))
-        req.end_headers()
-        req.write(data)
-        raise RequestDone
+        Mimeview(self.env).send_download(req, iterate(),
+                                         mimetype + ';charset=utf-8',
+                                         filename)
 
     def _send_sql(self, req, id, title, description, sql):
         req.perm(self.realm, id).require('REPORT_SQL_VIEW')
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 Hewlett Packard Enterprise Development LP.
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at https://trac.edgewall.org/wiki/TracLicense.
+
+"""Cache of ticket query and report results.
+
+Dashboards polling the same `/query` or `/report/N` URL every few
+seconds get the results of the previous execution as long as no ticket
+or milestone changed, nor the options of the ticket fields (components,
+versions, priorities, ...). Each process keeps its own bounded LRU of results;
+changes bump the generation of the cache through the `CacheManager`, so
+that every process sharing the environment drops its results.
+"""
+
+import collections
+import threading
+
+from trac.admin.api import IAdminPanelProvider
+from trac.cache import cached
+from trac.config import IConfigurationChangeListener, IntOption
+from trac.core import Component, implements
+from trac.db.api import DatabaseManager
+from trac.ticket.api import IMilestoneChangeListener, ITicketChangeListener
+from trac.util.translation import _
+from trac.web.chrome import add_notice
+
+
+__all__ = ['ResultCache']
+
+
+class ResultCache(Component):
+    """Cache the results of ticket queries and reports until the next
+    ticket or milestone change."""
+
+    implements(IAdminPanelProvider, IConfigurationChangeListener,
+               IMilestoneChangeListener, ITicketChangeListener)
+
+    size = IntOption('ticket', 'result_cache_size', 100,
+        """Number of ticket query and report results kept in memory by
+        each process, until a ticket, a milestone or the options of a
+        ticket field (e.g. the components) change. Set to `0` to disable
+        the cache. Queries with constraints relative to the current time
+        (e.g. `created=-1w..`) and reports using the current time of the
+        database (e.g. `datetime('now')`) are not cached. Reports reading
+        other data than tickets and milestones (e.g. wiki pages or
+        sessions) may show stale results until the next ticket change.
+        (''since 1.6'')""")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+        self._loaded = False
+
+    # IAdminPanelProvider methods
+
+    def get_admin_panels(self, req):
+        if 'TICKET_ADMIN' in req.perm('admin', 'ticket/resultcache'):
+            yield ('ticket', _("Ticket System"), 'resultcache',
+                   _("Result Cache"))
+
+    def render_admin_panel(self, req, cat, page, path_info):
+        req.perm('admin', 'ticket/resultcache').require('TICKET_ADMIN')
+        if req.method == 'POST':
+            if req.args.get('clear'):
+                self.invalidate()
+                add_notice(req, _("The result cache has been cleared."))
+            req.redirect(req.href.admin(cat, page))
+        return 'admin_resultcache.html', {'cache': self.stats}
+
+    # IConfigurationChangeListener methods
+
+    def get_config_sections(self):
+        return ['query', 'ticket', 'ticket-custom']
+
+    def config_sections_changed(self, changes):
+        self.invalidate()
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        self.invalidate()
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        self.invalidate()
+
+    def ticket_deleted(self, ticket):
+        self.invalidate()
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        self.invalidate()
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        self.invalidate()
+
+    # IMilestoneChangeListener methods
+
+    def milestone_created(self, milestone):
+        self.invalidate()
+
+    def milestone_changed(self, milestone, old_values):
+        self.invalidate()
+
+    def milestone_deleted(self, milestone):
+        self.invalidate()
+
+    # Public API
+
+    def get(self, key, compute):
+        """Return the value cached for `key`, calling `compute()` to get
+        and cache it if needed.
+
+        The least recently used values beyond `[ticket]
+        result_cache_size` are evicted. The value must not be modified.
+        """
+        size = self.size
+        if size <= 0 or DatabaseManager(self.env).in_transaction:
+            # The results may include changes not committed yet.
+            return compute()
+        # A value computed while a change invalidates the cache goes to
+        # the entries of the previous generation, which are dropped.
+        entries = self._entries
+        with self._lock:
+            value = entries.get(key)
+            if value is not None:
+                entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return value
+            self._stats['misses'] += 1
+        value = compute()
+        with self._lock:
+            entries[key] = value
+            while len(entries) > size:
+                entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return value
+
+    def invalidate(self):
+        """Drop the cached results in all processes, once the current
+        transaction, if any, is committed."""
+        DatabaseManager(self.env).call_after_commit(self._invalidate)
+
+    @property
+    def stats(self):
+        """Hit, miss, eviction and invalidation counters of this process,
+        plus the current and maximum number of entries."""
+        stats = dict.fromkeys(('hits', 'misses', 'evictions',
+                               'invalidations'), 0)
+        stats.update(self._stats)
+        stats['entries'] = len(self._entries)
+        stats['size'] = self.size
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else None
+        return stats
+
+    # Internal methods
+
+    def _invalidate(self):
+        del self._entries
+
+    @cached
+    def _entries(self):
+        # Called again whenever the generation of the cache changed.
+        with self._lock:
+            if self._loaded:
+                self._stats['invalidations'] += 1
+            self._loaded = True
+        return collections.OrderedDict()
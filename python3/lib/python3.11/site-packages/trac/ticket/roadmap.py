@@ -37,6 +37,7 @@ from trac.util.presentation import classes
 from trac.util.text import CRLF, exception_to_unicode, to_unicode
 from trac.util.translation import _, tag_
 from trac.ticket.api import TicketSystem
+from trac.ticket.customtable import CustomFieldTable
 from trac.ticket.notification import BatchTicketChangeEvent
 from trac.ticket.model import Milestone, MilestoneCache, Ticket
 from trac.timeline.api import ITimelineEventProvider
@@ -304,6 +305,14 @@ def get_tickets_for_milestone(env, milestone=None, field='component'):
         sql = """SELECT id, status, %s FROM ticket WHERE milestone=%%s
                  ORDER BY %s, id""" % (field, field)
         args = (milestone,)
+    elif CustomFieldTable(env).covers([field]):
+        with env.db_query as db:
+            sql = """SELECT t.id, t.status, c.%(field)s FROM ticket AS t
+                       LEFT OUTER JOIN %(table)s AS c ON c.ticket=t.id
+                      WHERE t.milestone=%%s ORDER BY c.%(field)s, t.id
+                  """ % {'field': db.quote(field),
+                         'table': CustomFieldTable.table_name}
+        args = (milestone,)
     else:
         sql = """SELECT id, status, value FROM ticket
                    LEFT OUTER JOIN ticket_custom ON (id=ticket AND name=%s)
@@ -323,6 +332,15 @@ def get_tickets_for_all_milestones(env, field='component'):
                      ORDER BY milestone, %(field)s, id
                   """ % {'field': db.quote(field)}
             args = ()
+        elif CustomFieldTable(env).covers([field]):
+            sql = """SELECT t.id, t.status, c.%(field)s, t.milestone
+                     FROM ticket AS t
+                     LEFT OUTER JOIN %(table)s AS c ON c.ticket=t.id
+                     WHERE t.milestone != ''
+                     ORDER BY t.milestone, c.%(field)s, t.id
+                  """ % {'field': db.quote(field),
+                         'table': CustomFieldTable.table_name}
+            args = ()
         else:
             sql = """SELECT t.id, t.status, c.value, t.milestone
                      FROM ticket AS t
@@ -479,6 +497,9 @@ class RoadmapModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/roadmap']
+
     def match_request(self, req):
         return req.path_info == '/roadmap'
 
@@ -729,6 +750,9 @@ class MilestoneModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/milestone']
+
     def match_request(self, req):
         match = re.match(r'/milestone(?:/(.+))?$', req.path_info)
         if match:
@@ -5,9 +5,11 @@ import os
 from datetime import datetime
 import logging
 import csv
+import json
 from apscheduler.schedulers.background import BackgroundScheduler
 from xmlrpc.client import ServerProxy
 from dotenv import load_dotenv
+from trac.notification.dispatcher import OutboundQueue
 load_dotenv()    # pip install python-dotenv
 
 
@@ -35,21 +37,63 @@ def mention_for(username):
     return slack_id if slack_id else username
 
 
-def fetch_and_list_active_tickets():
+def post_to_slack(channel, payloads, session):
     """
-    Fetch the “Active Tickets” report as CSV from Trac,
-    parse out ticket ID, summary, and status (in a case‐insensitive way),
-    and post the formatted list to Slack.
+    Deliver queued webhook payloads over the worker's keep-alive session.
+    Workflow webhooks take one set of variables per call, so a burst is
+    sent as consecutive posts rather than merged.
+    """
+    for payload in payloads:
+        response = session.post(SLACK_WEBHOOK_URL, json=payload, timeout=10)
+        if response.status_code != 200:
+            raise Exception(f"Slack API returned {response.status_code}: {response.text}")
+
+
+# Outgoing Slack posts are delivered by background workers so the browser
+# isn't kept waiting on Slack; failures are retried with backoff.
+slack_queue = OutboundQueue(
+    post_to_slack, logger,
+    workers=int(os.environ.get('SLACK_QUEUE_WORKERS', 2)),
+    maxsize=int(os.environ.get('SLACK_QUEUE_SIZE', 1000)),
+    coalesce_delay=0,
+    spool_dir=os.environ.get('SLACK_SPOOL_DIR')
+)
+
+
+# 'full' reposts every active ticket on each run; 'incremental' posts only
+# the tickets opened, changed or closed since the previous post.
+ACTIVE_TICKETS_MODE = os.environ.get('ACTIVE_TICKETS_MODE', 'full')
+# Trac environment read directly in incremental mode; without it the
+# report is fetched over HTTP and compared with the previous snapshot.
+TRAC_ENV = os.environ.get('TRAC_ENV')
+# File keeping the last posted snapshot across restarts.
+ACTIVE_TICKETS_STATE = os.environ.get('ACTIVE_TICKETS_STATE')
+# Slack truncates long messages, so lists are split into several posts.
+ACTIVE_TICKETS_CHUNK = int(os.environ.get('ACTIVE_TICKETS_CHUNK', 3000))
+REPORT_CSV_URL = 'http://localhost:8123/report/1?format=csv'
+REPORT_URL = 'http://localhost:8123/system/report/1'
+
+active_tickets_session = requests.Session()
+active_tickets_state = None
+
+
+def format_ticket(tid, summary, status):
+    return f"{tid} • {summary} ({status})"
+
+
+def fetch_report_tickets():
+    """
+    Fetch the “Active Tickets” report as CSV from Trac and
+    parse out ticket ID, summary, and status (in a case‐insensitive
+    way). Returns a list of (id, summary, status) tuples, or None if the
+    report can't be fetched.
     """
     try:
-        resp = requests.get(
-            'http://localhost:8123/report/1?format=csv',
-            timeout=10
-        )
+        resp = active_tickets_session.get(REPORT_CSV_URL, timeout=10)
         resp.raise_for_status()
     except Exception as e:
         logger.error(f"Error fetching CSV from Trac: {e}")
-        return
+        return None
 
     reader = csv.DictReader(resp.text.splitlines())
     fields = reader.fieldnames or []
@@ -60,33 +104,196 @@ def fetch_and_list_active_tickets():
     summary_col = lc_fields.get('summary')
     status_col  = lc_fields.get('status')
 
-    lines = []
-    for row in reader:
-        tid = row.get(id_col, '<no id>')
-        sm  = row.get(summary_col, '<no summary>')
-        st  = row.get(status_col, '<no status>')
-        lines.append(f"{tid} • {sm} ({st})")
-
-    text_report = (
-        "Active tickets:\n" + "\n".join(lines)
-        if lines else
-        "No active tickets right now."
-    )
+    return [(row.get(id_col, '<no id>'),
+             row.get(summary_col, '<no summary>'),
+             row.get(status_col, '<no status>'))
+            for row in reader]
 
-    payload = {
-        "bot_name": "Active Tickets Bot",
-        "ticket_list": text_report,
-        "report_url": "http://localhost:8123/system/report/1"
-    }
 
-    try:
-        slack_resp = requests.post(
+def fetch_db_tickets(snapshot, watermark):
+    """
+    Bring `snapshot` ({id: [summary, status]} of the active tickets) up to
+    date by reading the tickets changed after `watermark`, a `changetime`
+    value, straight from the Trac database. Returns the new snapshot and
+    watermark.
+    """
+    from trac.env import open_environment
+    env = open_environment(TRAC_ENV, use_cache=True)
+    snapshot = dict(snapshot)
+    if watermark is None:
+        rows = env.db_query("""
+            SELECT id, summary, status, changetime FROM ticket
+            WHERE status != 'closed'""")
+        snapshot = {}
+        watermark = 0
+    else:
+        rows = env.db_query("""
+            SELECT id, summary, status, changetime FROM ticket
+            WHERE changetime > %s""", (watermark,))
+    for tid, summary, status, changetime in rows:
+        if status == 'closed':
+            snapshot.pop(str(tid), None)
+        else:
+            snapshot[str(tid)] = [summary, status]
+        watermark = max(watermark, changetime)
+    # Deleted tickets leave no row behind, so drop the ids which are no
+    # longer those of active tickets.
+    active = {str(tid) for tid, in env.db_query("""
+        SELECT id FROM ticket WHERE status != 'closed'""")}
+    snapshot = {tid: values for tid, values in snapshot.items()
+                if tid in active}
+    return snapshot, watermark
+
+
+def chunk_report(title, lines, limit=None):
+    """
+    Split `lines` under `title` into texts of at most `limit` characters,
+    numbering the parts if there is more than one.
+    """
+    limit = limit or ACTIVE_TICKETS_CHUNK
+    chunks = []
+    current = []
+    size = 0
+    for line in lines:
+        if current and size + len(line) + 1 > limit:
+            chunks.append(current)
+            current = []
+            size = 0
+        current.append(line)
+        size += len(line) + 1
+    if current or not chunks:
+        chunks.append(current)
+    if len(chunks) == 1:
+        return ["\n".join([title] + chunks[0])]
+    return ["\n".join([f"{title} (part {i}/{len(chunks)})"] + chunk)
+            for i, chunk in enumerate(chunks, 1)]
+
+
+def post_active_tickets(texts):
+    """
+    Post each text to the active tickets webhook, in order. Raises an
+    exception if a post fails.
+    """
+    for text in texts:
+        payload = {
+            "bot_name": "Active Tickets Bot",
+            "ticket_list": text,
+            "report_url": REPORT_URL
+        }
+        slack_resp = active_tickets_session.post(
             ACTIVE_TICKETS_WEBHOOK_URL,
             json=payload,
             timeout=10
         )
         if slack_resp.status_code != 200:
-            logger.error(f"Slack API returned {slack_resp.status_code}: {slack_resp.text}")
+            raise Exception(f"Slack API returned {slack_resp.status_code}: {slack_resp.text}")
+
+
+def load_active_tickets_state():
+    global active_tickets_state
+    if active_tickets_state is None:
+        active_tickets_state = {'tickets': None, 'watermark': None}
+        if ACTIVE_TICKETS_STATE and os.path.exists(ACTIVE_TICKETS_STATE):
+            try:
+                with open(ACTIVE_TICKETS_STATE, encoding='utf-8') as f:
+                    active_tickets_state = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Can't read {ACTIVE_TICKETS_STATE}: {e}")
+    return active_tickets_state
+
+
+def save_active_tickets_state(state):
+    global active_tickets_state
+    active_tickets_state = state
+    if not ACTIVE_TICKETS_STATE:
+        return
+    try:
+        with open(ACTIVE_TICKETS_STATE + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(ACTIVE_TICKETS_STATE + '.tmp', ACTIVE_TICKETS_STATE)
+    except OSError as e:
+        logger.error(f"Can't write {ACTIVE_TICKETS_STATE}: {e}")
+
+
+def diff_active_tickets(old, new):
+    """
+    Compare two {id: [summary, status]} snapshots and return the report
+    lines for opened, changed and closed tickets.
+    """
+    def key(tid):
+        return int(tid) if tid.isdigit() else tid
+    opened = [format_ticket(tid, *new[tid])
+              for tid in sorted(set(new) - set(old), key=key)]
+    changed = [format_ticket(tid, *new[tid])
+               for tid in sorted(set(new) & set(old), key=key)
+               if list(new[tid]) != list(old[tid])]
+    closed = [format_ticket(tid, old[tid][0], 'closed')
+              for tid in sorted(set(old) - set(new), key=key)]
+    lines = []
+    for title, items in (("New:", opened), ("Changed:", changed),
+                         ("Closed:", closed)):
+        if items:
+            lines.append(title)
+            lines.extend(items)
+    return lines
+
+
+def post_active_ticket_changes():
+    """
+    Post the active tickets opened, changed or closed since the last
+    successful post. The first run posts the full list.
+    """
+    state = load_active_tickets_state()
+    old = state.get('tickets')
+    watermark = state.get('watermark')
+    try:
+        if TRAC_ENV:
+            new, watermark = fetch_db_tickets(old or {},
+                                              watermark if old is not None
+                                              else None)
+        else:
+            rows = fetch_report_tickets()
+            if rows is None:
+                return
+            new = {str(tid): [sm, st] for tid, sm, st in rows}
+    except Exception as e:
+        logger.error(f"Error reading active tickets: {e}")
+        return
+
+    if old is None:
+        lines = [format_ticket(tid, *new[tid]) for tid in new]
+        texts = (chunk_report("Active tickets:", lines) if lines else
+                 ["No active tickets right now."])
+    else:
+        lines = diff_active_tickets(old, new)
+        texts = chunk_report("Active ticket changes:", lines) if lines else []
+
+    try:
+        post_active_tickets(texts)
+    except Exception as e:
+        # Keep the previous snapshot so the changes are posted next time.
+        logger.error(f"Error sending message to Slack: {e}")
+        return
+    save_active_tickets_state({'tickets': new, 'watermark': watermark})
+
+
+def fetch_and_list_active_tickets():
+    """
+    Post the active tickets to Slack: the full list, or only the changes
+    in incremental mode.
+    """
+    if ACTIVE_TICKETS_MODE == 'incremental':
+        post_active_ticket_changes()
+        return
+
+    rows = fetch_report_tickets()
+    if rows is None:
+        return
+    lines = [format_ticket(tid, sm, st) for tid, sm, st in rows]
+    texts = (chunk_report("Active tickets:", lines) if lines else
+             ["No active tickets right now."])
+    try:
+        post_active_tickets(texts)
     except Exception as e:
         logger.error(f"Error sending message to Slack: {e}")
 
@@ -161,19 +368,8 @@ def slack_proxy():
             "new_status": new_status
         }
 
-        response = requests.post(
-            SLACK_WEBHOOK_URL,
-            json=slack_payload,
-            timeout=10
-        )
-
-        if response.status_code == 200:
-            return jsonify({'message': 'Message sent to Slack successfully'}), 200
-        else:
-            return jsonify({
-                'error': 'Failed to send message to Slack',
-                'details': response.text
-            }), 500
+        slack_queue.put('slack', slack_payload)
+        return jsonify({'message': 'Message queued for Slack'}), 202
 
     except requests.exceptions.Timeout:
         return jsonify({'error': 'Timeout when sending to Slack'}), 500
@@ -32,6 +32,7 @@ from trac.resource import (
     get_resource_shortname
 )
 from trac.search import ISearchSource, search_to_sql, shorten_result
+from trac.search.index import SearchIndex
 from trac.ticket import model
 from trac.ticket.api import TicketSystem, ITicketManipulator, TicketFieldList
 from trac.ticket.notification import TicketChangeEvent
@@ -146,6 +147,9 @@ class TicketModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/ticket', '/newticket']
+
     def match_request(self, req):
         match = self.ticket_path_re.match(req.path_info)
         if match:
@@ -179,6 +183,49 @@ class TicketModule(Component):
         if 'ticket' not in filters:
             return
         ticket_realm = Resource(self.realm)
+        hits = SearchIndex(self.env).search(terms, self.realm)
+        if hits is not None:
+            for result in self._get_indexed_search_results(req, hits):
+                yield result
+        else:
+            for result in self._get_sql_search_results(req, terms):
+                yield result
+
+        # Attachments
+        for result in AttachmentModule(self.env).get_search_results(
+            req, ticket_realm, terms):
+            yield result
+
+    def _get_indexed_search_results(self, req, hits):
+        ticket_realm = Resource(self.realm)
+        ticketsystem = TicketSystem(self.env)
+        ranks = {int(hit[0]): hit for hit in hits}
+        ids = list(ranks)
+        with self.env.db_query as db:
+            for i in range(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                rows = db("""SELECT summary, reporter, type, id, time,
+                                    status, resolution
+                             FROM ticket WHERE id IN (%s)
+                             """ % ','.join(['%s'] * len(chunk)), chunk)
+                viewable = set(req.perm.filter(
+                    'TICKET_VIEW', [ticket_realm(id=row[3]) for row in rows]))
+                for summary, author, type, tid, ts, status, resolution in \
+                        rows:
+                    t = ticket_realm(id=tid)
+                    if t in viewable:
+                        score, snippet = ranks[tid][-2:]
+                        yield (req.href.ticket(tid),
+                               tag_("%(title)s: %(message)s",
+                                    title=tag.span(
+                                        get_resource_shortname(self.env, t),
+                                        class_=status),
+                                    message=ticketsystem.format_summary(
+                                        summary, status, resolution, type)),
+                               from_utimestamp(ts), author, snippet, score)
+
+    def _get_sql_search_results(self, req, terms):
+        ticket_realm = Resource(self.realm)
         with self.env.db_query as db:
             sql, args = search_to_sql(db, ['summary', 'keywords',
                                            'description', 'reporter', 'cc',
@@ -186,22 +233,25 @@ class TicketModule(Component):
             sql2, args2 = search_to_sql(db, ['newvalue'], terms)
             sql3, args3 = search_to_sql(db, ['value'], terms)
             ticketsystem = TicketSystem(self.env)
+            rows = db("""SELECT summary, description, reporter, type, id,
+                                time, status, resolution
+                         FROM ticket
+                         WHERE id IN (
+                             SELECT id FROM ticket WHERE %s
+                           UNION
+                             SELECT ticket FROM ticket_change
+                             WHERE field='comment' AND %s
+                           UNION
+                             SELECT ticket FROM ticket_custom WHERE %s
+                         )
+                         """ % (sql, sql2, sql3),
+                         args + args2 + args3)
+            viewable = set(req.perm.filter(
+                'TICKET_VIEW', [ticket_realm(id=row[4]) for row in rows]))
             for summary, desc, author, type, tid, ts, status, resolution in \
-                    db("""SELECT summary, description, reporter, type, id,
-                                 time, status, resolution
-                          FROM ticket
-                          WHERE id IN (
-                              SELECT id FROM ticket WHERE %s
-                            UNION
-                              SELECT ticket FROM ticket_change
-                              WHERE field='comment' AND %s
-                            UNION
-                              SELECT ticket FROM ticket_custom WHERE %s
-                          )
-                          """ % (sql, sql2, sql3),
-                          args + args2 + args3):
+                    rows:
                 t = ticket_realm(id=tid)
-                if 'TICKET_VIEW' in req.perm(t):
+                if t in viewable:
                     yield (req.href.ticket(tid),
                            tag_("%(title)s: %(message)s",
                                 title=tag.span(
@@ -212,11 +262,6 @@ class TicketModule(Component):
                            from_utimestamp(ts), author,
                            shorten_result(desc, terms))
 
-        # Attachments
-        for result in AttachmentModule(self.env).get_search_results(
-            req, ticket_realm, terms):
-            yield result
-
     # ITimelineEventProvider methods
 
     def get_timeline_filters(self, req):
@@ -238,10 +283,18 @@ class TicketModule(Component):
 
         field_labels = TicketSystem(self.env).get_ticket_field_labels()
 
+        viewable = set()
+
+        def check_viewable(rows):
+            # Check the permissions on all the tickets at once.
+            viewable.update(req.perm.filter('TICKET_VIEW',
+                                            {ticket_realm(id=row[0])
+                                             for row in rows}))
+
         def produce_event(values, status, fields, comment, cid):
             id, ts, author, type, summary, description, component = values
             ticket = ticket_realm(id=id)
-            if 'TICKET_VIEW' not in req.perm(ticket):
+            if ticket not in viewable:
                 return None
             resolution = fields.get('resolution')
             info = ''
@@ -271,8 +324,7 @@ class TicketModule(Component):
 
         def produce_ticket_change_events(db):
             data = None
-            for (id, t, author, type, summary,
-                 component, field, oldvalue, newvalue) in db("""
+            rows = db("""
                     SELECT t.id, tc.time, tc.author, t.type, t.summary,
                            t.component, tc.field, tc.oldvalue, tc.newvalue
                     FROM ticket_change tc
@@ -281,7 +333,10 @@ class TicketModule(Component):
                     LEFT OUTER JOIN enum p ON
                         p.type='priority' AND p.name=t.priority
                     ORDER BY tc.time, COALESCE(p.value,'')='', %s, tc.ticket
-                    """ % db.cast('p.value', 'int'), (ts_start, ts_stop)):
+                    """ % db.cast('p.value', 'int'), (ts_start, ts_stop))
+            check_viewable(rows)
+            for (id, t, author, type, summary,
+                 component, field, oldvalue, newvalue) in rows:
                 if not (oldvalue or newvalue):
                     # ignore empty change corresponding to custom field
                     # created (None -> '') or deleted ('' -> None)
@@ -344,10 +399,12 @@ class TicketModule(Component):
 
                 # New tickets
                 if 'ticket' in filters:
-                    for row in db("""SELECT id, time, reporter, type, summary,
-                                            description, component
-                                     FROM ticket WHERE time>=%s AND time<=%s
-                                     """, (ts_start, ts_stop)):
+                    rows = db("""SELECT id, time, reporter, type, summary,
+                                        description, component
+                                 FROM ticket WHERE time>=%s AND time<=%s
+                                 """, (ts_start, ts_stop))
+                    check_viewable(rows)
+                    for row in rows:
                         ev = produce_event(row, 'new', {}, None, None)
                         if ev:
                             yield ev
@@ -1930,6 +1987,14 @@ class DefaultTicketPolicy(Component):
             if change and username == change['author']:
                 return True
 
+    def check_permissions(self, action, username, resources, perm):
+        if action not in ('TICKET_CHG_MILESTONE', 'TICKET_EDIT_DESCRIPTION',
+                          'TICKET_EDIT_COMMENT'):
+            return [None] * len(resources)
+        return [self.check_permission(action, username, resource,
+                                      perm(resource))
+                for resource in resources]
+
     def _is_valid_resource(self, resource, expected_realm, exists=True):
         return resource and resource.realm == expected_realm and \
                (resource.id is not None if exists else resource.id is None)
\ No newline at end of file
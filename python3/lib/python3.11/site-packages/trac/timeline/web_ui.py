@@ -86,6 +86,9 @@ class TimelineModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/timeline']
+
     def match_request(self, req):
         return req.path_info == '/timeline'
 
@@ -19,7 +19,7 @@ from abc import ABCMeta, abstractmethod
 from datetime import datetime
 
 from trac.admin import AdminCommandError, IAdminCommandProvider, get_dir_list
-from trac.config import ConfigSection, Option
+from trac.config import ConfigSection, IConfigurationChangeListener, Option
 from trac.core import *
 from trac.resource import IResourceManager, Resource, ResourceNotFound
 from trac.util import as_bool, native_path
@@ -320,8 +320,8 @@ class DbRepositoryProvider(Component):
 class RepositoryManager(Component):
     """Version control system manager."""
 
-    implements(IRequestFilter, IResourceManager, IRepositoryProvider,
-               ITemplateProvider)
+    implements(IConfigurationChangeListener, IRequestFilter,
+               IResourceManager, IRepositoryProvider, ITemplateProvider)
 
     changeset_realm = 'changeset'
     source_realm = 'source'
@@ -359,6 +359,16 @@ class RepositoryManager(Component):
         self._connectors = None
         self._all_repositories = None
 
+    # IConfigurationChangeListener methods
+
+    def get_config_sections(self):
+        return ['repositories']
+
+    def config_sections_changed(self, changes):
+        # The repositories cached by the threads are released at the end
+        # of their current request.
+        self._all_repositories = None
+
     # IRequestFilter methods
 
     def pre_process_request(self, req, handler):
@@ -305,6 +305,9 @@ class BrowserModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/browser', '/export', '/file']
+
     def match_request(self, req):
         match = re.match(r'/(export|browser|file)(/.*)?$', req.path_info)
         if match:
@@ -182,6 +182,9 @@ class ChangesetModule(Component):
 
     _request_re = re.compile(r"/changeset(?:/([^/]+)(/.*)?)?$")
 
+    def get_request_routes(self):
+        return ['/changeset']
+
     def match_request(self, req):
         match = re.match(self._request_re, req.path_info)
         if match:
@@ -1166,6 +1169,9 @@ class AnyDiffModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/diff']
+
     def match_request(self, req):
         return req.path_info == '/diff'
 
@@ -68,6 +68,9 @@ class LogModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/log']
+
     def match_request(self, req):
         match = re.match(r'/log(/.*)?$', req.path_info)
         if match:
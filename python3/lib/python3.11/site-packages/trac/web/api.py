@@ -26,6 +26,7 @@ import re
 import sys
 import tempfile
 import urllib.parse
+import zlib
 
 try:
     import multipart
@@ -73,6 +74,23 @@ class IRequestHandler(Interface):
     def match_request(req):
         """Return whether the handler wants to process the given request."""
 
+    def get_request_routes():
+        """Return the paths of the requests the handler can process
+        (optional).
+
+        The routes are path prefixes such as `'/wiki'`, which match the
+        `path_info` of a request at a path segment boundary (`/wiki` and
+        `/wiki/WikiStart` but not `/wikipedia`), and compiled regular
+        expressions, which match the start of the `path_info`.
+
+        The `RequestDispatcher` calls `match_request` only for requests
+        matching one of the routes, so that it doesn't need to ask every
+        handler for every request. Handlers that don't implement this
+        method are asked for every request.
+
+        :since: 1.6
+        """
+
     def process_request(req):
         """Process the request.
 
@@ -469,6 +487,19 @@ def arg_list_to_args(arg_list):
     return args
 
 
+def gzip_chunks(chunks, level=6):
+    """Compress an iterable of `bytes` to gzip on the fly.
+
+    :since: 1.6
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
 def _raise_if_null_bytes(value):
     if value and '\x00' in value:
         raise HTTPBadRequest(_("Invalid request arguments."))
@@ -680,6 +711,22 @@ class Request(object):
         """
         return self.authname and self.authname != 'anonymous'
 
+    @lazy
+    def accepts_gzip(self):
+        """Returns `True` if the client accepts gzip encoded responses.
+
+        :since: 1.6
+        """
+        for coding in (self.get_header('Accept-Encoding') or '').split(','):
+            name, sep, params = coding.partition(';')
+            if name.strip().lower() in ('gzip', 'x-gzip', '*'):
+                match = re.match(r'\s*q\s*=\s*([0-9.]+)', params)
+                try:
+                    return not match or float(match.group(1)) > 0
+                except ValueError:
+                    return False
+        return False
+
     @lazy
     def is_xhr(self):
         """Returns `True` if the request is an `XMLHttpRequest`.
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 Hewlett Packard Enterprise Development LP.
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at https://trac.edgewall.org/wiki/TracLicense.
+
+"""Fingerprinted and precompressed static resources.
+
+`trac-admin $ENV deploy <directory> --fingerprint` copies the style
+sheets and scripts of the deployed `htdocs` tree to names containing a
+hash of their content (e.g. `common/css/trac.0123456789ab.css`), writes
+gzip (and brotli, if the `brotli` package is installed) compressed
+variants next to the text resources, and records the names in a
+`manifest.json` file. When `[trac] htdocs_manifest` points to that file,
+`add_stylesheet` and `add_script` reference the fingerprinted names,
+which never change content and can be cached forever by browsers and
+served directly by the web server.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+
+from trac.util import AtomicFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+__all__ = ['build_assets', 'load_manifest', 'MANIFEST_NAME']
+
+
+#: Name of the manifest file written at the root of the `htdocs` tree.
+MANIFEST_NAME = 'manifest.json'
+
+_fingerprinted_exts = ('.css', '.js')
+_compressed_exts = ('.css', '.js', '.json', '.map', '.svg', '.txt', '.xml')
+_fingerprint_re = re.compile(r'\.[0-9a-f]{12}\.[^./]+\Z')
+
+
+def build_assets(htdocs_dir):
+    """Write fingerprinted copies of the style sheets and scripts and
+    compressed variants of the text resources found in `htdocs_dir`.
+
+    Return the manifest, a `dict` mapping the paths of the resources
+    relative to `htdocs_dir` (e.g. `'common/css/trac.css'`) to their
+    fingerprinted paths. The manifest is also written to the
+    `manifest.json` file of `htdocs_dir`.
+    """
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(htdocs_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            base, ext = os.path.splitext(filename)
+            if ext in ('.gz', '.br') or _fingerprint_re.search(filename) \
+                    or filename == MANIFEST_NAME and dirpath == htdocs_dir:
+                continue  # Output of a previous deployment
+            path = os.path.join(dirpath, filename)
+            if ext in _fingerprinted_exts:
+                with open(path, 'rb') as f:
+                    content = f.read()
+                digest = hashlib.sha1(content).hexdigest()[:12]
+                name = '%s.%s%s' % (base, digest, ext)
+                fingerprinted = os.path.join(dirpath, name)
+                if not os.path.isfile(fingerprinted):
+                    _write(fingerprinted, content)
+                _compress(fingerprinted, content)
+                relpath = os.path.relpath(path, htdocs_dir)
+                manifest[relpath.replace(os.sep, '/')] = \
+                    os.path.relpath(fingerprinted, htdocs_dir) \
+                      .replace(os.sep, '/')
+            if ext in _compressed_exts:
+                with open(path, 'rb') as f:
+                    _compress(path, f.read())
+    with AtomicFile(os.path.join(htdocs_dir, MANIFEST_NAME)) as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    return manifest
+
+
+def load_manifest(path):
+    """Return the manifest read from the `manifest.json` file at `path`.
+
+    :raise OSError: if the file can't be read.
+    :raise ValueError: if the file is not a valid manifest.
+    """
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict):
+        raise ValueError("%s is not a manifest" % path)
+    return manifest
+
+
+def _compress(path, content):
+    # Only keep the compressed variants which are actually smaller; the
+    # fixed gzip timestamp keeps the output stable across deployments.
+    variants = [('.gz', lambda: gzip.compress(content, 9, mtime=0))]
+    if brotli:
+        variants.append(('.br', lambda: brotli.compress(content)))
+    for suffix, compress in variants:
+        compressed = compress()
+        if len(compressed) < len(content):
+            _write(path + suffix, compressed)
+
+
+def _write(path, content):
+    with AtomicFile(path, 'wb') as f:
+        f.write(content)
@@ -131,6 +131,9 @@ class LoginModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/login', '/logout']
+
     def match_request(self, req):
         return re.match('/(login|logout)/?$', req.path_info)
 
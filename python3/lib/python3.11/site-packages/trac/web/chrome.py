@@ -32,7 +32,7 @@ import pprint
 import re
 from functools import partial
 
-from jinja2 import FileSystemLoader
+from jinja2 import FileSystemBytecodeCache, FileSystemLoader, TemplateError
 try:
     import babel
 except ImportError:
@@ -40,6 +40,7 @@ except ImportError:
 else:
     from babel.support import LazyProxy
 
+from trac.admin.api import AdminCommandError, IAdminCommandProvider
 from trac.api import IEnvironmentSetupParticipant, ISystemInfoProvider
 from trac.config import *
 from trac.core import *
@@ -52,8 +53,9 @@ from trac.util.html import (Element, Markup, escape, plaintext, tag,
                             to_fragment, valid_html_bytes)
 from trac.util.text import (exception_to_unicode, is_obfuscated,
                             javascript_quote, jinja2env,
-                            obfuscate_email_address, pretty_size, shorten_line,
-                            to_js_string, to_unicode, unicode_quote_plus)
+                            obfuscate_email_address, pretty_size, printerr,
+                            printout, shorten_line, to_js_string, to_unicode,
+                            unicode_quote_plus)
 from trac.util.datefmt import (
     pretty_timedelta, datetime_now, format_datetime, format_date, format_time,
     from_utimestamp, http_date, utc, get_date_format_jquery_ui, is_24_hours,
@@ -63,6 +65,7 @@ from trac.util.datefmt import (
     get_period_names_jquery_ui, localtz)
 from trac.util.translation import _, get_available_locales
 from trac.web.api import IRequestHandler, HTTPNotFound
+from trac.web.assets import load_manifest
 from trac.web.href import Href
 from trac.wiki import IWikiSyntaxProvider
 from trac.wiki.formatter import format_to, format_to_html, format_to_oneliner
@@ -373,7 +376,10 @@ def chrome_resource_path(req, filename):
     """
     if filename.startswith(('http://', 'https://', '//')):
         return filename
-    elif filename.startswith('common/') and 'htdocs_location' in req.chrome:
+    manifest = req.chrome.get('manifest')
+    if manifest:
+        filename = manifest.get(filename, filename)
+    if filename.startswith('common/') and 'htdocs_location' in req.chrome:
         return Href(req.chrome['htdocs_location'])(filename[7:])
     else:
         href = req.href if filename.startswith('/') else req.href.chrome
@@ -410,9 +416,9 @@ class Chrome(Component):
     Chrome is everything that is not actual page content.
     """
 
-    implements(ISystemInfoProvider, IEnvironmentSetupParticipant,
-               IPermissionRequestor, IRequestHandler, ITemplateProvider,
-               IWikiSyntaxProvider)
+    implements(IAdminCommandProvider, ISystemInfoProvider,
+               IEnvironmentSetupParticipant, IPermissionRequestor,
+               IRequestHandler, ITemplateProvider, IWikiSyntaxProvider)
 
     required = True
     is_valid_default_handler = False
@@ -446,6 +452,14 @@ class Chrome(Component):
     auto_reload = BoolOption('trac', 'auto_reload', False,
         """Automatically reload template files after modification.""")
 
+    template_bytecode_cache = BoolOption('trac', 'template_bytecode_cache',
+                                         'true',
+        """Keep the compiled templates in the `cache/templates` directory
+        of the environment, so that new processes don't compile them
+        again. Run `trac-admin $ENV template compile` after installing or
+        upgrading Trac or plugins to compile all the templates before the
+        first requests. (''since 1.6'')""")
+
     htdocs_location = Option('trac', 'htdocs_location', '',
         """Base URL for serving the core static resources below
         `/chrome/common/`.
@@ -461,6 +475,21 @@ class Chrome(Component):
         will not be made available this way and additional rewrite
         rules will be needed in the web server.""")
 
+    htdocs_manifest = PathOption('trac', 'htdocs_manifest', '',
+        """Path to the `manifest.json` file written by
+        [TracAdmin trac-admin ... deploy <deploydir> --fingerprint].
+
+        When set, style sheets and scripts are referenced by the
+        content-hashed names listed in the manifest. The web server can
+        serve `<deploydir>/htdocs` below `/chrome/` with far-future cache
+        headers, preferring the precompressed `.gz` and `.br` variants.
+        Otherwise Trac serves the fingerprinted names itself, with the
+        same cache headers.
+
+        Non-absolute paths are relative to the Environment `conf`
+        directory.
+        (''since 1.6'')""")
+
     jquery_location = Option('trac', 'jquery_location', '',
         """Location of the jQuery !JavaScript library (version %(version)s).
 
@@ -606,6 +635,7 @@ class Chrome(Component):
     templates = None
     jenv = None
     jenv_text = None
+    _manifest = None
 
     # A dictionary of default context data for templates
     _default_context_data = {
@@ -638,6 +668,46 @@ class Chrome(Component):
         'utc': utc,
     }
 
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('template compile', '',
+               """Compile all templates into the bytecode cache
+
+               Compiles the templates of Trac and of the enabled plugins
+               ahead of the first requests, after clearing the templates
+               compiled before.
+               """,
+               None, self._do_compile_templates)
+
+    def _do_compile_templates(self):
+        if not self.template_bytecode_cache:
+            raise AdminCommandError(_("The template bytecode cache is "
+                                      "disabled by the [trac] "
+                                      "template_bytecode_cache option."))
+        self._init_jinja2()
+        for jenv in (self.jenv, self.jenv_text):
+            if jenv.bytecode_cache is None:
+                raise AdminCommandError(_("The template cache directory "
+                                          "can't be created, see the log "
+                                          "for details."))
+            jenv.bytecode_cache.clear()
+            jenv.cache.clear()
+        compiled = 0
+        for text, extensions in ((False, ('html', 'rss', 'xml')),
+                                 (True, ('txt',))):
+            jenv = self.jenv_text if text else self.jenv
+            for filename in jenv.list_templates(extensions):
+                try:
+                    self.load_template(filename, text)
+                except TemplateError as e:
+                    printerr(_("Can't compile template %(name)s: %(error)s",
+                               name=filename,
+                               error=exception_to_unicode(e)))
+                else:
+                    compiled += 1
+        printout(_("Compiled %(num)s templates.", num=compiled))
+
     # ISystemInfoProvider methods
 
     def get_system_info(self):
@@ -702,6 +772,9 @@ class Chrome(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/chrome']
+
     def match_request(self, req):
         match = re.match(r'/chrome/(?P<prefix>[^/]+)/+(?P<filename>.+)',
                          req.path_info)
@@ -714,6 +787,10 @@ class Chrome(Component):
         prefix = req.args['prefix']
         filename = req.args['filename']
 
+        manifest = self._get_manifest()
+        if manifest and prefix + '/' + filename in manifest[2]:
+            self._send_fingerprinted(req, manifest, prefix + '/' + filename)
+
         dirs = []
         for provider in self.template_providers:
             for dir in [os.path.normpath(dir[1]) for dir
@@ -788,6 +865,9 @@ class Chrome(Component):
 
         htdocs_location = self.htdocs_location or req.href.chrome('common')
         chrome['htdocs_location'] = htdocs_location.rstrip('/') + '/'
+        manifest = self._get_manifest()
+        if manifest:
+            chrome['manifest'] = manifest[1]
 
         # HTML <head> links
         add_link(req, 'start', req.href.wiki())
@@ -1250,6 +1330,18 @@ class Chrome(Component):
         else:
             trac_lang = 'en'
 
+        # The listeners of a disabled cache wouldn't invalidate it
+        from trac.wiki.rendercache import RenderCache
+        render_cache = self.env[RenderCache]
+        if render_cache:
+            wiki_to = render_cache.format_to
+            wiki_to_html = render_cache.format_to_html
+            wiki_to_oneliner = render_cache.format_to_oneliner
+        else:
+            wiki_to = partial(format_to, self.env)
+            wiki_to_html = partial(format_to_html, self.env)
+            wiki_to_oneliner = partial(format_to_oneliner, self.env)
+
         d.update({
             'env': self.env,
             'context': web_context(req) if req else None,
@@ -1289,9 +1381,9 @@ class Chrome(Component):
             'from_utimestamp': from_utimestamp,
 
             # Wiki-formatting functions
-            'wiki_to': partial(format_to, self.env),
-            'wiki_to_html': partial(format_to_html, self.env),
-            'wiki_to_oneliner': partial(format_to_oneliner, self.env),
+            'wiki_to': wiki_to,
+            'wiki_to_html': wiki_to_html,
+            'wiki_to_oneliner': wiki_to_oneliner,
         })
 
         # Finally merge in the page-specific data
@@ -1312,19 +1404,38 @@ class Chrome(Component):
         :param text: in text mode (``True``) XML/HTML auto-escape of
                      variable expansion is disabled.
         """
+        self._init_jinja2()
+        return (self.jenv_text if text else self.jenv).get_template(filename)
+
+    def _init_jinja2(self):
         if not self.jenv:
             jinja2_dirs = self.get_all_templates_dirs()
             self.jenv = jinja2env(
                 loader=FileSystemLoader(jinja2_dirs),
                 auto_reload=self.auto_reload,
                 autoescape=True,
+                bytecode_cache=self._get_bytecode_cache('html'),
             )
             self.jenv.globals.update(self._default_context_data.copy())
             self.jenv.globals.update(translation.functions)
             self.jenv.globals.update(unicode=to_unicode)
             presentation.jinja2_update(self.jenv)
-            self.jenv_text = self.jenv.overlay(autoescape=False)
-        return (self.jenv_text if text else self.jenv).get_template(filename)
+            # Templates compile differently without auto-escape.
+            self.jenv_text = self.jenv.overlay(
+                autoescape=False,
+                bytecode_cache=self._get_bytecode_cache('text'))
+
+    def _get_bytecode_cache(self, mode):
+        if not self.template_bytecode_cache:
+            return None
+        path = os.path.join(self.env.cache_dir, 'templates', mode)
+        try:
+            os.makedirs(path, exist_ok=True)
+        except OSError as e:
+            self.log.warning("Can't create template cache directory %s: %s",
+                             path, exception_to_unicode(e))
+            return None
+        return FileSystemBytecodeCache(path)
 
     def render_template(self, req, filename, data, metadata):
         """Renders the ``filename`` template using ``data`` for the context.
@@ -1575,3 +1686,49 @@ class Chrome(Component):
                            e.__class__.__name__,
                            'text' if text else 'XML/HTML',
                            exception_to_unicode(e, traceback=True))
+
+    # Internal methods
+
+    def _get_manifest(self):
+        """Return the path, the content and the reverse mapping of the
+        `[trac] htdocs_manifest` file, reloaded when the file changed, or
+        `None` if there's no usable manifest."""
+        path = self.htdocs_manifest
+        if not path:
+            return None
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError as e:
+            manifest = None
+            error = e
+        else:
+            manifest = self._manifest
+            if manifest and manifest[0] == (path, mtime):
+                return manifest
+            try:
+                files = load_manifest(path)
+            except (OSError, ValueError) as e:
+                manifest = None
+                error = e
+            else:
+                manifest = ((path, mtime), files,
+                            {fp: name for name, fp in files.items()})
+        if manifest is None and self._manifest is not False:
+            self.log.warning("Can't load [trac] htdocs_manifest: %s",
+                             exception_to_unicode(error))
+        self._manifest = manifest if manifest else False
+        return manifest
+
+    def _send_fingerprinted(self, req, manifest, filename):
+        # The content of a fingerprinted name never changes
+        path = os.path.join(os.path.dirname(manifest[0][0]),
+                            *filename.split('/'))
+        if not os.path.isfile(path):
+            return
+        mimetype = get_mimetype(path)
+        req.send_header('Cache-Control', 'public, max-age=31536000, immutable')
+        req.send_header('Vary', 'Accept-Encoding')
+        if os.path.isfile(path + '.gz') and req.accepts_gzip:
+            req.send_header('Content-Encoding', 'gzip')
+            path += '.gz'
+        req.send_file(path, mimetype)
@@ -21,11 +21,13 @@ from functools import partial
 import gc
 import io
 import locale
+import logging
 import os
 import pkg_resources
 from pprint import pformat, pprint
 import re
 import sys
+import time
 import traceback
 from urllib.parse import urlparse
 
@@ -36,6 +38,7 @@ from trac.config import BoolOption, ChoiceOption, ConfigSection, \
                         ConfigurationError, ExtensionOption, Option, \
                         OrderedExtensionsOption
 from trac.core import *
+from trac.db.profiler import QueryProfiler
 from trac.env import open_environment
 from trac.loader import get_plugin_info, match_plugins_to_frames
 from trac.perm import PermissionCache, PermissionError
@@ -201,11 +204,7 @@ class RequestDispatcher(Component):
 
         try:
             # Select the component that should handle the request
-            chosen_handler = None
-            for handler in self._request_handlers.values():
-                if handler.match_request(req):
-                    chosen_handler = handler
-                    break
+            chosen_handler = self._match_request_handler(req)
             if not chosen_handler and req.path_info in ('', '/'):
                 chosen_handler = self._get_valid_default_handler(req)
             # pre-process any incoming request, whether a handler
@@ -332,6 +331,82 @@ class RequestDispatcher(Component):
         return {handler.__class__.__name__: handler
                 for handler in self.handlers}
 
+    @lazy
+    def _route_index(self):
+        """Candidate handlers for the requests, by first segment of the
+        `path_info`.
+
+        Returns a `(candidates, default)` tuple, where `candidates` maps
+        the first path segments of the declared routes to the handlers
+        that may match them, and `default` lists the handlers that may
+        match any other path. The handlers are listed in order as
+        `(handler, routes)` pairs, where `routes` is `None` for handlers
+        that don't declare routes, else a list of compiled regexps.
+        """
+        entries = []
+        for handler in self._request_handlers.values():
+            get_request_routes = getattr(handler, 'get_request_routes', None)
+            if get_request_routes is None:
+                entries.append((handler, None, None))
+                continue
+            routes = []
+            prefixes = []
+            segments = set()
+            any_segment = False
+            for route in get_request_routes() or ():
+                if isinstance(route, str):
+                    segment = route.strip('/').split('/', 1)[0]
+                    if segment:
+                        prefixes.append(route.rstrip('/'))
+                        segments.add(segment)
+                        continue
+                    route = re.compile('/')  # matches any path
+                routes.append(route)
+                any_segment = True
+            if prefixes:
+                routes.insert(0, re.compile(
+                    '(?:%s)(?:/|$)' % '|'.join(re.escape(prefix)
+                                               for prefix in prefixes)))
+            entries.append((handler, routes,
+                            None if any_segment else segments))
+        default = [(handler, routes) for handler, routes, segments in entries
+                   if segments is None]
+        candidates = {}
+        for segment in {segment for handler, routes, segments in entries
+                                for segment in segments or ()}:
+            candidates[segment] = [(handler, routes)
+                                   for handler, routes, segments in entries
+                                   if segments is None or segment in segments]
+        return candidates, default
+
+    def _match_request_handler(self, req):
+        path_info = req.path_info
+        candidates, default = self._route_index
+        candidates = candidates.get(path_info[1:].split('/', 1)[0], default)
+        timings = [] if self.log.isEnabledFor(logging.DEBUG) else None
+        chosen_handler = None
+        for handler, routes in candidates:
+            if routes is not None and \
+                    not any(route.match(path_info) for route in routes):
+                continue
+            if timings is None:
+                matched = handler.match_request(req)
+            else:
+                start = time.perf_counter()
+                matched = handler.match_request(req)
+                timings.append((handler.__class__.__name__,
+                                (time.perf_counter() - start) * 1000))
+            if matched:
+                chosen_handler = handler
+                break
+        if timings is not None:
+            self.log.debug("Matched %r against %d of %d handlers: %s",
+                           path_info, len(timings),
+                           len(self._request_handlers),
+                           ', '.join('%s %.3fms' % timing
+                                     for timing in timings))
+        return chosen_handler
+
     def _get_valid_default_handler(self, req):
         # Use default_handler from the Session if it is a valid value.
         name = req.session.get('default_handler')
@@ -605,8 +680,13 @@ def dispatch_request(environ, start_response):
             raise HTTPInternalServerError(env_error)
         dispatcher = RequestDispatcher(env)
         dispatcher.set_default_callbacks(req)
+        profiler = env[QueryProfiler]
         try:
-            dispatcher.dispatch(req)
+            if profiler:
+                with profiler.profile_request(req):
+                    dispatcher.dispatch(req)
+            else:
+                dispatcher.dispatch(req)
         except RequestDone as req_done:
             resp = req_done.iterable
     except HTTPException as e:
@@ -24,16 +24,23 @@ import functools
 import importlib
 import os
 import pkg_resources
+import queue
+import signal
 import socket
 import ssl
 import sys
+import threading
+import time
 from socketserver import ThreadingMixIn
 
 from trac import __version__ as VERSION
+from trac.db.api import DatabaseManager
+from trac.env import Environment, env_cache, env_cache_lock
 from trac.util import autoreload, daemon
-from trac.util.text import printerr
+from trac.util.text import exception_to_unicode, printerr, printout
 from trac.web.auth import BasicAuthentication, DigestAuthentication
-from trac.web.main import dispatch_request
+from trac.web.main import dispatch_request, get_environments
+from trac.versioncontrol.api import RepositoryManager
 from trac.web.wsgi import WSGIServer, WSGIRequestHandler
 
 
@@ -97,6 +104,11 @@ class TracEnvironMiddleware(object):
 class TracHTTPServer(ThreadingMixIn, WSGIServer):
     daemon_threads = True
 
+    #: Seconds to wait for the next request on a persistent connection,
+    #: and for each read of a request, if set
+    keep_alive_timeout = None
+    connection_timeout = None
+
     def __init__(self, server_address, application, env_parent_dir, env_paths,
                  use_http_11=False):
         request_handlers = (TracHTTPRequestHandler, TracHTTP11RequestHandler)
@@ -104,6 +116,222 @@ class TracHTTPServer(ThreadingMixIn, WSGIServer):
                             request_handler=request_handlers[bool(use_http_11)])
 
 
+class ThreadPoolMixIn(object):
+    """Mix-in class handling the connections in a fixed number of
+    threads.
+
+    Accepted connections wait in a queue of at most `queue_size` entries
+    (no limit if `0`) for a free thread; when the queue is full, new
+    connections get a "503 Service Unavailable" response right away.
+    An idle persistent connection is closed after `keep_alive_timeout`
+    seconds, so that it doesn't hold a thread meanwhile.
+    """
+
+    threads = 10
+    queue_size = 40
+    keep_alive_timeout = 5
+    connection_timeout = 30
+
+    _busy_response = (b'HTTP/1.0 503 Service Unavailable\r\n'
+                      b'Content-Type: text/plain\r\n'
+                      b'Content-Length: 20\r\n'
+                      b'Retry-After: 1\r\n'
+                      b'Connection: close\r\n'
+                      b'\r\n'
+                      b'Server is too busy.\n')
+
+    _requests = None
+    _workers = ()
+
+    def serve_forever(self, *args, **kwargs):
+        # The threads are only started now, as they wouldn't survive the
+        # fork of a prefork worker process.
+        self._requests = queue.Queue(self.queue_size)
+        self._workers = [threading.Thread(target=self._process_requests,
+                                          name='tracd-worker-%d' % i,
+                                          daemon=True)
+                         for i in range(self.threads)]
+        for worker in self._workers:
+            worker.start()
+        super().serve_forever(*args, **kwargs)
+
+    def process_request(self, request, client_address):
+        try:
+            self._requests.put_nowait((request, client_address))
+        except queue.Full:
+            try:
+                request.sendall(self._busy_response)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    def server_close(self):
+        # The queued connections are served before the threads stop
+        for worker in self._workers:
+            self._requests.put(None)
+        for worker in self._workers:
+            worker.join()
+        super().server_close()
+
+    def _process_requests(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                request.settimeout(self.connection_timeout)
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+
+class TracPooledHTTPServer(ThreadPoolMixIn, TracHTTPServer):
+
+    def __init__(self, server_address, application, env_parent_dir, env_paths,
+                 use_http_11=False, threads=10, queue_size=None,
+                 keep_alive_timeout=5):
+        self.threads = threads
+        self.queue_size = queue_size if queue_size is not None \
+                          else 4 * threads
+        self.keep_alive_timeout = keep_alive_timeout
+        TracHTTPServer.__init__(self, server_address, application,
+                                env_parent_dir, env_paths, use_http_11)
+
+
+class PreforkServer(object):
+    """Serve the requests of `httpd` from `processes` worker processes
+    forked from the current process, which accept the connections on the
+    listening socket they share.
+
+    The environments are loaded before forking, so that each worker
+    doesn't load them again. Each worker then checks whether they need
+    an upgrade, as some components start background threads when asked,
+    and threads don't survive a fork. On `SIGHUP`, the environments are reopened
+    and a new set of workers replaces the current one, which finishes
+    the requests in progress first. `SIGTERM` and `SIGINT` stop the
+    workers the same way, then the server.
+    """
+
+    _signals = {signal.SIGCHLD, signal.SIGHUP, signal.SIGINT,
+                signal.SIGTERM} if hasattr(signal, 'SIGHUP') else set()
+
+    def __init__(self, httpd, processes, env_paths=()):
+        self.httpd = httpd
+        self.processes = processes
+        self.env_paths = env_paths
+        self._workers = {}  # pid -> generation
+        self._generation = 0
+
+    def serve_forever(self):
+        signal.pthread_sigmask(signal.SIG_BLOCK, self._signals)
+        self._preload()
+        self._spawn(self.processes)
+        stopping = False
+        while self._workers or not stopping:
+            signum = signal.sigwaitinfo(self._signals).si_signo
+            if signum == signal.SIGCHLD:
+                self._reap(respawn=not stopping)
+            elif signum == signal.SIGHUP and not stopping:
+                printout("Reloading %d workers." % self.processes)
+                old_generation = self._generation
+                self._preload()
+                self._generation += 1
+                self._spawn(self.processes)
+                self._stop(old_generation)
+            elif not stopping:
+                printout("Stopping %d workers." % len(self._workers))
+                stopping = True
+                self._stop(self._generation)
+        self.httpd.server_close()
+
+    def _preload(self):
+        with env_cache_lock:
+            for env in env_cache.values():
+                env.shutdown()
+            env_cache.clear()
+            for env_path in self.env_paths:
+                try:
+                    env = Environment(env_path)
+                except Exception as e:
+                    printerr("Can't preload environment %s: %s"
+                             % (env_path, exception_to_unicode(e)))
+                    continue
+                env_cache[env_path] = env
+                # Each worker opens its own connections
+                RepositoryManager(env).shutdown()
+                DatabaseManager(env).shutdown()
+
+    def _check_preloaded(self):
+        with env_cache_lock:
+            for env_path, env in list(env_cache.items()):
+                try:
+                    needs_upgrade = env.needs_upgrade()
+                except Exception as e:
+                    env.log.error("Exception caught while checking for "
+                                  "upgrade: %s", exception_to_unicode(e))
+                    needs_upgrade = True
+                if needs_upgrade:
+                    # Reported to the users by `open_environment`
+                    env.shutdown()
+                    del env_cache[env_path]
+
+    def _spawn(self, count):
+        for i in range(count):
+            pid = os.fork()
+            if pid == 0:
+                self._run_worker()
+            self._workers[pid] = self._generation
+
+    def _run_worker(self):
+        status = 0
+        try:
+            def stop(signum, frame):
+                # shutdown() waits for serve_forever() to return, which
+                # runs in this thread.
+                threading.Thread(target=self.httpd.shutdown).start()
+            signal.signal(signal.SIGTERM, stop)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, self._signals)
+            self._check_preloaded()
+            try:
+                self.httpd.serve_forever()
+            finally:
+                self.httpd.server_close()
+        except BaseException as e:
+            printerr("Worker %s failed: %s" % (os.getpid(),
+                                               exception_to_unicode(e)))
+            status = 1
+        finally:
+            os._exit(status)
+
+    def _reap(self, respawn):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            generation = self._workers.pop(pid, None)
+            if respawn and generation == self._generation:
+                printerr("Worker %s exited with status %s, restarting."
+                         % (pid, os.waitstatus_to_exitcode(status)))
+                time.sleep(1)  # Don't loop on a worker failing to start
+                self._spawn(1)
+
+    def _stop(self, generation):
+        for pid, gen in list(self._workers.items()):
+            if gen <= generation:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+
+
 class TracHTTPRequestHandler(WSGIRequestHandler):
 
     server_version = 'tracd/' + VERSION
@@ -112,6 +340,17 @@ class TracHTTPRequestHandler(WSGIRequestHandler):
         # Disable reverse name lookups
         return self.client_address[:2][0]
 
+    def handle_one_request(self):
+        if self.server.keep_alive_timeout:
+            self.connection.settimeout(self.server.keep_alive_timeout)
+        super().handle_one_request()
+
+    def parse_request(self):
+        # Once the request line is read, wait longer for the rest
+        if self.server.keep_alive_timeout:
+            self.connection.settimeout(self.server.connection_timeout)
+        return super().parse_request()
+
 
 class TracHTTP11RequestHandler(TracHTTPRequestHandler):
     protocol_version = 'HTTP/1.1'
@@ -207,6 +446,20 @@ def parse_args(args=None):
                         help="the initial portion of the request URL's "
                              "\"path\"")
 
+    parser.add_argument('--threads', type=int, metavar='N',
+                        help="number of threads handling the connections in "
+                             "each process, 0 for a thread per connection "
+                             "(default: 0, or 10 with --processes)")
+    parser.add_argument('--queue-size', type=int, metavar='N',
+                        help="number of connections waiting for a thread "
+                             "before new ones are refused, 0 for no limit "
+                             "(default: 4 times the number of threads)")
+    parser.add_argument('--keep-alive-timeout', type=float, default=5,
+                        metavar='SECONDS',
+                        help="seconds a thread waits for the next request "
+                             "on an idle persistent connection, with "
+                             "--threads (default: 5)")
+
     parser_group = parser.add_mutually_exclusive_group()
     parser_group.add_argument('--http10', action='store_false', dest='http11',
                               help="use HTTP/1.0 protocol instead of "
@@ -271,12 +524,17 @@ def parse_args(args=None):
                             help="the group to run as")
         parser.add_argument('--user', action=_UserAction,
                             help="the user to run as")
+        parser.add_argument('--processes', type=int, default=1,
+                            metavar='N',
+                            help="number of worker processes sharing the "
+                                 "listening socket, reloaded on SIGHUP "
+                                 "(default: 1, serve from the main process)")
     else:
         parser.add_argument('-r', '--auto-reload', action='store_true',
                             help="restart automatically when sources are "
                                  "modified")
 
-    parser.set_defaults(daemonize=False, user=None, group=None)
+    parser.set_defaults(daemonize=False, user=None, group=None, processes=1)
     args = parser.parse_args(args)
 
     if not args.env_parent_dir and not args.envs:
@@ -288,6 +546,23 @@ def parse_args(args=None):
     if args.protocol == 'https' and not args.certfile:
         parser.error("the --certfile option is required when using the https "
                      "protocol")
+    if args.processes < 1:
+        parser.error("the --processes option must be at least 1")
+    if args.threads is not None and args.threads < 0 or \
+            args.queue_size is not None and args.queue_size < 0:
+        parser.error("the --threads and --queue-size options cannot be "
+                     "negative")
+    if args.keep_alive_timeout <= 0:
+        parser.error("the --keep-alive-timeout option must be positive")
+    if (args.processes > 1 or args.threads or args.queue_size is not None) \
+            and args.protocol not in ('http', 'https'):
+        parser.error("the --processes, --threads and --queue-size options "
+                     "can only be used with the http and https protocols")
+    if args.processes > 1 and args.auto_reload:
+        parser.error("the --processes option cannot be used with the "
+                     "--auto-reload (-r) option")
+    if args.threads is None:
+        args.threads = 10 if args.processes > 1 else 0
 
     if args.port is None:
         args.port = {
@@ -328,9 +603,16 @@ def main():
                 loc = '%s://%s:%s/%s' % (args.protocol, addr, port, base_path)
 
             try:
-                httpd = TracHTTPServer(server_address, wsgi_app,
-                                       args.env_parent_dir, args.envs,
-                                       use_http_11=args.http11)
+                if args.threads:
+                    httpd = TracPooledHTTPServer(
+                        server_address, wsgi_app, args.env_parent_dir,
+                        args.envs, use_http_11=args.http11,
+                        threads=args.threads, queue_size=args.queue_size,
+                        keep_alive_timeout=args.keep_alive_timeout)
+                else:
+                    httpd = TracHTTPServer(server_address, wsgi_app,
+                                           args.env_parent_dir, args.envs,
+                                           use_http_11=args.http11)
             except socket.error as e:
                 print("Error starting Trac server on %s" % loc)
                 print("[Errno %s] %s" % e.args)
@@ -340,12 +622,22 @@ def main():
             print("Serving on %s" % loc)
             if args.http11:
                 print("Using HTTP/1.1 protocol version")
+            if args.threads:
+                print("Using %d threads per process" % args.threads)
             if args.protocol == 'https':
                 httpd.socket = ssl.wrap_socket(httpd.socket, server_side=True,
                                                certfile=args.certfile,
                                                keyfile=args.keyfile)
                 httpd.environ['HTTPS'] = 'yes'
-            httpd.serve_forever()
+            if args.processes > 1:
+                print("Using %d worker processes" % args.processes)
+                env_paths = get_environments({
+                    'trac.env_paths': list(args.envs),
+                    'trac.env_parent_dir': args.env_parent_dir,
+                }).values()
+                PreforkServer(httpd, args.processes, env_paths).serve_forever()
+            else:
+                httpd.serve_forever()
     elif args.protocol in ('scgi', 'ajp', 'fcgi'):
         def serve():
             module = 'flup.server.%s' % args.protocol
@@ -59,6 +59,9 @@ class InterTracDispatcher(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/intertrac']
+
     def match_request(self, req):
         match = re.match(r'^/intertrac/(.*)', req.path_info)
         if match:
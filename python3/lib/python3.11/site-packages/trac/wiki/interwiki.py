@@ -17,7 +17,7 @@
 import re
 
 from trac.cache import cached
-from trac.config import ConfigSection
+from trac.config import ConfigSection, IConfigurationChangeListener
 from trac.core import *
 from trac.util import lazy
 from trac.util.html import tag
@@ -30,7 +30,8 @@ from trac.wiki.formatter import split_url_into_path_query_fragment
 class InterWikiMap(Component):
     """InterWiki map manager."""
 
-    implements(IWikiChangeListener, IWikiMacroProvider)
+    implements(IConfigurationChangeListener, IWikiChangeListener,
+               IWikiMacroProvider)
 
     interwiki_section = ConfigSection('interwiki',
         """Every option in the `[interwiki]` section defines one InterWiki
@@ -107,6 +108,14 @@ class InterWikiMap(Component):
                                target=target, name=title)
         return expanded_url, expanded_title
 
+    # IConfigurationChangeListener methods
+
+    def get_config_sections(self):
+        return ['interwiki']
+
+    def config_sections_changed(self, changes):
+        del self.interwiki_map
+
     # IWikiChangeListener methods
 
     def wiki_page_added(self, page):
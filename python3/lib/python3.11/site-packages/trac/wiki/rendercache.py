@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 Hewlett Packard Enterprise Development LP.
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at https://trac.edgewall.org/wiki/TracLicense.
+
+"""Cache of rendered wiki fragments.
+
+Ticket descriptions and comments, milestone descriptions and wiki pages
+are rendered again on every view although their text rarely changes.
+The rendered HTML is kept in a bounded LRU per process, keyed by a hash
+of the text and of everything in the rendering context that changes the
+output: the resource, the rendering hints, the base URL, the user and
+their permissions, the locale and the configuration. The rendered links
+depend on the state of tickets, milestones, wiki pages, attachments and
+changesets, so any change to those bumps the generation of the cache through the
+`CacheManager`, dropping the fragments in every process sharing the
+environment.
+
+Fragments evicted from memory can optionally be spilled to the `cache`
+directory of the environment, in one directory per generation.
+"""
+
+import collections
+import hashlib
+import os
+import shutil
+import threading
+
+from trac.attachment import IAttachmentChangeListener
+from trac.cache import cached
+from trac.config import BoolOption, IntOption
+from trac.core import Component, implements
+from trac.db.api import DatabaseManager
+from trac.perm import PermissionSystem
+from trac.ticket.api import IMilestoneChangeListener, ITicketChangeListener
+from trac.util import AtomicFile, read_file
+from trac.util.html import Markup
+from trac.versioncontrol.api import IRepositoryChangeListener
+from trac.wiki.api import IWikiChangeListener
+from trac.wiki.formatter import format_to_html, format_to_oneliner
+
+
+__all__ = ['RenderCache']
+
+
+class _Entries(collections.OrderedDict):
+    """Rendered fragments of one generation of the cache."""
+
+    def __init__(self, spill_dir=None):
+        super().__init__()
+        self.spill_dir = spill_dir
+        self.size = 0
+
+
+class RenderCache(Component):
+    """Cache the HTML rendered from wiki text until the next change of
+    the wiki pages, tickets, milestones, attachments or changesets it may
+    link to."""
+
+    implements(IAttachmentChangeListener, IMilestoneChangeListener,
+               IRepositoryChangeListener, ITicketChangeListener,
+               IWikiChangeListener)
+
+    size = IntOption('wiki', 'render_cache_size', 4096,
+        """Maximum size in kilobytes of the rendered wiki fragments kept
+        in memory by each process. Set to `0` to disable the cache.
+        Text calling macros or processors is always rendered again, as
+        their output may depend on other data. (''since 1.6'')""")
+
+    spill = BoolOption('wiki', 'render_cache_spill', False,
+        """Write the rendered wiki fragments evicted from memory to the
+        `cache` directory of the environment, and read them back from
+        there instead of rendering them again. The directory is emptied
+        whenever a change invalidates the cache. (''since 1.6'')""")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    # IAttachmentChangeListener methods
+
+    def attachment_added(self, attachment):
+        self.invalidate()
+
+    def attachment_deleted(self, attachment):
+        self.invalidate()
+
+    def attachment_moved(self, attachment, old_parent_realm, old_parent_id,
+                         old_filename):
+        self.invalidate()
+
+    # IMilestoneChangeListener methods
+
+    def milestone_created(self, milestone):
+        self.invalidate()
+
+    def milestone_changed(self, milestone, old_values):
+        self.invalidate()
+
+    def milestone_deleted(self, milestone):
+        self.invalidate()
+
+    # IRepositoryChangeListener methods
+
+    def changeset_added(self, repos, changeset):
+        self.invalidate()
+
+    def changeset_modified(self, repos, changeset, old_changeset):
+        self.invalidate()
+
+    # ITicketChangeListener methods
+
+    def ticket_created(self, ticket):
+        self.invalidate()
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        self.invalidate()
+
+    def ticket_deleted(self, ticket):
+        self.invalidate()
+
+    def ticket_comment_modified(self, ticket, cdate, author, comment,
+                                old_comment):
+        self.invalidate()
+
+    def ticket_change_deleted(self, ticket, cdate, changes):
+        self.invalidate()
+
+    # IWikiChangeListener methods
+
+    def wiki_page_added(self, page):
+        self.invalidate()
+
+    def wiki_page_changed(self, page, version, t, comment, author):
+        self.invalidate()
+
+    def wiki_page_deleted(self, page):
+        self.invalidate()
+
+    def wiki_page_version_deleted(self, page):
+        self.invalidate()
+
+    def wiki_page_renamed(self, page, old_name):
+        self.invalidate()
+
+    def wiki_page_comment_modified(self, page, old_comment):
+        pass
+
+    # Public API
+
+    def format_to_html(self, context, wikidom, escape_newlines=None):
+        """Cached equivalent of `trac.wiki.formatter.format_to_html`."""
+        if escape_newlines is None:
+            escape_newlines = context.get_hint('preserve_newlines', False)
+        return self.render('html', context, wikidom,
+                           lambda: format_to_html(self.env, context, wikidom,
+                                                  escape_newlines),
+                           escape_newlines)
+
+    def format_to_oneliner(self, context, wikidom, shorten=None):
+        """Cached equivalent of `trac.wiki.formatter.format_to_oneliner`."""
+        if shorten is None:
+            shorten = context.get_hint('shorten_lines', False)
+        return self.render('oneliner', context, wikidom,
+                           lambda: format_to_oneliner(self.env, context,
+                                                      wikidom, shorten),
+                           shorten)
+
+    def format_to(self, flavor, context, wikidom, **options):
+        """Cached equivalent of `trac.wiki.formatter.format_to`."""
+        if flavor is None:
+            flavor = context.get_hint('wiki_flavor', 'html')
+        if flavor == 'oneliner':
+            return self.format_to_oneliner(context, wikidom, **options)
+        else:
+            return self.format_to_html(context, wikidom, **options)
+
+    def render(self, flavor, context, text, render, *options):
+        """Return the `Markup` rendered by `render()` from the wiki
+        `text` in `context`, using the cached fragment if possible.
+
+        `flavor` and `options` identify the renderer and its arguments,
+        so that different renderings of the same text are kept apart
+        (e.g. `'markdown'` for text rendered by a plugin).
+        """
+        if not text or not isinstance(text, str) or self.size <= 0 or \
+                '[[' in text or '#!' in text or \
+                DatabaseManager(self.env).in_transaction:
+            return render()
+        key = self._make_key(flavor, context, text, options)
+        # A fragment rendered while a change invalidates the cache goes
+        # to the entries of the previous generation, which are dropped.
+        entries = self._entries
+        with self._lock:
+            html = entries.get(key)
+            if html is not None:
+                entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return Markup(html)
+        html = self._read_spilled(entries, key)
+        if html is not None:
+            self._stats['spill_hits'] += 1
+        else:
+            self._stats['misses'] += 1
+            html = render()
+        self._store(entries, key, str(html))
+        return Markup(html)
+
+    def invalidate(self):
+        """Drop the cached fragments in all processes, once the current
+        transaction, if any, is committed."""
+        DatabaseManager(self.env).call_after_commit(self._invalidate)
+
+    @property
+    def stats(self):
+        """Hit, miss, spill hit and eviction counters of this process,
+        plus the current number and size in bytes of the fragments."""
+        stats = dict.fromkeys(('hits', 'misses', 'spill_hits', 'evictions'),
+                              0)
+        stats.update(self._stats)
+        entries = self._entries
+        stats['entries'] = len(entries)
+        stats['bytes'] = entries.size
+        return stats
+
+    # Internal methods
+
+    def _invalidate(self):
+        del self._entries
+
+    @cached
+    def _entries(self):
+        # Called again whenever the generation of the cache changed.
+        spill_dir = None
+        if self.spill:
+            for generation, in self.env.db_query("""
+                    SELECT generation FROM cache WHERE id=%s
+                    """, (type(self)._entries.id,)):
+                break
+            else:
+                generation = 0
+            root = os.path.join(self.env.cache_dir, 'wiki')
+            spill_dir = os.path.join(root, str(generation))
+            self._remove_spilled(root, generation)
+        return _Entries(spill_dir)
+
+    def _make_key(self, flavor, context, text, options):
+        h = hashlib.sha1()
+        def update(value):
+            h.update(repr(value).encode('utf-8'))
+            h.update(b'\0')
+        update((flavor, options, self.config._lastmtime))
+        update(context.href.base if context.href else None)
+        req = getattr(context, 'req', None)
+        update(req.locale if req else None)
+        perm = context.perm
+        if perm is not None:
+            update(perm.username)
+            update(sorted(PermissionSystem(self.env)
+                          .get_permission_set(perm.username)))
+        ctx = context
+        while ctx is not None:
+            update(ctx.resource)
+            update(sorted(ctx._hints.items()) if ctx._hints else None)
+            ctx = ctx.parent
+        h.update(text.encode('utf-8'))
+        return h.hexdigest()
+
+    def _store(self, entries, key, html):
+        limit = self.size * 1024
+        evicted = []
+        with self._lock:
+            if key not in entries:
+                entries[key] = html
+                entries.size += len(html)
+            while entries.size > limit:
+                old_key, old_html = entries.popitem(last=False)
+                entries.size -= len(old_html)
+                evicted.append((old_key, old_html))
+                self._stats['evictions'] += 1
+        if entries.spill_dir:
+            for old_key, old_html in evicted:
+                self._spill(entries.spill_dir, old_key, old_html)
+
+    def _spill(self, spill_dir, key, html):
+        try:
+            os.makedirs(spill_dir, exist_ok=True)
+            with AtomicFile(os.path.join(spill_dir, key + '.html')) as f:
+                f.write(html)
+        except OSError as e:
+            self.log.warning("Can't spill rendered wiki fragment to %s: %s",
+                             spill_dir, e)
+
+    def _read_spilled(self, entries, key):
+        if not entries.spill_dir:
+            return None
+        try:
+            return read_file(os.path.join(entries.spill_dir, key + '.html'))
+        except OSError:
+            return None
+
+    def _remove_spilled(self, root, generation):
+        # Fragments of older generations are stale; newer ones belong to
+        # processes which already saw a later change.
+        try:
+            names = os.listdir(root)
+        except OSError:
+            return
+        for name in names:
+            if name.isdigit() and int(name) < generation:
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
@@ -28,6 +28,9 @@ class WikiRenderer(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/wiki_render']
+
     def match_request(self, req):
         return req.path_info == '/wiki_render'
 
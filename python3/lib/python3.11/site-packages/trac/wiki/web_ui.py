@@ -26,6 +26,7 @@ from trac.mimeview.api import IContentConverter, Mimeview
 from trac.perm import IPermissionPolicy, IPermissionRequestor
 from trac.resource import *
 from trac.search import ISearchSource, search_to_sql, shorten_result
+from trac.search.index import SearchIndex
 from trac.timeline.api import ITimelineEventProvider
 from trac.util import as_int, get_reporter_id
 from trac.util.datefmt import from_utimestamp, to_utimestamp
@@ -99,6 +100,9 @@ class WikiModule(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return ['/wiki']
+
     def match_request(self, req):
         match = re.match(r'/wiki(?:/(.+))?$', req.path_info)
         if match:
@@ -800,10 +804,35 @@ class WikiModule(Component):
     def get_search_results(self, req, terms, filters):
         if 'wiki' not in filters:
             return
+        wiki_realm = Resource(self.realm)
+        hits = SearchIndex(self.env).search(terms, self.realm)
+        if hits is not None:
+            results = self._get_indexed_search_results(req, hits)
+        else:
+            results = self._get_sql_search_results(req, terms)
+        for result in results:
+            yield result
+
+        # Attachments
+        for result in AttachmentModule(self.env).get_search_results(
+                req, wiki_realm, terms):
+            yield result
+
+    def _get_indexed_search_results(self, req, hits):
+        wiki_realm = Resource(self.realm)
+        for name, parent_realm, parent_id, title, text, author, ts, score, \
+                snippet in hits:
+            page = wiki_realm(id=name)
+            if 'WIKI_VIEW' in req.perm(page):
+                yield (get_resource_url(self.env, page, req.href),
+                       '%s: %s' % (name, shorten_line(text)),
+                       from_utimestamp(ts), author, snippet, score)
+
+    def _get_sql_search_results(self, req, terms):
+        wiki_realm = Resource(self.realm)
         with self.env.db_query as db:
             sql_query, args = search_to_sql(db, ['w1.name', 'w1.author',
                                                  'w1.text'], terms)
-            wiki_realm = Resource(self.realm)
             for name, ts, author, text in db("""
                     SELECT w1.name, w1.time, w1.author, w1.text
                     FROM wiki w1,(SELECT name, max(version) AS ver
@@ -817,11 +846,6 @@ class WikiModule(Component):
                            from_utimestamp(ts), author,
                            shorten_result(text, terms))
 
-        # Attachments
-        for result in AttachmentModule(self.env).get_search_results(
-                req, wiki_realm, terms):
-            yield result
-
 
 class DefaultWikiPolicy(Component):
     """Default permission policy for the wiki system.
@@ -844,3 +868,11 @@ class DefaultWikiPolicy(Component):
                 page = WikiPage(self.env, resource)
                 if page.readonly and 'WIKI_ADMIN' not in perm(resource):
                     return False
+
+    def check_permissions(self, action, username, resources, perm):
+        if action not in ('WIKI_CHANGE_READONLY', 'WIKI_DELETE',
+                          'WIKI_MODIFY', 'WIKI_RENAME'):
+            return [None] * len(resources)
+        return [self.check_permission(action, username, resource,
+                                      perm(resource))
+                for resource in resources]
@@ -141,12 +141,28 @@ class AuthzPolicy(Component):
     # IPermissionPolicy methods
 
     def check_permission(self, action, username, resource, perm):
+        return self.check_permissions(action, username, [resource], perm)[0]
+
+    def check_permissions(self, action, username, resources, perm):
         if not self.authz_mtime or \
                 os.path.getmtime(self.authz_file) != self.authz_mtime:
             self.parse_authz()
-        resource_key = self.normalise_resource(resource)
-        self.log.debug('Checking %s on %s', action, resource_key)
-        permissions = self.authz_permissions(resource_key, username)
+        # Resources usually match a few sections, decide once per section.
+        decisions = {}
+        results = []
+        for resource in resources:
+            resource_key = self.normalise_resource(resource)
+            self.log.debug('Checking %s on %s', action, resource_key)
+            permissions = self.authz_permissions(resource_key, username)
+            key = tuple(permissions) if permissions is not None else None
+            if key not in decisions:
+                decisions[key] = self._decide(action, permissions)
+            results.append(decisions[key])
+        return results
+
+    # Internal methods
+
+    def _decide(self, action, permissions):
         if permissions is None:
             return None                 # no match, can't decide
         elif permissions == []:
@@ -163,8 +179,6 @@ class AuthzPolicy(Component):
 
         return None                     # no match for action, can't decide
 
-    # Internal methods
-
     def parse_authz(self):
         self.log.debug("Parsing authz security policy %s",
                        self.authz_file)
@@ -73,6 +73,9 @@ class TicketDeleter(Component):
 
     # IRequestHandler methods
 
+    def get_request_routes(self):
+        return []
+
     def match_request(self, req):
         return False
 